@@ -1,43 +1,328 @@
-import pymongo
-import time_helpers
-import twitter_helpers
-import openai_helpers
-import datetime
-import pytz
+import atexit
+import sys
+import startup_helpers
+#--profile-startup has to be seen before the imports below to time them
+if '--profile-startup' in sys.argv:
+    startup_helpers.enable()
 import os
-from dotenv import load_dotenv
+import argparse
+import config_helpers
+import twitter_helpers
 import q_helpers
+import daemon_helpers
+import qtable_helpers
+import replay_helpers
+import action_log_helpers
+import candidate_helpers
+import rate_limit_helpers
+import tweet_buffer_helpers
+import metrics_helpers
+import storage_helpers
+import follow_graph_helpers
+import snapshot_helpers
+import dedup_helpers
+import cache_helpers
+import policy_helpers
+import multi_account_helpers
 
-load_dotenv()
-
-mongo_client = pymongo.MongoClient(os.getenv('MONGO_PASS'), tlsInsecure=True)
-
-#get Twitter info
-twitter_ck = os.getenv('TWITTER_CONSUMER_KEY')
-twitter_cs = os.getenv('TWITTER_CONSUMER_SECRET')
-twitter_at = os.getenv('TWITTER_ACCESS_TOKEN')
-twitter_ats = os.getenv('TWITTER_ACCESS_TOKEN_SECRET')
-twitter_bt = os.getenv('TWITTER_BEARER_TOKEN')
-client_bearer = twitter_helpers.generate_client(bt_present=True,bearer_token= twitter_bt)
-client = twitter_helpers.generate_client(twitter_ck, twitter_cs, twitter_at, twitter_ats)
-username = 'motivater247'
-
-#OpenAI API access info preparation
-openai_key = os.getenv('OPENAI_KEY')
-
-
-
-db = mongo_client['Qbase']
-
-#instantite the MongoDB Qtable
-qtable = db.qtable
-#instantiate MongoDB action table
-action_table = db.action_table
 alpha = 0.1
 gamma = 0.9
 epsilon = 0.8
-q_helpers.get_results(qtable,action_table,alpha,gamma,epsilon,client,client_bearer,openai_key,username)
-q_helpers.execute_action(qtable,action_table,alpha,gamma,epsilon,client,client_bearer,openai_key,username)
+username = 'motivater247'
+#age in days after which action log rows are rolled up into action_rollups, None keeps them forever
+archive_after_days = None
+#local index of the accounts already followed, synced from the following list
+follow_index_path = 'following.npz'
+#directory of the per-cycle engagement snapshots used for delayed reward attribution
+snapshot_dir = 'snapshots'
+#MinHash signatures of the posted tweets, used to reject near-duplicate tweets
+tweet_signatures_path = 'tweet_signatures.bin'
+#actions planned and performed per cycle, within planner_helpers.DEFAULT_BUDGET
+actions_per_cycle = 1
+#exploration policy, one of policy_helpers.POLICIES. 'epsilon' keeps the fixed epsilon above
+exploration_policy = 'epsilon'
+
+def setup(metrics_path = None, storage = 'mongo', storage_path = 'qbase.jsonl', account = None, shared = None):
+    """
+    Builds everything a bot cycle needs: the Twitter clients, the OpenAI key and the database collections. In daemon
+    mode this runs once, so the clients and the MongoDB connection pool are reused by every cycle.
+
+    Args:
+        metrics_path (str, optional): File the timing metrics are exported to after every cycle. Instrumentation
+            stays off when None.
+        storage (str): 'mongo' to keep the Q-table and logs in the MongoDB cluster, 'file' to keep them in an
+            embedded database file on this host.
+        storage_path (str): The database file used when storage is 'file'.
+        account (dict, optional): The account to run, as read by multi_account_helpers.load_accounts. Its
+            collections are prefixed and its local files are kept under a directory named after its namespace,
+            and its credentials are read from the environment variables starting with its env_prefix. The
+            module level username and file names are used when None.
+        shared (dict, optional): Caches shared with the other accounts of the process.
+
+    Returns:
+        dict: The clients, collections and credentials used by run_cycle.
+    """
+    with startup_helpers.phase('config'):
+        config_helpers.load()
+    account = account or {}
+    shared = shared or {}
+    namespace = account.get('namespace')
+    env_prefix = account.get('env_prefix', '')
+    def local_path(path):
+        #each account keeps its local indexes and snapshots in its own directory
+        return os.path.join(namespace, path) if namespace else path
+    if namespace:
+        os.makedirs(namespace, exist_ok = True)
+
+    with startup_helpers.phase('storage'):
+        if metrics_path is not None:
+            metrics_helpers.enable()
+        if storage == 'mongo':
+            event_listeners = [metrics_helpers.MongoCommandListener()] if metrics_path is not None else []
+            db, storage_handle = storage_helpers.open_database('mongo', mongo_uri=config_helpers.get('MONGO_PASS'), tlsInsecure=True, event_listeners=event_listeners)
+        else:
+            db, storage_handle = storage_helpers.open_database(storage, local_path(storage_path))
+        collection_prefix = namespace + '_' if namespace else ''
+        def collection(name):
+            return db[collection_prefix + name]
+
+    with startup_helpers.phase('clients'):
+        #get Twitter info
+        twitter_ck = config_helpers.get(env_prefix + 'TWITTER_CONSUMER_KEY')
+        twitter_cs = config_helpers.get(env_prefix + 'TWITTER_CONSUMER_SECRET')
+        twitter_at = config_helpers.get(env_prefix + 'TWITTER_ACCESS_TOKEN')
+        twitter_ats = config_helpers.get(env_prefix + 'TWITTER_ACCESS_TOKEN_SECRET')
+        twitter_bt = config_helpers.get(env_prefix + 'TWITTER_BEARER_TOKEN')
+        client_bearer = twitter_helpers.generate_client(bt_present=True,bearer_token= twitter_bt)
+        client = twitter_helpers.generate_client(twitter_ck, twitter_cs, twitter_at, twitter_ats)
+        #every Twitter call goes through one limiter that tracks the quota of each endpoint
+        rate_limiter = rate_limit_helpers.RateLimiter()
+        client_bearer = rate_limiter.wrap(metrics_helpers.instrument(client_bearer, 'twitter_bearer'))
+        client = rate_limiter.wrap(metrics_helpers.instrument(client, 'twitter'))
+        #reads are answered once per cycle, writes on either client drop the reads they make stale
+        response_cache = cache_helpers.ResponseCache()
+        client_bearer = response_cache.wrap(client_bearer)
+        client = response_cache.wrap(client)
+
+        #OpenAI API access info preparation
+        openai_key = config_helpers.get(env_prefix + 'OPENAI_KEY')
+
+    #loads the Q-table and the local indexes
+    with startup_helpers.phase('state'):
+        action_table = collection('action_table')
+        action_log_helpers.ensure_indexes(action_table)
+        duplicate_index = dedup_helpers.DuplicateIndex(local_path(tweet_signatures_path))
+
+        bot = {
+            #the MongoClient or embedded database, closed at shutdown
+            'storage': storage_handle,
+            'metrics_path': metrics_path,
+            'client': client,
+            'client_bearer': client_bearer,
+            'rate_limiter': rate_limiter,
+            'response_cache': response_cache,
+            'openai_key': openai_key,
+            'username': account.get('username', username),
+            #load the MongoDB Qtable into memory, changes are written back by flush
+            'qtable': qtable_helpers.QTable(collection('qtable')),
+            #instantiate MongoDB action table
+            'action_table': action_table,
+            #instantiate MongoDB per-tweet engagement metrics
+            'metrics_table': collection('tweet_metrics'),
+            #collection the offline trainer writes its Q-table to
+            'replay_table': collection('qtable_replay'),
+            #daily per state/action rollups of archived action log rows
+            'rollup_table': collection('action_rollups'),
+            #searched tweets shared by the like, retweet and follow actions
+            'candidate_pool': candidate_helpers.CandidatePool(client_bearer, acted_table = collection('acted_candidates'), pools = shared.get('search_pools'), pool_table = collection('candidate_pools')),
+            #generated tweets waiting to be posted, refilled in batches
+            'tweet_buffer': tweet_buffer_helpers.TweetBuffer(collection('tweet_buffer'), openai_key, duplicate_index = duplicate_index),
+            #posted tweets, so near-duplicates are regenerated instead of posted
+            'duplicate_index': duplicate_index,
+            'duplicates_backfilled': False,
+            #accounts already followed or attempted, so follows skip them without an API call
+            'follow_index': follow_graph_helpers.FollowIndex(local_path(follow_index_path)),
+            #id of the bot's account, looked up by the first follow index sync
+            'user_id': None,
+            #per-tweet and account engagement recorded every cycle
+            'snapshot_store': snapshot_helpers.SnapshotStore(local_path(snapshot_dir)),
+            'actions_per_cycle': account.get('actions_per_cycle', actions_per_cycle),
+            #chooses the actions from the Q-table and the reward statistics stored with it
+            'policy': policy_helpers.make_policy(account.get('policy', exploration_policy), epsilon),
+        }
+    return bot
+
+def run_cycle(bot):
+    """
+    Runs one bot cycle: learns from the previous action, then chooses and performs the next one.
+
+    Args:
+        bot (dict): The clients and collections built by setup.
+    """
+    try:
+        with metrics_helpers.span('cycle'), bot['response_cache'].cycle():
+            learn_and_act(bot)
+    finally:
+        if bot['metrics_path'] is not None:
+            metrics_helpers.export(bot['metrics_path'])
+
+def learn_and_act(bot):
+    """
+    Learns from the previous action, then chooses and performs the next one.
+
+    Args:
+        bot (dict): The clients and collections built by setup.
+    """
+    sync_indexes(bot)
+    q_helpers.get_results(bot['qtable'],bot['action_table'],alpha,gamma,epsilon,bot['client'],bot['client_bearer'],bot['openai_key'],bot['username'],bot['metrics_table'],snapshot_store = bot['snapshot_store'])
+    if bot['actions_per_cycle'] > 1:
+        q_helpers.execute_actions(bot['qtable'],bot['action_table'],alpha,gamma,epsilon,bot['client'],bot['client_bearer'],bot['openai_key'],bot['username'],bot['actions_per_cycle'],metrics_table = bot['metrics_table'],candidate_pool = bot['candidate_pool'],rate_limiter = bot['rate_limiter'],tweet_buffer = bot['tweet_buffer'],follow_index = bot['follow_index'],snapshot_store = bot['snapshot_store'],duplicate_index = bot['duplicate_index'],policy = bot['policy'])
+    else:
+        q_helpers.execute_action(bot['qtable'],bot['action_table'],alpha,gamma,epsilon,bot['client'],bot['client_bearer'],bot['openai_key'],bot['username'],bot['metrics_table'],candidate_pool = bot['candidate_pool'],rate_limiter = bot['rate_limiter'],tweet_buffer = bot['tweet_buffer'],follow_index = bot['follow_index'],snapshot_store = bot['snapshot_store'],duplicate_index = bot['duplicate_index'],policy = bot['policy'])
+    flush_qtable(bot, due = True)
+    bot['follow_index'].save()
+    if archive_after_days is not None:
+        action_log_helpers.archive_old_actions(bot['action_table'], bot['rollup_table'], archive_after_days)
+
+def flush_qtable(bot, due = False):
+    """
+    Writes the changed Q-table rows back to the database. Rows another process changed since they were read are
+    not overwritten: the flush re-reads them, dropping this process's updates of those rows, and the conflict is
+    reported and counted, so the cycle carries on from the other writer's values.
+
+    Args:
+        bot (dict): The clients and collections built by setup.
+        due (bool): Only flush when the flush interval of the Q-table has passed.
+    """
+    try:
+        if due:
+            bot['qtable'].flush_if_due()
+        else:
+            bot['qtable'].flush()
+    except qtable_helpers.StaleQTableError as error:
+        metrics_helpers.increment('qtable_conflicts_total')
+        print('qtable flush skipped: ' + str(error) + ', reloaded from the database')
+
+def sync_indexes(bot):
+    """
+    Brings the follow index up to date with the account's following list when its sync interval has passed. The
+    first sync reads the whole list, later ones usually a single page. An empty duplicate index is filled once
+    from the tweets already on the timeline. A failed sync is reported and retried on the next cycle, the indexes
+    keep working from what they already know.
+
+    Args:
+        bot (dict): The clients and collections built by setup.
+    """
+    import tweepy
+    try:
+        if bot['user_id'] is None:
+            bot['user_id'] = twitter_helpers.get_user(bot['client_bearer'], bot['username']).data.data['id']
+        added = bot['follow_index'].sync_if_due(bot['client_bearer'], bot['user_id'])
+        if added:
+            print('follow index: ' + str(added) + ' followed accounts added')
+        if not bot['duplicates_backfilled']:
+            if len(bot['duplicate_index']) == 0:
+                print('duplicate index: ' + str(bot['duplicate_index'].backfill(bot['client_bearer'], bot['user_id'])) + ' posted tweets indexed')
+            bot['duplicates_backfilled'] = True
+    except (tweepy.TweepyException, rate_limit_helpers.QuotaExhausted) as error:
+        print('index sync failed: ' + str(error))
+
+def replay(bot, epochs, reward_window = None):
+    """
+    Recomputes the Q-table offline from the whole action log and writes it to the qtable_replay collection,
+    leaving the live qtable untouched.
+
+    Args:
+        bot (dict): The clients and collections built by setup.
+        epochs (int): The number of sweeps over the action log.
+        reward_window (float, optional): When given, each action is rewarded with the engagement attributed to it
+            within this many seconds, from the snapshot store, instead of the interaction delta to the next action.
+    """
+    q_values, states, actions = replay_helpers.train_from_log(bot['action_table'], alpha, gamma, epochs, snapshot_store = bot['snapshot_store'], reward_window = reward_window)
+    replay_helpers.write_qtable(bot['replay_table'], q_values, states, actions)
+    print('wrote ' + str(len(states)) + ' states to ' + bot['replay_table'].name)
+
+def shutdown(bot):
+    """
+    Writes pending Q-table changes back to the database, waits for background tweet generation and releases the
+    resources held by the bot.
+
+    Args:
+        bot (dict): The clients and collections built by setup.
+    """
+    try:
+        bot['tweet_buffer'].wait()
+        flush_qtable(bot)
+        bot['follow_index'].save()
+    finally:
+        bot['storage'].close()
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Q-learning Twitter bot')
+    parser.add_argument('--daemon', action = 'store_true', help = 'keep running and schedule cycles instead of running a single cycle')
+    parser.add_argument('--interval', type = float, default = 3600, help = 'seconds between the start of two cycles in daemon mode')
+    parser.add_argument('--jitter', type = float, default = 300, help = 'maximum random seconds added to or removed from each interval')
+    parser.add_argument('--replay', action = 'store_true', help = 'recompute the Q-table from the whole action log into qtable_replay and exit')
+    parser.add_argument('--replay-epochs', type = int, help = 'number of sweeps over the action log in replay mode, 50 by default')
+    parser.add_argument('--reward-window', type = float, help = 'in replay mode, reward each action with the engagement attributed to it within this many hours')
+    parser.add_argument('--metrics', help = 'export timing metrics to this file after every cycle, in the Prometheus text format if it ends in .prom and as JSON lines otherwise')
+    parser.add_argument('--actions', type = int, default = actions_per_cycle, help = 'number of actions planned and performed per cycle')
+    parser.add_argument('--policy', choices = policy_helpers.POLICIES, default = exploration_policy, help = 'exploration policy: fixed epsilon-greedy, epsilon decaying per time bucket, UCB1 or Thompson sampling')
+    parser.add_argument('--storage', choices = ['mongo', 'file'], default = 'mongo', help = 'keep the Q-table and logs in MongoDB or in an embedded database file')
+    parser.add_argument('--storage-path', default = 'qbase.jsonl', help = 'database file used with --storage file')
+    parser.add_argument('--accounts', help = 'JSON file listing several accounts to run at once, each with its own Q-table and logs')
+    parser.add_argument('--workers', type = int, help = 'number of worker processes the accounts are spread over, one per CPU by default')
+    parser.add_argument('--host-index', type = int, default = 0, help = 'index of this host when the accounts are spread over several hosts')
+    parser.add_argument('--host-count', type = int, default = 1, help = 'number of hosts the accounts are spread over')
+    parser.add_argument('--profile-startup', action = 'store_true', help = 'print the time spent importing each module and initializing the bot when the process exits')
+    args = parser.parse_args()
+    if args.profile_startup:
+        #lazy imports made by the first cycles show up in the report too
+        atexit.register(startup_helpers.report)
+
+    #replay works on the collections of a single account, and the sharding flags only mean something with --accounts
+    if args.accounts:
+        for flag, value in (('--replay', args.replay), ('--replay-epochs', args.replay_epochs), ('--reward-window', args.reward_window)):
+            if value:
+                parser.error(flag + ' cannot be used with --accounts')
+    else:
+        for flag, value in (('--workers', args.workers), ('--host-index', args.host_index), ('--host-count', args.host_count != 1)):
+            if value:
+                parser.error(flag + ' requires --accounts')
+    if args.replay and args.daemon:
+        parser.error('--daemon cannot be used with --replay')
+    if not args.replay:
+        for flag, value in (('--replay-epochs', args.replay_epochs), ('--reward-window', args.reward_window)):
+            if value is not None:
+                parser.error(flag + ' requires --replay')
+
+    if args.accounts:
+        accounts = multi_account_helpers.load_accounts(args.accounts)
+        for account in accounts:
+            account.setdefault('actions_per_cycle', args.actions)
+            account.setdefault('policy', args.policy)
+        options = {'metrics_path': args.metrics, 'storage': args.storage, 'storage_path': args.storage_path}
+        multi_account_helpers.run(accounts, setup, run_cycle, shutdown, workers = args.workers, options = options, interval = args.interval, jitter = args.jitter, cycles = None if args.daemon else 1, host_index = args.host_index, host_count = args.host_count)
+        return
+
+    bot = setup(args.metrics, args.storage, args.storage_path)
+    bot['actions_per_cycle'] = args.actions
+    bot['policy'] = policy_helpers.make_policy(args.policy, epsilon)
+    if args.replay:
+        try:
+            replay(bot, args.replay_epochs or 50, args.reward_window * 3600 if args.reward_window is not None else None)
+        finally:
+            shutdown(bot)
+    elif args.daemon:
+        daemon_helpers.run_forever(lambda: run_cycle(bot), args.interval, args.jitter, on_shutdown = lambda: shutdown(bot))
+    else:
+        try:
+            run_cycle(bot)
+        finally:
+            shutdown(bot)
+
+if __name__ == '__main__':
+    main()
 
 
  
@@ -0,0 +1,141 @@
+import datetime
+
+# pymongo, bson and pytz are imported where they are used, so importing this module stays cheap
+ASCENDING = 1
+DESCENDING = -1
+# The order actions were logged in: the rows of a batch share a datetime and are told apart by their position
+LOG_ORDER = [('datetime', ASCENDING), ('position', ASCENDING)]
+LATEST_FIRST = [('datetime', DESCENDING), ('position', DESCENDING)]
+
+def now():
+    """
+    Returns the current America/New_York time, the timestamp of logged actions. sim_helpers.simulated points it at
+    the simulated clock.
+    """
+    import pytz
+    return datetime.datetime.now(pytz.timezone('America/New_York'))
+
+def ensure_indexes(action_table):
+    """
+    Creates the indexes the action log is queried with: one on datetime and position, used to find the latest
+    action and to read the log in order, one on datetime alone, used by the archive, and a compound index on
+    state and action.
+
+    Args:
+        action_table (pymongo.collection.Collection): The MongoDB collection that stores previous actions.
+    """
+    action_table.create_index([('datetime', ASCENDING)], name = 'datetime_1')
+    action_table.create_index(LOG_ORDER, name = 'datetime_1_position_1')
+    action_table.create_index([('state', ASCENDING), ('action', ASCENDING)], name = 'state_1_action_1')
+
+def latest_action(action_table):
+    """
+    Returns the most recently logged action, or None if the log is empty. Uses the datetime index, so the cost
+    does not grow with the size of the log.
+    """
+    return action_table.find_one({}, sort = LATEST_FIRST)
+
+def record_action(action_table, state, action, interaction_count, **fields):
+    """
+    Appends an action to the log, timestamped in the America/New_York timezone.
+
+    Args:
+        action_table (pymongo.collection.Collection): The MongoDB collection that stores previous actions.
+        state (str): The time bucket the action was taken in.
+        action (str): The action that was performed.
+        interaction_count (int): The interaction count of the account when the action was taken.
+        **fields: Extra fields stored with the action.
+
+    Returns:
+        dict: The inserted document.
+    """
+    doc = {'datetime': now(), 'state': state, 'action': action, 'interactions': interaction_count}
+    doc.update(fields)
+    action_table.insert_one(doc)
+    return doc
+
+def record_actions(action_table, state, actions, interaction_count, fields = None):
+    """
+    Appends a batch of actions taken in the same cycle to the log with a single insert. The rows share a batch id,
+    the batch size and the timestamp of the cycle, and keep their order in a position field.
+
+    Args:
+        action_table (pymongo.collection.Collection): The MongoDB collection that stores previous actions.
+        state (str): The time bucket the actions were taken in.
+        actions (list): The actions that were performed, in order.
+        interaction_count (int): The interaction count of the account before the batch.
+        fields (list, optional): Extra fields stored with each action, one dictionary per action.
+
+    Returns:
+        list: The inserted documents.
+    """
+    import bson
+    logged_at = now()
+    batch = bson.ObjectId()
+    docs = []
+    for position, action in enumerate(actions):
+        doc = {'datetime': logged_at, 'position': position, 'state': state, 'action': action, 'interactions': interaction_count, 'batch': batch, 'batch_size': len(actions)}
+        if fields is not None:
+            doc.update(fields[position])
+        docs.append(doc)
+    if docs:
+        action_table.insert_many(docs)
+    return docs
+
+def latest_batch(action_table, latest = None):
+    """
+    Returns the actions of the most recent cycle: the latest action alone, or every action of its batch when it
+    was logged by record_actions. The batch is read through the datetime and position index, newest first.
+    """
+    if latest is None:
+        latest = latest_action(action_table)
+        if latest is None:
+            return []
+    if latest.get('batch_size', 1) <= 1:
+        return [latest]
+    recent = action_table.find({}, sort = LATEST_FIRST).limit(latest['batch_size'])
+    return [doc for doc in recent if doc.get('batch') == latest['batch']]
+
+def archive_old_actions(action_table, rollup_table, older_than_days):
+    """
+    Moves log rows older than older_than_days into compact daily rollups and deletes them from the log. Each
+    rollup document covers one state, action and America/New_York day, and holds the number of actions and the
+    lowest and highest interaction counts seen.
+
+    Only whole days are archived: the cutoff is the start of the day older_than_days ago, so every row of a day is
+    rolled up by the same run and a rollup, once written, is final. Rollups are written with $setOnInsert, so a
+    run interrupted between writing the rollups and deleting the rows only deletes the rows the next time,
+    without counting them twice.
+
+    Args:
+        action_table (pymongo.collection.Collection): The MongoDB collection that stores previous actions.
+        rollup_table (pymongo.collection.Collection): The MongoDB collection that stores the rollups.
+        older_than_days (float): The age in days after which a row is archived.
+
+    Returns:
+        int: The number of log rows deleted.
+    """
+    import pymongo
+    import pytz
+    timezone = pytz.timezone('America/New_York')
+    day = (now() - datetime.timedelta(days = older_than_days)).date()
+    cutoff = timezone.localize(datetime.datetime.combine(day, datetime.time())).astimezone(datetime.timezone.utc)
+    pipeline = [
+        {'$match': {'datetime': {'$lt': cutoff}}},
+        {'$group': {
+            '_id': {'state': '$state', 'action': '$action', 'day': {'$dateToString': {'format': '%Y-%m-%d', 'date': '$datetime', 'timezone': 'America/New_York'}}},
+            'count': {'$sum': 1},
+            'min_interactions': {'$min': '$interactions'},
+            'max_interactions': {'$max': '$interactions'},
+        }},
+    ]
+    operations = []
+    for group in action_table.aggregate(pipeline):
+        operations.append(pymongo.UpdateOne(
+            group['_id'],
+            {'$setOnInsert': {'count': group['count'], 'min_interactions': group['min_interactions'], 'max_interactions': group['max_interactions']}},
+            upsert = True))
+    if not operations:
+        return 0
+    rollup_table.bulk_write(operations, ordered = False)
+    return action_table.delete_many({'datetime': {'$lt': cutoff}}).deleted_count
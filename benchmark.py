@@ -0,0 +1,185 @@
+import argparse
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import threading
+import time
+import numpy as np
+import action_log_helpers
+import cache_helpers
+import q_helpers
+import qtable_helpers
+import sim_helpers
+
+SCENARIOS = {
+    'new_account': 0,
+    'tweets_100': 100,
+    'tweets_10k': 10000,
+}
+
+def payload_size(value):
+    """
+    Estimates the number of bytes a response carried by serializing its data the way the API sends it, as JSON.
+    """
+    def convert(item):
+        if isinstance(item, sim_helpers.SimTweet):
+            return item.data
+        if hasattr(item, 'data'):
+            return convert(item.data)
+        if isinstance(item, (list, tuple)):
+            return [convert(element) for element in item]
+        return item
+    return len(json.dumps(convert(getattr(value, 'data', value)), default = str))
+
+class RecordingClient:
+    """
+    Proxy of a client that counts the calls and response bytes of every method, by method name. The calls of a
+    cycle are fanned out over several threads, so the counts are updated under a lock.
+    """
+    def __init__(self, client, stats):
+        self.client = client
+        self.stats = stats
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+        def recorded(*args, **kwargs):
+            response = attribute(*args, **kwargs)
+            size = payload_size(response)
+            with self.lock:
+                endpoint = self.stats.setdefault(name, {'calls': 0, 'bytes': 0})
+                endpoint['calls'] += 1
+                endpoint['bytes'] += size
+            return response
+        return recorded
+
+def populate(world, tweet_count):
+    """
+    Gives the simulated account tweet_count existing tweets with random engagement.
+    """
+    rng = np.random.default_rng(0)
+    likes = rng.poisson(3, tweet_count)
+    retweets = rng.poisson(1, tweet_count)
+    for index in range(tweet_count):
+        tweet = sim_helpers.SimTweet(next(world.next_id), world.user_id, world.now, int(likes[index]), int(retweets[index]))
+        world.tweets[tweet.id] = tweet
+        world.tweet_ids.append(tweet.id)
+
+def run_scenario(tweet_count, cycles, incremental, seed = 0):
+    """
+    Runs bot cycles against recording stub clients and an in-memory database and measures each cycle.
+
+    Args:
+        tweet_count (int): The number of tweets the account starts with.
+        cycles (int): The number of cycles to measure.
+        incremental (bool): Count interactions with the incremental metrics table instead of timeline rescans.
+        seed (int): The random seed.
+
+    Returns:
+        dict: Wall time, per-endpoint calls and bytes, and database round trips, for the first cycle and averaged
+        over the following ones.
+    """
+    random.seed(seed)
+    np.random.seed(seed)
+    world = sim_helpers.SimWorld(seed = seed)
+    populate(world, tweet_count)
+    db = sim_helpers.MemoryDatabase()
+    sim_helpers.new_qtable(db.qtable)
+    action_log_helpers.ensure_indexes(db.action_table)
+    qtable = qtable_helpers.QTable(db.qtable)
+    metrics_table = db.tweet_metrics if incremental else None
+    measured = []
+    with sim_helpers.simulated(world), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for cycle in range(cycles + 1):
+            stats = {}
+            # the cycle-scoped cache sits in front of the API, as in Q_bot.setup
+            client = cache_helpers.ResponseCache().wrap(RecordingClient(sim_helpers.SimClient(world), stats))
+            trips_before = sum(collection.round_trips for collection in db.collections.values())
+            start = time.perf_counter()
+            q_helpers.get_results(qtable, db.action_table, 0.1, 0.9, 0.8, client, client, None, world.username, metrics_table)
+            q_helpers.execute_action(qtable, db.action_table, 0.1, 0.9, 0.8, client, client, None, world.username, metrics_table)
+            qtable.flush()
+            seconds = time.perf_counter() - start
+            trips = sum(collection.round_trips for collection in db.collections.values()) - trips_before
+            measured.append({'seconds': seconds, 'endpoints': stats, 'db_round_trips': trips})
+            world.advance()
+    return {'first_cycle': measured[0], 'steady_state': average(measured[1:])}
+
+def average(cycles):
+    """
+    Averages the measurements of several cycles.
+    """
+    if not cycles:
+        return {}
+    endpoints = {}
+    for cycle in cycles:
+        for name, stats in cycle['endpoints'].items():
+            total = endpoints.setdefault(name, {'calls': 0, 'bytes': 0})
+            total['calls'] += stats['calls']
+            total['bytes'] += stats['bytes']
+    count = len(cycles)
+    return {
+        'seconds': sum(cycle['seconds'] for cycle in cycles) / count,
+        'endpoints': {name: {'calls': total['calls'] / count, 'bytes': total['bytes'] / count} for name, total in sorted(endpoints.items())},
+        'api_calls': sum(total['calls'] for total in endpoints.values()) / count,
+        'bytes': sum(total['bytes'] for total in endpoints.values()) / count,
+        'db_round_trips': sum(cycle['db_round_trips'] for cycle in cycles) / count,
+    }
+
+def git_revision():
+    """
+    Returns the current git commit, or None outside a git checkout.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output = True, text = True, check = True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(previous, current):
+    """
+    Prints the change of the steady-state numbers between two benchmark result files.
+    """
+    for name, result in current['scenarios'].items():
+        if name not in previous['scenarios']:
+            continue
+        old = previous['scenarios'][name]['steady_state']
+        new = result['steady_state']
+        for metric in ('seconds', 'api_calls', 'bytes', 'db_round_trips'):
+            if old.get(metric):
+                change = (new[metric] - old[metric]) / old[metric] * 100
+                print(name + ' ' + metric + ': ' + format(old[metric], '.6g') + ' -> ' + format(new[metric], '.6g') + ' (' + format(change, '+.1f') + '%)')
+
+def main():
+    parser = argparse.ArgumentParser(description = 'Measures the cost of a bot cycle against simulated clients')
+    parser.add_argument('--cycles', type = int, default = 50, help = 'cycles measured per scenario after the first one')
+    parser.add_argument('--scenario', choices = sorted(SCENARIOS), action = 'append', help = 'scenario to run, all by default')
+    parser.add_argument('--rescan', action = 'store_true', help = 'count interactions by rescanning the timeline instead of the metrics table')
+    parser.add_argument('--output', default = 'bench_results.json', help = 'file the results are written to')
+    parser.add_argument('--compare', help = 'earlier result file to compare against')
+    args = parser.parse_args()
+
+    results = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'cycles': args.cycles,
+        'incremental': not args.rescan,
+        'scenarios': {},
+    }
+    for name in args.scenario or sorted(SCENARIOS):
+        result = run_scenario(SCENARIOS[name], args.cycles, not args.rescan)
+        results['scenarios'][name] = result
+        steady = result['steady_state']
+        print(name + ': ' + format(steady['seconds'] * 1000, '.2f') + ' ms/cycle, ' + format(steady['api_calls'], '.1f') + ' API calls, ' + format(steady['bytes'], '.0f') + ' bytes, ' + format(steady['db_round_trips'], '.1f') + ' DB round trips')
+    with open(args.output, 'w') as output:
+        json.dump(results, output, indent = 2)
+    if args.compare:
+        with open(args.compare) as previous:
+            compare(json.load(previous), results)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import contextlib
+import threading
+import metrics_helpers
+
+# Read endpoints whose responses are cached for the rest of a cycle
+READ_ENDPOINTS = {'get_user', 'get_me', 'get_users_tweets', 'get_tweets', 'get_users_following', 'search_recent_tweets'}
+
+# Read endpoints whose cached responses a write endpoint makes stale
+INVALIDATES = {
+    # the new tweet changes the timeline and the tweet count
+    'create_tweet': {'get_user', 'get_me', 'get_users_tweets', 'get_tweets'},
+    'delete_tweet': {'get_user', 'get_me', 'get_users_tweets', 'get_tweets'},
+    # a retweet shows up on the timeline and changes the retweeted tweet's counts
+    'retweet': {'get_users_tweets', 'get_tweets', 'search_recent_tweets'},
+    'like': {'get_tweets', 'search_recent_tweets'},
+    # following changes the following count and list
+    'follow_user': {'get_user', 'get_me', 'get_users_following'},
+    'unfollow_user': {'get_user', 'get_me', 'get_users_following'},
+}
+
+def freeze(value):
+    """
+    Turns call arguments into a hashable cache key part, lists and dictionaries included.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((key, freeze(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple, set)):
+        return tuple(freeze(item) for item in value)
+    return value
+
+class ResponseCache:
+    """
+    Memoizes read API responses for the duration of one bot cycle, keyed on the endpoint and its arguments, so the
+    same user or timeline is fetched once per cycle however many helpers ask for it. Concurrent identical reads
+    wait for the first one instead of issuing their own. Write calls drop the cached reads they make stale, as
+    listed in INVALIDATES, and clear() empties the cache at the start of every cycle.
+
+    Attributes:
+        hits (dict): The number of reads served from the cache, per endpoint.
+        misses (dict): The number of reads sent to the API, per endpoint.
+    """
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.hits = {}
+        self.misses = {}
+
+    def clear(self):
+        """
+        Drops every cached response.
+        """
+        with self.lock:
+            self.entries = {}
+
+    @contextlib.contextmanager
+    def cycle(self):
+        """
+        Scopes the cache to the enclosed block: it starts empty and is emptied again when the block exits.
+        """
+        self.clear()
+        try:
+            yield self
+        finally:
+            self.clear()
+
+    def invalidate(self, endpoints):
+        """
+        Drops the cached responses of the given endpoints.
+        """
+        with self.lock:
+            self.entries = {key: entry for key, entry in self.entries.items() if key[0] not in endpoints}
+
+    def call(self, endpoint, function, *args, **kwargs):
+        """
+        Returns the cached response of endpoint for these arguments, calling function(*args, **kwargs) on a miss.
+        Errors are not cached.
+        """
+        key = (endpoint, freeze(args), freeze(kwargs))
+        with self.lock:
+            entry = self.entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = {'done': threading.Event(), 'value': None, 'error': None}
+                self.entries[key] = entry
+                self.misses[endpoint] = self.misses.get(endpoint, 0) + 1
+            else:
+                self.hits[endpoint] = self.hits.get(endpoint, 0) + 1
+        metrics_helpers.increment('response_cache_misses_total' if owner else 'response_cache_hits_total', endpoint = endpoint)
+        if owner:
+            try:
+                entry['value'] = function(*args, **kwargs)
+            except BaseException as error:
+                entry['error'] = error
+                with self.lock:
+                    if self.entries.get(key) is entry:
+                        del self.entries[key]
+                raise
+            finally:
+                entry['done'].set()
+            return entry['value']
+        entry['done'].wait()
+        if entry['error'] is not None:
+            raise entry['error']
+        return entry['value']
+
+    def stats(self):
+        """
+        Returns the hit and miss counts per endpoint and the overall hit rate.
+        """
+        with self.lock:
+            hits = sum(self.hits.values())
+            misses = sum(self.misses.values())
+            return {'hits': dict(self.hits), 'misses': dict(self.misses), 'hit_rate': hits / (hits + misses) if hits + misses else 0.0}
+
+    def wrap(self, client):
+        """
+        Returns a proxy of a tweepy Client whose reads go through this cache.
+        """
+        return CachedClient(client, self)
+
+class CachedClient:
+    """
+    Proxy of a tweepy Client that serves the endpoints in READ_ENDPOINTS from a ResponseCache and invalidates the
+    cache after write endpoints. Other attributes are passed through unchanged. Wrap it around the rate limited
+    client, so cache hits do not use quota.
+    """
+    def __init__(self, client, cache):
+        self.client = client
+        self.cache = cache
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+        if name in READ_ENDPOINTS:
+            def cached(*args, **kwargs):
+                return self.cache.call(name, attribute, *args, **kwargs)
+            return cached
+        if name in INVALIDATES:
+            def invalidating(*args, **kwargs):
+                try:
+                    return attribute(*args, **kwargs)
+                finally:
+                    self.cache.invalidate(INVALIDATES[name])
+            return invalidating
+        return attribute
@@ -0,0 +1,160 @@
+import time
+import random
+
+# The actions whose targets come from the pool
+ACTIONS = ['like', 'retweet', 'follow']
+
+class CandidatePool:
+    """
+    Pool of candidate tweets for the like, retweet and follow actions, kept per search query. One search page
+    fills the pool, later actions are served from it until the pool gets stale or runs low, and each refill only
+    asks for tweets newer than the newest one already seen. With a pool_table the pools are saved after every
+    refill and loaded back, so one-shot runs started by cron reuse them instead of searching every time. The pool
+    remembers which tweets were already liked or retweeted and which authors were already followed, so the same
+    target is never acted on twice.
+
+    Attributes:
+        client_bearer: A tweepy Client object with a bearer token, used for searching.
+        acted (dict): The ids already acted on, per action: tweet ids for 'like' and 'retweet', author ids for 'follow'.
+        search_count (int): The number of search requests made so far.
+    """
+    def __init__(self, client_bearer, ttl = 6 * 3600, low_water = 5, max_pages = 1, page_size = 100, acted_table = None, pools = None, pool_table = None):
+        """
+        Args:
+            client_bearer: A tweepy Client object with a bearer token.
+            ttl (float): The number of seconds a filled pool is served before it is considered stale. Keep it
+                longer than the interval between two cycles, or every action starts with a search.
+            low_water (int): Refill when fewer than this many unused candidates are left for an action.
+            max_pages (int): The maximum number of result pages fetched per refill.
+            page_size (int): The number of tweets requested per page, between 10 and 100.
+            acted_table (pymongo.collection.Collection, optional): A collection that persists the acted-on ids,
+                so they survive restarts. Kept in memory only when None.
+            pools (dict, optional): The searched tweets per query, to share them between the pools of several
+                accounts. Each pool still keeps its own acted-on ids.
+            pool_table (pymongo.collection.Collection, optional): A collection the pools are saved to, so they
+                survive restarts. Kept in memory only when None.
+        """
+        self.client_bearer = client_bearer
+        self.ttl = ttl
+        self.low_water = low_water
+        self.max_pages = max_pages
+        self.page_size = page_size
+        self.acted_table = acted_table
+        self.pools = {} if pools is None else pools
+        self.pool_table = pool_table
+        self.acted = {'like': set(), 'retweet': set(), 'follow': set()}
+        self.search_count = 0
+        if acted_table is not None:
+            for doc in acted_table.find({}, {'_id': 0, 'kind': 1, 'target_id': 1}):
+                self.acted.setdefault(doc['kind'], set()).add(doc['target_id'])
+        if pool_table is not None:
+            self.load_pools()
+
+    def load_pools(self):
+        """
+        Loads the saved pools that are still fresh, for the queries not pooled yet.
+        """
+        import tweepy
+        for doc in self.pool_table.find({'filled_at': {'$gt': time.time() - self.ttl}}, {'_id': 0}):
+            if doc['query'] not in self.pools:
+                self.pools[doc['query']] = {'tweets': [tweepy.Tweet(data) for data in doc['tweets']], 'since_id': doc['since_id'], 'filled_at': doc['filled_at']}
+
+    def save_pool(self, query):
+        """
+        Saves the pool of a query to pool_table.
+        """
+        pool = self.pools[query]
+        tweets = [tweet.data for tweet in pool['tweets']]
+        self.pool_table.update_one({'query': query}, {'$set': {'query': query, 'tweets': tweets, 'since_id': pool['since_id'], 'filled_at': pool['filled_at']}}, upsert = True)
+
+    def target_id(self, tweet, kind):
+        """
+        Returns the id an action is taken on: the author for a follow, the tweet itself otherwise.
+        """
+        if kind == 'follow':
+            return int(tweet.author_id)
+        return int(tweet.id)
+
+    def available(self, query, kind, follow_index = None):
+        """
+        Returns the pooled tweets for a query that the given action has not been taken on yet. For a follow, authors
+        in follow_index are skipped as well.
+        """
+        pool = self.pools.get(query)
+        if pool is None:
+            return []
+        acted = self.acted.setdefault(kind, set())
+        candidates = [tweet for tweet in pool['tweets'] if self.target_id(tweet, kind) not in acted]
+        if kind == 'follow' and follow_index is not None:
+            candidates = follow_index.filter_authors(candidates)
+        return candidates
+
+    def refill(self, query):
+        """
+        Searches for tweets newer than the newest pooled one and adds them to the pool, following pagination for
+        at most max_pages pages. A stale pool is emptied first.
+        """
+        pool = self.pools.setdefault(query, {'tweets': [], 'since_id': None, 'filled_at': 0.0})
+        if time.time() - pool['filled_at'] > self.ttl:
+            pool['tweets'] = []
+        seen = set(int(tweet.id) for tweet in pool['tweets'])
+        next_token = None
+        newest = pool['since_id']
+        for page in range(self.max_pages):
+            tweets = self.client_bearer.search_recent_tweets(query = query, max_results = self.page_size, since_id = pool['since_id'], next_token = next_token, tweet_fields = ['context_annotations','author_id', 'public_metrics'])
+            self.search_count += 1
+            for tweet in tweets.data or []:
+                if int(tweet.id) not in seen:
+                    seen.add(int(tweet.id))
+                    pool['tweets'].append(tweet)
+                if newest is None or int(tweet.id) > newest:
+                    newest = int(tweet.id)
+            next_token = tweets.meta.get('next_token') if tweets.meta else None
+            if not next_token:
+                break
+        pool['since_id'] = newest
+        pool['filled_at'] = time.time()
+        if self.pool_table is not None:
+            self.save_pool(query)
+
+    def needs_refill(self, query, kind, follow_index = None):
+        """
+        Tells whether taking a tweet for the action would search first: the pool is missing or stale, or has fewer
+        than low_water tweets the action was not taken on.
+        """
+        pool = self.pools.get(query)
+        if pool is None or time.time() - pool['filled_at'] > self.ttl:
+            return True
+        return len(self.available(query, kind, follow_index)) < self.low_water
+
+    def take(self, query, kind, follow_index = None):
+        """
+        Returns a random pooled tweet for the query that the given action has not been taken on yet, refilling the
+        pool first if it is stale or has fewer than low_water such tweets. The tweet is marked as acted on.
+
+        Args:
+            query (str): The search query.
+            kind (str): The action about to be taken: 'like', 'retweet' or 'follow'.
+            follow_index (follow_graph_helpers.FollowIndex, optional): Accounts already followed, skipped as
+                follow targets.
+
+        Returns:
+            tweepy.Tweet: The selected tweet, or None if the search returned nothing usable.
+        """
+        if self.needs_refill(query, kind, follow_index):
+            self.refill(query)
+        candidates = self.available(query, kind, follow_index)
+        if not candidates:
+            return None
+        tweet = random.choice(candidates)
+        self.mark(tweet, kind)
+        return tweet
+
+    def mark(self, tweet, kind):
+        """
+        Records that an action was taken on a tweet, persisting it if an acted_table was given.
+        """
+        target_id = self.target_id(tweet, kind)
+        self.acted.setdefault(kind, set()).add(target_id)
+        if self.acted_table is not None:
+            self.acted_table.update_one({'kind': kind, 'target_id': target_id}, {'$setOnInsert': {'kind': kind, 'target_id': target_id}}, upsert = True)
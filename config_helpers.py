@@ -0,0 +1,30 @@
+import os
+import threading
+
+loaded = False
+lock = threading.Lock()
+
+def load(path = None):
+    """
+    Reads the .env file into the environment the first time it is called, later calls return at once. Variables
+    already set in the environment are kept. python-dotenv is only imported here, so modules that read the
+    configuration do not pay for it at import time.
+
+    Args:
+        path (str, optional): The .env file. python-dotenv searches for one from the working directory when None.
+    """
+    global loaded
+    if loaded:
+        return
+    with lock:
+        if not loaded:
+            from dotenv import load_dotenv
+            load_dotenv(path)
+            loaded = True
+
+def get(name, default = None):
+    """
+    Returns the value of a configuration variable, loading the .env file first if it was not loaded yet.
+    """
+    load()
+    return os.environ.get(name, default)
@@ -0,0 +1,75 @@
+import random
+import signal
+import threading
+import time
+import traceback
+
+def install_signal_handlers(stop_event):
+    """
+    Makes SIGINT and SIGTERM set the given event instead of killing the process, so the cycle that is running
+    can finish and the daemon can shut down cleanly.
+
+    Args:
+        stop_event (threading.Event): The event that tells the scheduler loop to stop.
+    """
+    def handle_signal(signum, frame):
+        print('Received signal ' + str(signum) + ', shutting down after the current cycle')
+        stop_event.set()
+    signal.signal(signal.SIGINT, handle_signal)
+    signal.signal(signal.SIGTERM, handle_signal)
+
+def next_delay(interval, jitter):
+    """
+    Returns the number of seconds to wait before the next cycle.
+
+    Args:
+        interval (float): The base number of seconds between the start of two cycles.
+        jitter (float): The maximum number of seconds randomly added to or removed from the interval.
+
+    Returns:
+        float: The delay in seconds, never negative.
+    """
+    return max(0.0, interval + random.uniform(-jitter, jitter))
+
+def run_forever(cycle, interval, jitter = 0.0, stop_event = None, max_cycles = None, on_shutdown = None):
+    """
+    Runs `cycle` repeatedly on a fixed schedule until a stop signal is received. Cycles are scheduled from the start
+    of the previous cycle, so a slow cycle shortens the following wait instead of pushing the whole schedule back.
+    An exception inside a cycle is reported with its traceback and the daemon keeps going with the next cycle.
+
+    Args:
+        cycle (callable): The function run once per cycle, called without arguments.
+        interval (float): The base number of seconds between the start of two cycles.
+        jitter (float): The maximum number of seconds randomly added to or removed from each wait.
+        stop_event (threading.Event, optional): The event used to stop the loop. Signal handlers are installed when None.
+        max_cycles (int, optional): Stop after this many cycles. Runs until stopped when None.
+        on_shutdown (callable, optional): Called once without arguments when the loop exits.
+
+    Returns:
+        list: The wall time of every cycle in seconds.
+    """
+    if stop_event is None:
+        stop_event = threading.Event()
+        install_signal_handlers(stop_event)
+    latencies = []
+    try:
+        while not stop_event.is_set():
+            start = time.monotonic()
+            try:
+                cycle()
+                status = 'ok'
+            except Exception as error:
+                traceback.print_exc()
+                status = 'failed: ' + repr(error)
+            latency = time.monotonic() - start
+            latencies.append(latency)
+            print('cycle ' + str(len(latencies)) + ' ' + status + ' in ' + format(latency, '.3f') + 's')
+            if max_cycles is not None and len(latencies) >= max_cycles:
+                break
+            stop_event.wait(max(0.0, next_delay(interval, jitter) - latency))
+    finally:
+        if on_shutdown is not None:
+            on_shutdown()
+    if latencies:
+        print('ran ' + str(len(latencies)) + ' cycles, mean latency ' + format(sum(latencies) / len(latencies), '.3f') + 's, max ' + format(max(latencies), '.3f') + 's')
+    return latencies
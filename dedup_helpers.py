@@ -0,0 +1,171 @@
+import os
+import re
+import zlib
+import numpy as np
+import timeline_helpers
+
+# Mersenne prime the MinHash permutations are computed modulo
+PRIME = (1 << 31) - 1
+
+def normalize(text):
+    """
+    Lowercases a tweet and reduces it to words separated by single spaces, dropping punctuation, emoji, mentions,
+    hashtag marks and links, so cosmetic differences do not hide a duplicate.
+    """
+    text = re.sub(r'https?://\S+', ' ', text.lower())
+    return ' '.join(re.findall(r'[a-z0-9\']+', text))
+
+def shingles(text, size = 5):
+    """
+    Returns the set of character shingles of the normalized text, hashed to 31-bit integers.
+    """
+    text = normalize(text)
+    if len(text) <= size:
+        return {zlib.crc32(text.encode()) % PRIME}
+    return {zlib.crc32(text[start:start + size].encode()) % PRIME for start in range(len(text) - size + 1)}
+
+class DuplicateIndex:
+    """
+    Index of posted tweets that finds near-duplicates of a new tweet without comparing it to every stored one.
+    Each tweet is reduced to a MinHash signature of num_perm values over its character shingles; two signatures
+    agree in a fraction of positions that estimates the Jaccard similarity of the texts. The signature is cut
+    into bands, and every band is a key in a hash table, so only tweets sharing at least one whole band with the
+    candidate are compared. The lookup cost depends on the number of bands, not on the number of stored tweets.
+
+    Signatures are appended to a flat binary file of uint32 values, num_perm per tweet, and the band tables are
+    rebuilt from it on load.
+
+    Attributes:
+        path (str): The signature file, or None to keep the index in memory only.
+        signatures (list): The signature of every indexed tweet, in insertion order.
+        threshold (float): The estimated Jaccard similarity at or above which two tweets are duplicates.
+    """
+    def __init__(self, path = None, num_perm = 64, bands = 16, threshold = 0.6, shingle_size = 5, seed = 7):
+        """
+        Args:
+            path (str, optional): The signature file the index is loaded from and appended to.
+            num_perm (int): The number of MinHash values per signature. Must be a multiple of bands.
+            bands (int): The number of LSH bands. More bands find less similar pairs at the cost of more
+                candidates to verify.
+            threshold (float): The estimated Jaccard similarity at or above which two tweets are duplicates.
+            shingle_size (int): The number of characters per shingle.
+            seed (int): The seed of the MinHash permutations. An existing signature file is only valid with the
+                num_perm and seed it was written with.
+        """
+        if num_perm % bands:
+            raise ValueError('num_perm must be a multiple of bands')
+        self.path = path
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        self.seed = seed
+        rng = np.random.default_rng(seed)
+        self.a = rng.integers(1, PRIME, num_perm, dtype = np.uint64)
+        self.b = rng.integers(0, PRIME, num_perm, dtype = np.uint64)
+        self.signatures = []
+        self.tables = [{} for band in range(bands)]
+        if path is not None and os.path.exists(path):
+            row_bytes = num_perm * 4
+            size = os.path.getsize(path)
+            if size % row_bytes:
+                # Drop a signature cut short by a crash during an append
+                with open(path, 'r+b') as signature_file:
+                    signature_file.truncate(size - size % row_bytes)
+            stored = np.fromfile(path, dtype = np.uint32).reshape(-1, num_perm)
+            for signature in stored:
+                self.insert(signature)
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def signature(self, text):
+        """
+        Returns the MinHash signature of a text as a uint32 array of num_perm values.
+        """
+        hashes = np.fromiter(shingles(text, self.shingle_size), dtype = np.uint64)
+        # Values stay below 2**62, so the products cannot overflow uint64
+        return ((self.a[:, None] * hashes[None, :] + self.b[:, None]) % PRIME).min(axis = 1).astype(np.uint32)
+
+    def band_keys(self, signature):
+        return [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+
+    def insert(self, signature):
+        position = len(self.signatures)
+        self.signatures.append(signature)
+        for table, key in zip(self.tables, self.band_keys(signature)):
+            table.setdefault(key, []).append(position)
+
+    def similar(self, text):
+        """
+        Returns the positions of the indexed tweets whose estimated similarity to text reaches the threshold,
+        with the similarities.
+
+        Returns:
+            list: (position, similarity) pairs, most similar first.
+        """
+        signature = self.signature(text)
+        candidates = set()
+        for table, key in zip(self.tables, self.band_keys(signature)):
+            candidates.update(table.get(key, ()))
+        matches = []
+        for position in candidates:
+            similarity = float(np.mean(self.signatures[position] == signature))
+            if similarity >= self.threshold:
+                matches.append((position, similarity))
+        matches.sort(key = lambda match: -match[1])
+        return matches
+
+    def is_duplicate(self, text):
+        """
+        Tells whether text is a near-duplicate of an indexed tweet.
+        """
+        return bool(self.similar(text))
+
+    def unique(self, texts, others = ()):
+        """
+        Returns the texts that are near-duplicates neither of an indexed tweet, nor of one of others, nor of an
+        earlier text in the list. Nothing is added to the index.
+
+        Args:
+            texts (list): The candidate tweets.
+            others (list): Tweets that are not indexed but must not be repeated either, such as buffered ones.
+
+        Returns:
+            list: The kept texts, in their original order.
+        """
+        seen = DuplicateIndex(None, self.num_perm, self.bands, self.threshold, self.shingle_size, self.seed)
+        for text in others:
+            seen.add(text)
+        kept = []
+        for text in texts:
+            if self.is_duplicate(text) or seen.is_duplicate(text):
+                continue
+            seen.add(text)
+            kept.append(text)
+        return kept
+
+    def add(self, text):
+        """
+        Indexes a tweet and appends its signature to the signature file.
+        """
+        signature = self.signature(text)
+        self.insert(signature)
+        if self.path is not None:
+            with open(self.path, 'ab') as signature_file:
+                signature_file.write(signature.tobytes())
+
+    def backfill(self, client_bearer, user_id, max_pages = 32):
+        """
+        Indexes the tweets already on the account's timeline, newest first, for at most max_pages pages of 100.
+
+        Returns:
+            int: The number of tweets indexed.
+        """
+        added = 0
+        for tweets, next_token in timeline_helpers.iter_timeline(client_bearer, user_id, exclude = ['retweets'], max_pages = max_pages, raw = True, tweet_fields = None):
+            for tweet in tweets:
+                self.add(tweet.text)
+                added += 1
+        return added
@@ -0,0 +1,126 @@
+import timeline_helpers
+import twitter_helpers
+
+SUMMARY_ID = 'summary'
+ACTIVE_WINDOW = 100
+PAGE_SIZE = 100
+
+def get_summary(metrics_table):
+    """
+    Returns the running-total document stored in the metrics table, creating an empty one in memory if the
+    table has never been filled.
+
+    Args:
+        metrics_table (pymongo.collection.Collection): The MongoDB collection that stores per-tweet metrics.
+
+    Returns:
+        dict: The summary document with the keys 'since_id', 'likes' and 'retweets'.
+    """
+    summary = metrics_table.find_one({'_id': SUMMARY_ID})
+    if summary is None:
+        summary = {'_id': SUMMARY_ID, 'since_id': None, 'likes': 0, 'retweets': 0}
+    return summary
+
+def fetch_new_tweets(client_bearer, user_id, since_id):
+    """
+    Walks the user's timeline page by page and returns every tweet newer than since_id. When since_id is None
+    the whole available timeline is fetched, which only happens the first time the metrics table is filled.
+
+    Args:
+        client_bearer: A tweepy Client object with a bearer token.
+        user_id: The id of the Twitter user whose tweets are fetched.
+        since_id (int): The newest tweet id already stored, or None.
+
+    Returns:
+        list: The tweepy Tweet objects newer than since_id.
+    """
+    new_tweets = []
+    for tweets, next_token in timeline_helpers.iter_timeline(client_bearer, user_id, page_size = PAGE_SIZE, since_id = since_id, raw = True):
+        new_tweets.extend(tweets)
+    return new_tweets
+
+def refresh_active_tweets(client_bearer, tweet_ids):
+    """
+    Looks up the current public metrics of the given tweets in batches of 100 ids.
+
+    Args:
+        client_bearer: A tweepy Client object with a bearer token.
+        tweet_ids (list): The ids of the tweets to refresh.
+
+    Returns:
+        dict: A mapping of tweet id to its tweepy Tweet object. Tweets that no longer exist are left out.
+    """
+    refreshed = {}
+    for start in range(0, len(tweet_ids), PAGE_SIZE):
+        batch = tweet_ids[start:start + PAGE_SIZE]
+        tweets = client_bearer.get_tweets(ids = batch, tweet_fields = ['created_at', 'public_metrics'])
+        if tweets.data:
+            for tweet in tweets.data:
+                refreshed[int(tweet.id)] = tweet
+    return refreshed
+
+def get_total_lr_incremental(client_bearer, username, metrics_table, active_window = ACTIVE_WINDOW, snapshot_store = None):
+    """
+    Incremental replacement for twitter_helpers.get_total_lr. Instead of downloading the whole timeline on every
+    call, the per-tweet like and retweet counts are kept in metrics_table together with running totals. Each call
+    only fetches the tweets newer than the last seen id and refreshes the metrics of the `active_window` most
+    recent stored tweets, which is where almost all new engagement lands. Older tweets keep their last known counts.
+
+    Args:
+        client_bearer: A tweepy Client object with a bearer token.
+        username (str): The username of the target user.
+        metrics_table (pymongo.collection.Collection): The MongoDB collection that stores per-tweet metrics.
+        active_window (int): The number of most recent stored tweets whose metrics are refreshed on every call.
+        snapshot_store (snapshot_helpers.SnapshotStore, optional): Store the counts of every new and refreshed
+            tweet are appended to as a snapshot.
+
+    Returns:
+        dict: A dictionary with the keys 'likes' and 'retweets', in the same format as get_total_lr.
+    """
+    import pymongo
+    summary = get_summary(metrics_table)
+    user = twitter_helpers.get_user(client_bearer, username)
+    user_id = user.data.data['id']
+
+    new_tweets = fetch_new_tweets(client_bearer, user_id, summary['since_id'])
+    active_docs = list(metrics_table.find({'_id': {'$ne': SUMMARY_ID}}).sort('_id', -1).limit(active_window))
+    refreshed = {}
+    if active_docs:
+        refreshed = refresh_active_tweets(client_bearer, [doc['_id'] for doc in active_docs])
+
+    operations = []
+    like_delta = 0
+    retweet_delta = 0
+    since_id = summary['since_id']
+    for tweet in new_tweets:
+        tweet_id = int(tweet.id)
+        likes = int(tweet.data['public_metrics']['like_count'])
+        retweets = int(tweet.data['public_metrics']['retweet_count'])
+        like_delta += likes
+        retweet_delta += retweets
+        operations.append(pymongo.UpdateOne({'_id': tweet_id}, {'$set': {'created_at': tweet.data.get('created_at'), 'likes': likes, 'retweets': retweets}}, upsert = True))
+        if since_id is None or tweet_id > since_id:
+            since_id = tweet_id
+    for doc in active_docs:
+        tweet = refreshed.get(doc['_id'])
+        if tweet is None:
+            # The tweet was deleted, so its engagement no longer counts towards the totals
+            like_delta -= doc['likes']
+            retweet_delta -= doc['retweets']
+            operations.append(pymongo.DeleteOne({'_id': doc['_id']}))
+            continue
+        likes = int(tweet.data['public_metrics']['like_count'])
+        retweets = int(tweet.data['public_metrics']['retweet_count'])
+        if likes != doc['likes'] or retweets != doc['retweets']:
+            like_delta += likes - doc['likes']
+            retweet_delta += retweets - doc['retweets']
+            operations.append(pymongo.UpdateOne({'_id': doc['_id']}, {'$set': {'likes': likes, 'retweets': retweets}}))
+
+    operations.append(pymongo.UpdateOne({'_id': SUMMARY_ID}, {'$set': {'since_id': since_id}, '$inc': {'likes': like_delta, 'retweets': retweet_delta}}, upsert = True))
+    metrics_table.bulk_write(operations, ordered = False)
+    if snapshot_store is not None:
+        observed = new_tweets + list(refreshed.values())
+        if observed:
+            snapshot_store.record_tweets([int(tweet.id) for tweet in observed], [int(tweet.data['public_metrics']['like_count']) for tweet in observed], [int(tweet.data['public_metrics']['retweet_count']) for tweet in observed])
+    total_counts = {'likes': summary['likes'] + like_delta, 'retweets': summary['retweets'] + retweet_delta}
+    return total_counts
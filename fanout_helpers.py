@@ -0,0 +1,103 @@
+import concurrent.futures
+import threading
+import time
+import metrics_helpers
+
+# Seconds a single fanned-out call may take before gather gives up on it. A call throttled by
+# rate_limit_helpers.RateLimiter may wait max_wait (60s) for its window and then back off up to backoff_cap (60s)
+# on each of max_retries (3) retries, and the first walk of a long timeline makes dozens of requests, so anything
+# shorter turns a throttled read into a failed cycle
+DEFAULT_TIMEOUT = 600
+MAX_WORKERS = 8
+
+# When False, every gather runs its calls one after the other on the calling thread
+concurrent_calls = True
+
+executor = None
+executor_lock = threading.Lock()
+# Marks the threads of the shared pool, so a gather made from one of them runs its calls inline
+local = threading.local()
+
+class CallTimeout(TimeoutError):
+    """
+    Raised by gather when a call does not finish within its timeout.
+    """
+    def __init__(self, name, timeout):
+        super().__init__(name + ' did not finish within ' + format(timeout, 'g') + 's')
+        self.name = name
+        self.timeout = timeout
+
+def get_executor():
+    """
+    Returns the thread pool shared by every gather, created on first use.
+    """
+    global executor
+    with executor_lock:
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(max_workers = MAX_WORKERS, thread_name_prefix = 'fanout')
+        return executor
+
+def disable():
+    """
+    Makes every gather run its calls inline, one after the other. Used against local clients, such as the
+    simulator and the benchmark, whose calls take microseconds: handing them to the thread pool costs far more than
+    running them.
+    """
+    global concurrent_calls
+    concurrent_calls = False
+
+def enable():
+    """
+    Makes gather run its calls on the thread pool again, the default.
+    """
+    global concurrent_calls
+    concurrent_calls = True
+
+def run_on_pool(call):
+    local.on_pool = True
+    return call()
+
+def gather(calls, timeout = DEFAULT_TIMEOUT, timeouts = None):
+    """
+    Runs independent blocking calls at the same time on a shared thread pool and waits for all of them, so the
+    total latency is that of the slowest call instead of the sum. If a call raises or runs past its timeout, the
+    calls that have not started yet are cancelled and the error is raised. A call that is already running cannot
+    be interrupted; its result is discarded when it finishes.
+
+    A gather made from inside a call that is already running on the pool, or made while fan-out is disabled,
+    runs its calls one after the other on the calling thread. Waiting for the pool there could deadlock once every worker is blocked on a nested
+    gather, and the outer gather already provides the concurrency.
+
+    Args:
+        calls (dict): The calls by name, each a function taking no arguments.
+        timeout (float): The number of seconds each call may take, None for no limit.
+        timeouts (dict, optional): Per-call timeouts by name, overriding timeout.
+
+    Returns:
+        dict: The return value of every call, by name.
+
+    Raises:
+        CallTimeout: If a call did not finish within its timeout.
+    """
+    if len(calls) == 1:
+        name, call = next(iter(calls.items()))
+        return {name: call()}
+    if not concurrent_calls or getattr(local, 'on_pool', False):
+        return {name: call() for name, call in calls.items()}
+    pool = get_executor()
+    start = time.monotonic()
+    futures = {name: pool.submit(run_on_pool, call) for name, call in calls.items()}
+    results = {}
+    try:
+        for name, future in futures.items():
+            limit = (timeouts or {}).get(name, timeout)
+            remaining = None if limit is None else max(0.0, start + limit - time.monotonic())
+            try:
+                results[name] = future.result(timeout = remaining)
+            except concurrent.futures.TimeoutError:
+                metrics_helpers.increment('fanout_timeouts_total', call = name)
+                raise CallTimeout(name, limit) from None
+    finally:
+        for future in futures.values():
+            future.cancel()
+    return results
@@ -0,0 +1,148 @@
+import os
+import time
+import numpy as np
+
+class FollowIndex:
+    """
+    Local index of the user ids the account follows or has tried to follow, so follow candidates can be filtered
+    before any API call. The ids are kept as a sorted int64 NumPy array, 8 bytes per id, so hundreds of thousands of
+    ids take a few megabytes and a membership test is a binary search. Ids added since the last merge wait in a
+    small set and are merged into the array in one pass. The array is saved to a local .npz file.
+
+    The index is bulk-synced from the account's following list. The list is returned newest first, so after the
+    first full sync a sync stops at the first page whose ids are all known, which usually costs one request.
+
+    Attributes:
+        path (str): The .npz file the index is saved to, or None to keep it in memory only.
+        ids (numpy.ndarray): The sorted merged ids.
+        pending (set): Ids added since the last merge.
+        synced_at (float): The epoch time of the last sync, 0 if it never ran.
+    """
+    def __init__(self, path = None, sync_interval = 6 * 3600, merge_threshold = 1024):
+        """
+        Args:
+            path (str, optional): The .npz file the index is loaded from and saved to.
+            sync_interval (float): The number of seconds after which sync_if_due syncs again.
+            merge_threshold (int): Merge the pending ids into the array once this many have been added.
+        """
+        self.path = path
+        self.sync_interval = sync_interval
+        self.merge_threshold = merge_threshold
+        self.ids = np.empty(0, dtype = np.int64)
+        self.pending = set()
+        self.synced_at = 0.0
+        self.dirty = False
+        if path is not None and os.path.exists(path):
+            with np.load(path) as saved:
+                self.ids = np.unique(saved['ids'].astype(np.int64))
+                self.synced_at = float(saved['synced_at'])
+
+    def __len__(self):
+        self.merge()
+        return len(self.ids)
+
+    def __contains__(self, user_id):
+        user_id = int(user_id)
+        if user_id in self.pending:
+            return True
+        position = np.searchsorted(self.ids, user_id)
+        return bool(position < len(self.ids) and self.ids[position] == user_id)
+
+    def contains_many(self, user_ids):
+        """
+        Returns a boolean array telling which of the given user ids are in the index.
+        """
+        self.merge()
+        return np.isin(np.asarray(user_ids, dtype = np.int64), self.ids, assume_unique = False)
+
+    def add(self, user_id):
+        """
+        Adds a followed or attempted user id.
+        """
+        user_id = int(user_id)
+        if user_id in self:
+            return
+        self.pending.add(user_id)
+        self.dirty = True
+        if len(self.pending) >= self.merge_threshold:
+            self.merge()
+
+    def add_many(self, user_ids):
+        """
+        Adds many user ids at once and returns the number that were not in the index yet.
+        """
+        user_ids = np.unique(np.asarray(list(user_ids), dtype = np.int64))
+        self.merge()
+        new_ids = user_ids[~np.isin(user_ids, self.ids)]
+        if len(new_ids):
+            self.ids = np.union1d(self.ids, new_ids)
+            self.dirty = True
+        return len(new_ids)
+
+    def merge(self):
+        """
+        Merges the pending ids into the sorted array.
+        """
+        if self.pending:
+            self.ids = np.union1d(self.ids, np.fromiter(self.pending, dtype = np.int64, count = len(self.pending)))
+            self.pending = set()
+
+    def filter_authors(self, tweets):
+        """
+        Returns the tweets whose author is not in the index.
+        """
+        if not tweets:
+            return []
+        known = self.contains_many([int(tweet.author_id) for tweet in tweets])
+        return [tweet for tweet, skip in zip(tweets, known) if not skip]
+
+    def sync(self, client_bearer, user_id, page_size = 1000, max_pages = None):
+        """
+        Adds the ids of the accounts user_id follows to the index. Stops at the first page that adds nothing new, unless the
+        index has never been synced, in which case the whole list is read.
+
+        Args:
+            client_bearer: A tweepy Client object with a bearer token.
+            user_id (int): The id of the bot's account.
+            page_size (int): The number of users requested per page, at most 1000.
+            max_pages (int, optional): The maximum number of pages read.
+
+        Returns:
+            int: The number of ids added to the index.
+        """
+        full = self.synced_at == 0
+        added = 0
+        pagination_token = None
+        pages = 0
+        while True:
+            response = client_bearer.get_users_following(id = user_id, max_results = page_size, pagination_token = pagination_token)
+            pages += 1
+            page_added = self.add_many(int(user.id) for user in response.data or [])
+            added += page_added
+            pagination_token = response.meta.get('next_token') if response.meta else None
+            if not pagination_token or (page_added == 0 and not full) or (max_pages is not None and pages >= max_pages):
+                break
+        self.synced_at = time.time()
+        self.dirty = True
+        return added
+
+    def sync_if_due(self, client_bearer, user_id):
+        """
+        Runs sync if sync_interval seconds have passed since the last one.
+        """
+        if time.time() - self.synced_at >= self.sync_interval:
+            return self.sync(client_bearer, user_id)
+        return 0
+
+    def save(self):
+        """
+        Saves the index to path if it changed, writing a temporary file and renaming it over the old one.
+        """
+        if self.path is None or not self.dirty:
+            return
+        self.merge()
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as output:
+            np.savez(output, ids = self.ids, synced_at = np.float64(self.synced_at))
+        os.replace(temporary, self.path)
+        self.dirty = False
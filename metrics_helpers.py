@@ -0,0 +1,221 @@
+import bisect
+import contextlib
+import functools
+import json
+import os
+import threading
+import time
+
+# Upper bounds in seconds of the latency histogram buckets, the last bucket is +Inf
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30]
+# Upper bounds of the buckets used for rewards and Q-value changes
+VALUE_BUCKETS = [-10, -1, -0.1, 0, 0.1, 1, 10, 100]
+
+enabled = False
+lock = threading.Lock()
+counters = {}
+histograms = {}
+
+def enable():
+    """
+    Turns instrumentation on. Until then every recording function returns immediately.
+    """
+    global enabled
+    enabled = True
+
+def disable():
+    """
+    Turns instrumentation off, keeping what was recorded so far.
+    """
+    global enabled
+    enabled = False
+
+def reset():
+    """
+    Drops every recorded counter and histogram.
+    """
+    with lock:
+        counters.clear()
+        histograms.clear()
+
+def series_key(name, labels):
+    return (name, tuple(sorted(labels.items())))
+
+def increment(name, value = 1, **labels):
+    """
+    Adds value to the counter name with the given labels.
+    """
+    if not enabled:
+        return
+    key = series_key(name, labels)
+    with lock:
+        counters[key] = counters.get(key, 0) + value
+
+def observe(name, value, buckets = None, **labels):
+    """
+    Records value in the histogram name with the given labels.
+
+    Args:
+        name (str): The histogram name.
+        value (float): The observed value.
+        buckets (list, optional): The bucket upper bounds, LATENCY_BUCKETS by default. Only used when the
+            histogram is created.
+        **labels: The labels of the series.
+    """
+    if not enabled:
+        return
+    key = series_key(name, labels)
+    with lock:
+        histogram = histograms.get(key)
+        if histogram is None:
+            bounds = list(buckets if buckets is not None else LATENCY_BUCKETS)
+            histogram = {'buckets': bounds, 'counts': [0] * (len(bounds) + 1), 'sum': 0.0, 'count': 0}
+            histograms[key] = histogram
+        histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+        histogram['sum'] += value
+        histogram['count'] += 1
+
+@contextlib.contextmanager
+def span(name, **labels):
+    """
+    Times the enclosed block into the histogram name_seconds and counts it in name_total, and errors raised in it in
+    name_errors_total.
+    """
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception as error:
+        increment(name + '_errors_total', error = type(error).__name__, **labels)
+        raise
+    finally:
+        observe(name + '_seconds', time.perf_counter() - start, **labels)
+        increment(name + '_total', **labels)
+
+def timed(name, **labels):
+    """
+    Decorator that runs a function inside span(name, **labels).
+    """
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return function(*args, **kwargs)
+            with span(name, **labels):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+class InstrumentedClient:
+    """
+    Proxy that times every method call of the wrapped object in the remote_call span, labelled with the target
+    name and the method name.
+    """
+    def __init__(self, client, target):
+        self.client = client
+        self.target = target
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+        def instrumented(*args, **kwargs):
+            with span('remote_call', target = self.target, method = name):
+                return attribute(*args, **kwargs)
+        return instrumented
+
+def instrument(client, target):
+    """
+    Returns client wrapped in an InstrumentedClient when instrumentation is enabled, and client itself otherwise,
+    so disabled instrumentation adds no per-call cost.
+    """
+    if not enabled:
+        return client
+    return InstrumentedClient(client, target)
+
+def mongo_command_listener_class():
+    """
+    Defines MongoCommandListener. It subclasses a pymongo class, so it is only built when first used, and importing
+    this module does not load pymongo.
+    """
+    import pymongo.monitoring
+
+    class MongoCommandListener(pymongo.monitoring.CommandListener):
+        """
+        pymongo command listener that times every MongoDB command, labelled with the command name, and counts
+        failures. Register it with pymongo.MongoClient(event_listeners = [MongoCommandListener()]).
+        """
+        def started(self, event):
+            pass
+
+        def succeeded(self, event):
+            observe('mongo_command_seconds', event.duration_micros / 1e6, command = event.command_name)
+            increment('mongo_command_total', command = event.command_name)
+
+        def failed(self, event):
+            observe('mongo_command_seconds', event.duration_micros / 1e6, command = event.command_name)
+            increment('mongo_command_errors_total', command = event.command_name)
+
+    MongoCommandListener.__qualname__ = 'MongoCommandListener'
+    return MongoCommandListener
+
+def __getattr__(name):
+    if name == 'MongoCommandListener':
+        listener_class = mongo_command_listener_class()
+        globals()[name] = listener_class
+        return listener_class
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+
+def format_labels(labels, extra = ()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(key + '="' + str(value).replace('"', '\\"') + '"' for key, value in pairs) + '}'
+
+def to_prometheus():
+    """
+    Returns every counter and histogram in the Prometheus text exposition format.
+    """
+    lines = []
+    with lock:
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(name + format_labels(labels) + ' ' + repr(value))
+        for (name, labels), histogram in sorted(histograms.items()):
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+                cumulative += count
+                lines.append(name + '_bucket' + format_labels(labels, [('le', bound)]) + ' ' + str(cumulative))
+            lines.append(name + '_sum' + format_labels(labels) + ' ' + repr(histogram['sum']))
+            lines.append(name + '_count' + format_labels(labels) + ' ' + str(histogram['count']))
+    return '\n'.join(lines) + '\n'
+
+def to_json_lines():
+    """
+    Returns every counter and histogram as JSON lines, one series per line, stamped with the current time.
+    """
+    now = time.time()
+    lines = []
+    with lock:
+        for (name, labels), value in sorted(counters.items()):
+            lines.append(json.dumps({'time': now, 'type': 'counter', 'name': name, 'labels': dict(labels), 'value': value}))
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines.append(json.dumps({'time': now, 'type': 'histogram', 'name': name, 'labels': dict(labels), 'buckets': histogram['buckets'], 'counts': histogram['counts'], 'sum': histogram['sum'], 'count': histogram['count']}))
+    return '\n'.join(lines) + '\n' if lines else ''
+
+def export(path):
+    """
+    Writes the metrics to path: in the Prometheus text format when it ends in .prom (replacing the file, as the
+    node exporter textfile collector expects), as appended JSON lines otherwise.
+    """
+    if not enabled:
+        return
+    if path.endswith('.prom'):
+        temporary = path + '.tmp'
+        with open(temporary, 'w') as output:
+            output.write(to_prometheus())
+        os.replace(temporary, path)
+    else:
+        with open(path, 'a') as output:
+            output.write(to_json_lines())
@@ -0,0 +1,157 @@
+import json
+import multiprocessing
+import os
+import queue
+import threading
+import time
+import traceback
+import daemon_helpers
+
+def load_accounts(path):
+    """
+    Reads the accounts to run from a JSON file holding a list of objects. Each account needs a 'username'; the
+    optional 'namespace' (the username by default) prefixes its collections and local files, 'env_prefix' is put
+    in front of the credential environment variable names (for example 'BOT2_' reads BOT2_TWITTER_ACCESS_TOKEN),
+    and 'actions_per_cycle' overrides the batch size.
+
+    Returns:
+        list: The account dictionaries, with 'namespace' filled in.
+    """
+    with open(path) as source:
+        accounts = json.load(source)
+    namespaces = set()
+    for account in accounts:
+        if 'username' not in account:
+            raise ValueError('every account in ' + path + ' needs a username')
+        account.setdefault('namespace', account['username'])
+        if account['namespace'] in namespaces:
+            raise ValueError('duplicate account namespace ' + repr(account['namespace']))
+        namespaces.add(account['namespace'])
+    return accounts
+
+def shard(accounts, workers, host_index = 0, host_count = 1):
+    """
+    Splits the accounts between the worker processes of this host. Accounts are first dealt round-robin between
+    host_count hosts, so several hosts started with the same config and different host_index values run disjoint
+    sets, then this host's accounts are dealt round-robin between its workers.
+
+    Returns:
+        list: One list of accounts per worker, empty shards left out.
+    """
+    mine = [account for position, account in enumerate(accounts) if position % host_count == host_index]
+    shards = [mine[worker::workers] for worker in range(workers)]
+    return [accounts for accounts in shards if accounts]
+
+def run_shard(worker, accounts, setup, cycle, shutdown, options, interval, jitter, cycles, reports):
+    """
+    Worker process entry point: sets up a bot per account and runs one cycle of every account per round, on the
+    daemon schedule, until stopped or until cycles rounds have run. Accounts in the same worker share the
+    'shared' dictionary passed to setup, which holds caches that are safe to share between accounts, such as
+    search results. Every account cycle is reported as (namespace, seconds, error) on the reports queue.
+
+    Args:
+        worker (int): The index of the worker.
+        accounts (list): The accounts of this shard.
+        setup (callable): Called as setup(account = account, shared = shared, **options) to build a bot.
+        cycle (callable): Runs one cycle of a bot.
+        shutdown (callable): Releases a bot.
+        options (dict): Extra keyword arguments for setup.
+        interval (float): The base number of seconds between the start of two rounds.
+        jitter (float): The maximum number of seconds randomly added to or removed from each wait.
+        cycles (int, optional): The number of rounds to run, forever when None.
+        reports (multiprocessing.Queue): The queue cycle reports are sent to.
+    """
+    options = dict(options)
+    if options.get('metrics_path'):
+        # the metrics of a process are exported by every bot it runs, one file per worker keeps them apart
+        options['metrics_path'] = options['metrics_path'] + '.' + str(worker)
+    shared = {'search_pools': {}}
+    bots = [(account['namespace'], setup(account = account, shared = shared, **options)) for account in accounts]
+    def run_round():
+        for namespace, bot in bots:
+            start = time.monotonic()
+            error = None
+            try:
+                cycle(bot)
+            except Exception as exception:
+                traceback.print_exc()
+                error = repr(exception)
+                print(namespace + ': cycle failed: ' + error)
+            reports.put((namespace, time.monotonic() - start, error))
+    def shutdown_all():
+        for namespace, bot in bots:
+            shutdown(bot)
+    daemon_helpers.run_forever(run_round, interval, jitter, max_cycles = cycles, on_shutdown = shutdown_all)
+
+def format_throughput(summary):
+    return str(summary['accounts']) + ' accounts, ' + str(summary['cycles']) + ' cycles (' + str(summary['failures']) + ' failed) in ' + format(summary['minutes'], '.2f') + ' min, ' + format(summary['cycles_per_minute'], '.2f') + ' cycles/min'
+
+def run(accounts, setup, cycle, shutdown, workers = None, options = None, interval = 3600, jitter = 0.0, cycles = None, host_index = 0, host_count = 1, report_every = 60):
+    """
+    Runs several accounts at once, each with its own Q-table, logs and credentials, sharded across worker
+    processes. Throughput across all accounts is printed every report_every seconds and when the run ends.
+
+    Args:
+        accounts (list): The accounts, as returned by load_accounts.
+        setup, cycle, shutdown (callable): Build, run one cycle of, and release a bot; see run_shard.
+        workers (int, optional): The number of worker processes, at most one per account. Defaults to the
+            number of CPUs.
+        options (dict, optional): Extra keyword arguments for setup.
+        interval (float): The base number of seconds between two cycles of an account.
+        jitter (float): The maximum number of seconds randomly added to or removed from each wait.
+        cycles (int, optional): The number of cycles per account, forever when None.
+        host_index (int): The index of this host when the accounts are spread over several hosts.
+        host_count (int): The number of hosts.
+        report_every (float): The number of seconds between two throughput reports.
+
+    Returns:
+        dict: The number of accounts, cycles and failed cycles, the elapsed minutes, the cycles per minute
+        and the mean cycle seconds per account.
+    """
+    shards = shard(accounts, workers or os.cpu_count() or 1, host_index, host_count)
+    reports = multiprocessing.Queue()
+    processes = []
+    for worker, accounts_of_worker in enumerate(shards):
+        process = multiprocessing.Process(target = run_shard, args = (worker, accounts_of_worker, setup, cycle, shutdown, options or {}, interval, jitter, cycles, reports), name = 'accounts-' + str(worker))
+        process.start()
+        processes.append(process)
+    # SIGINT and SIGTERM reach the workers too, the parent only waits for them to finish their cycle
+    stop_event = threading.Event()
+    daemon_helpers.install_signal_handlers(stop_event)
+    start = time.monotonic()
+    last_report = start
+    seconds = {}
+    failures = 0
+    def summary():
+        count = sum(len(values) for values in seconds.values())
+        minutes = (time.monotonic() - start) / 60
+        return {
+            'accounts': sum(len(accounts_of_worker) for accounts_of_worker in shards),
+            'cycles': count,
+            'failures': failures,
+            'minutes': minutes,
+            'cycles_per_minute': count / minutes if minutes > 0 else 0.0,
+            'mean_cycle_seconds': {namespace: sum(values) / len(values) for namespace, values in seconds.items()},
+        }
+    def drain(timeout):
+        nonlocal failures
+        try:
+            namespace, elapsed, error = reports.get(timeout = timeout)
+        except queue.Empty:
+            return False
+        seconds.setdefault(namespace, []).append(elapsed)
+        if error is not None:
+            failures += 1
+        return True
+    while any(process.is_alive() for process in processes):
+        drain(1.0)
+        if time.monotonic() - last_report >= report_every:
+            last_report = time.monotonic()
+            print(format_throughput(summary()))
+    for process in processes:
+        process.join()
+    while drain(0.1):
+        pass
+    result = summary()
+    print(format_throughput(result))
+    return result
@@ -1,10 +1,11 @@
-import openai
-import os
-import dotenv
-from dotenv import load_dotenv
-load_dotenv()
+import config_helpers
+import metrics_helpers
 
-api_key = os.getenv('OPENAI_KEY')
+def __getattr__(name):
+    # The key is read from the configuration on first use instead of at import
+    if name == 'api_key':
+        return config_helpers.get('OPENAI_KEY')
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
 
 
 
@@ -28,6 +29,28 @@ def generate_tweet(api_key, model_engine:str, prompt:str):
     prompt:
         The prompt for what you want the GPT model to generate(most likely "Write a motivational tweet")
     """
+    tweet = generate_tweets(api_key, model_engine, prompt, n = 1)[0]
+    return tweet
+
+@metrics_helpers.timed('openai_completion')
+def generate_tweets(api_key, model_engine:str, prompt:str, n:int):
+    """
+    Generates several tweets with a single OpenAI completion request, which is cheaper than n separate requests
+
+    api_key:
+        User api_key from OpenAi
+
+    model_engine:
+        The GPT model being used(most likely "text-davinci-003")
+
+    prompt:
+        The prompt for what you want the GPT model to generate(most likely "Write a motivational tweet")
+
+    n:
+        The number of tweets to generate
+    """
+    # The openai package is by far the slowest import of the bot, and most cycles never generate a tweet
+    import openai
     openai.api_key = api_key
     # Set up OpenAI API authentication
 
@@ -38,13 +61,12 @@ def generate_tweet(api_key, model_engine:str, prompt:str):
         engine=model_engine,
         prompt=prompt,
         max_tokens=240,
-        n=1,
+        n=n,
         stop=None,
         temperature=1,
     )
 
-    tweet = response.choices[0].text.strip()
-    tweet = tweet.replace('"','')
-    return tweet
+    tweets = [choice.text.strip().replace('"','') for choice in response.choices]
+    return tweets
 
 
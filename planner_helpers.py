@@ -0,0 +1,93 @@
+import random
+import numpy as np
+import candidate_helpers
+import qtable_helpers
+
+# API calls each action makes, per endpoint. The search is only made when no candidate pool serves the tweets
+ACTION_COSTS = {
+    'tweet': {'create_tweet': 1},
+    'like': {'like': 1, 'search_recent_tweets': 1},
+    'retweet': {'retweet': 1, 'search_recent_tweets': 1},
+    'follow': {'follow_user': 1, 'search_recent_tweets': 1},
+}
+SEARCH_ENDPOINTS = {'search_recent_tweets'}
+
+# API calls a cycle may spend per endpoint when no other budget is given
+DEFAULT_BUDGET = {
+    'create_tweet': 1,
+    'like': 2,
+    'retweet': 1,
+    'follow_user': 1,
+    'search_recent_tweets': 3,
+}
+
+def cycle_budget(budget = None, rate_limiter = None):
+    """
+    Returns the number of calls the cycle may make per endpoint: the given budget, or DEFAULT_BUDGET, capped by
+    what the rate limiter has left in the current window.
+    """
+    budget = dict(DEFAULT_BUDGET if budget is None else budget)
+    if rate_limiter is not None:
+        for endpoint in budget:
+            budget[endpoint] = min(budget[endpoint], rate_limiter.remaining(endpoint))
+    return budget
+
+def action_cost(action, searches = True):
+    """
+    Returns the calls per endpoint one action makes, leaving out the search when searches is False.
+    """
+    return {endpoint: calls for endpoint, calls in ACTION_COSTS.get(action, {}).items() if searches or endpoint not in SEARCH_ENDPOINTS}
+
+def affordable(action, budget, searches = True):
+    """
+    Tells whether the budget still covers one more of the action. Endpoints missing from the budget are unlimited.
+    """
+    return all(budget.get(endpoint, np.inf) >= calls for endpoint, calls in action_cost(action, searches).items())
+
+def plan(qtable, state, k, epsilon, budget, actions = qtable_helpers.DEFAULT_ACTIONS, candidate_pool = None, query = None, policy = None):
+    """
+    Selects up to k actions for the state, one after the other, each among the actions the remaining budget still
+    covers, and takes the cost of every selected action off the budget. Once the best action's endpoint is spent
+    the next best one is chosen, so a batch mixes actions.
+
+    Without a candidate pool every like, retweet and follow is charged a search. With one, a search is charged
+    for the first action of the batch that would find the pool stale or low, since one refill serves the rest.
+
+    Args:
+        qtable (qtable_helpers.QTable): The Q-table.
+        state (str): The current state.
+        k (int): The largest number of actions in the batch.
+        epsilon (float): The probability of choosing a random affordable action.
+        budget (dict): The calls left per endpoint. It is updated in place.
+        actions (list): The candidate actions.
+        candidate_pool (candidate_helpers.CandidatePool, optional): The pool the targets are taken from.
+        query (str, optional): The search query of the pool.
+        policy (optional): The policy_helpers policy that chooses each action. Epsilon-greedy with epsilon when None.
+
+    Returns:
+        list: The selected actions, possibly fewer than k when the budget runs out.
+    """
+    selected = []
+    refill_charged = False
+    def searches(action):
+        if candidate_pool is None:
+            return True
+        return not refill_charged and action in candidate_helpers.ACTIONS and candidate_pool.needs_refill(query, action)
+    for slot in range(k):
+        options = [action for action in actions if affordable(action, budget, searches(action))]
+        if not options:
+            break
+        if policy is not None:
+            action = policy.select(qtable, state, options)
+        elif np.random.random() < epsilon:
+            action = random.choice(options)
+        else:
+            action = qtable.best_action(state, options)
+        cost = action_cost(action, searches(action))
+        for endpoint, calls in cost.items():
+            if endpoint in budget:
+                budget[endpoint] -= calls
+        if candidate_pool is not None and any(endpoint in SEARCH_ENDPOINTS for endpoint in cost):
+            refill_charged = True
+        selected.append(action)
+    return selected
@@ -0,0 +1,166 @@
+import math
+import random
+import numpy as np
+
+POLICIES = ['epsilon', 'decay', 'ucb', 'thompson']
+
+def allowed_columns(qtable, allowed_actions = None):
+    """
+    Returns the column indexes of the allowed actions, every action when None.
+    """
+    if allowed_actions is None:
+        return np.arange(len(qtable.actions))
+    return np.array([qtable.action_index[action] for action in allowed_actions])
+
+def pick(qtable, columns, scores):
+    """
+    Returns the action of the highest score among the columns, breaking ties at random.
+    """
+    tied = columns[np.flatnonzero(scores == scores.max())]
+    return qtable.actions[random.choice(list(tied))]
+
+def pooled_deviation(qtable, row):
+    """
+    Returns the standard deviation of all the rewards observed in a row, or 1 when it has fewer than two.
+    """
+    total = qtable.counts[row].sum()
+    if total < 2:
+        return 1.0
+    mean = qtable.reward_sums[row].sum() / total
+    return math.sqrt(max(qtable.reward_squares[row].sum() / total - mean ** 2, 0.0)) or 1.0
+
+def reward_moments(qtable, row, columns):
+    """
+    Returns the reward counts, means and standard deviations of the columns of a row. Actions with fewer than two
+    rewards take the pooled deviation of the row.
+    """
+    counts = qtable.counts[row, columns]
+    sums = qtable.reward_sums[row, columns]
+    squares = qtable.reward_squares[row, columns]
+    with np.errstate(divide = 'ignore', invalid = 'ignore'):
+        means = np.where(counts > 0, sums / counts, 0.0)
+        variances = np.where(counts > 1, (squares - counts * means ** 2) / (counts - 1), pooled_deviation(qtable, row) ** 2)
+    return counts, means, np.sqrt(np.maximum(variances, 1e-12))
+
+class EpsilonGreedy:
+    """
+    Chooses a random action with probability epsilon and the action with the highest Q-value otherwise. With a
+    decay, epsilon shrinks with the number of rewards observed in the state, from epsilon towards min_epsilon,
+    so each time bucket explores a lot while it is new and little once it is known.
+
+    The greedy choice ranks actions by Q-value, or by their mean observed reward when greedy is 'reward'. The
+    next state is the next time bucket whatever the action, so the bootstrapped part of a Q-value is shared by
+    every action of a state and only adds noise to the ranking, which matters once a decaying epsilon stops
+    exploring; the 'decay' policy ranks on mean reward for that reason.
+
+    Attributes:
+        epsilon (float): The exploration rate of a state without observations.
+        min_epsilon (float): The exploration rate the decay tends to.
+        decay (str): None for a constant epsilon, 'exponential' to halve the distance to min_epsilon every
+            half_life observations, or 'inverse' for epsilon / (1 + observations / half_life).
+        half_life (float): The number of observations of the decay scale.
+        greedy (str): 'q' to exploit the Q-values, 'reward' to exploit the mean observed rewards.
+    """
+    def __init__(self, epsilon = 0.8, min_epsilon = 0.05, decay = None, half_life = 20, greedy = 'q'):
+        self.epsilon = epsilon
+        self.min_epsilon = min_epsilon
+        self.decay = decay
+        self.half_life = half_life
+        self.greedy = greedy
+
+    def epsilon_for(self, qtable, state):
+        """
+        Returns the exploration rate of a state.
+        """
+        if self.decay is None:
+            return self.epsilon
+        visits = qtable.counts[qtable.row(state)].sum()
+        if self.decay == 'exponential':
+            return self.min_epsilon + (self.epsilon - self.min_epsilon) * 0.5 ** (visits / self.half_life)
+        return max(self.min_epsilon, self.epsilon / (1 + visits / self.half_life))
+
+    def select(self, qtable, state, allowed_actions = None):
+        """
+        Returns the action to take in the state, among allowed_actions when given.
+        """
+        if np.random.random() < self.epsilon_for(qtable, state):
+            return random.choice(list(allowed_actions if allowed_actions is not None else qtable.actions))
+        if self.greedy == 'q':
+            return qtable.best_action(state, allowed_actions)
+        columns = allowed_columns(qtable, allowed_actions)
+        counts, means, stds = reward_moments(qtable, qtable.row(state), columns)
+        return pick(qtable, columns, means)
+
+class UCB1:
+    """
+    Upper confidence bound policy: every action of a state is tried once, then the action with the highest mean
+    reward plus c * std * sqrt(ln(n) / n_a) is chosen, where n is the number of rewards observed in the state, n_a
+    those of the action and std the standard deviation of the state's rewards, which puts the bonus in the units
+    of the engagement counts. Actions are only retried while they could still be the best one.
+
+    Attributes:
+        c (float): The weight of the exploration bonus.
+    """
+    def __init__(self, c = math.sqrt(2)):
+        self.c = c
+
+    def scores(self, qtable, state, allowed_actions = None):
+        """
+        Returns the columns of the allowed actions and their upper confidence bounds, infinite for untried ones.
+        """
+        row = qtable.row(state)
+        columns = allowed_columns(qtable, allowed_actions)
+        counts, means, stds = reward_moments(qtable, row, columns)
+        total = max(qtable.counts[row].sum(), 1.0)
+        # the bonus uses the pooled deviation of the state, per-action estimates from a few rewards are too noisy
+        bonus = np.where(counts > 0, self.c * pooled_deviation(qtable, row) * np.sqrt(math.log(total) / np.maximum(counts, 1)), np.inf)
+        return columns, means + bonus
+
+    def select(self, qtable, state, allowed_actions = None):
+        """
+        Returns the action to take in the state, among allowed_actions when given.
+        """
+        columns, scores = self.scores(qtable, state, allowed_actions)
+        return pick(qtable, columns, scores)
+
+class ThompsonSampling:
+    """
+    Gaussian Thompson sampling: the mean reward of each action of a state is drawn from a normal posterior
+    centred on the observed mean, shrunk towards prior_mean by prior_strength pseudo-observations, with a standard
+    deviation of the reward deviation over sqrt(n_a + prior_strength), and the action with the highest draw is
+    chosen. Actions are picked in proportion to the chance that they are the best one.
+
+    Attributes:
+        prior_mean (float): The mean reward assumed before any observation.
+        prior_strength (float): The number of pseudo-observations the prior is worth.
+    """
+    def __init__(self, prior_mean = 0.0, prior_strength = 1.0):
+        self.prior_mean = prior_mean
+        self.prior_strength = prior_strength
+
+    def select(self, qtable, state, allowed_actions = None):
+        """
+        Returns the action to take in the state, among allowed_actions when given.
+        """
+        row = qtable.row(state)
+        columns = allowed_columns(qtable, allowed_actions)
+        counts, means, stds = reward_moments(qtable, row, columns)
+        weight = counts + self.prior_strength
+        posterior_means = (counts * means + self.prior_strength * self.prior_mean) / weight
+        draws = np.random.normal(posterior_means, stds / np.sqrt(weight))
+        return pick(qtable, columns, draws)
+
+def make_policy(name, epsilon = 0.8):
+    """
+    Builds a policy by name: 'epsilon' for a constant epsilon-greedy policy on the Q-values, 'decay' for
+    epsilon-greedy on the mean rewards with an exponentially decaying epsilon per time bucket, 'ucb' for UCB1 or 'thompson' for Thompson sampling.
+    """
+    if name == 'epsilon':
+        return EpsilonGreedy(epsilon)
+    if name == 'decay':
+        return EpsilonGreedy(epsilon, decay = 'exponential', greedy = 'reward')
+    if name == 'ucb':
+        return UCB1()
+    if name == 'thompson':
+        return ThompsonSampling()
+    raise ValueError('unknown policy ' + repr(name) + ', expected one of ' + ', '.join(POLICIES))
@@ -1,23 +1,129 @@
-import pymongo
 import time_helpers
 import twitter_helpers
 import openai_helpers
 import numpy as np
 import random
-import twitter_helpers
-import openai_helpers
-import datetime
-import pytz
+import engagement_helpers
+import qtable_helpers
+import action_log_helpers
+import metrics_helpers
+import fanout_helpers
+import planner_helpers
+
+MODEL_ENGINE = "text-davinci-003"
+PROMPT = "Write a motivational tweet"
+QUERY = 'motivation -is:retweet lang:en'
+
+def interaction_calls(client_bearer, username, metrics_table = None, snapshot_store = None):
+    """
+    Returns the reads get_interaction_count is made of, the like and retweet totals and the follower count, as
+    calls for fanout_helpers.gather. Callers that already fan out other reads add these to theirs, so all of them
+    run at the same time, and pass the results to count_interactions.
+    """
+    if metrics_table is None:
+        count_lr = lambda: twitter_helpers.get_total_lr(client_bearer, username)
+    else:
+        count_lr = lambda: engagement_helpers.get_total_lr_incremental(client_bearer, username, metrics_table, snapshot_store = snapshot_store)
+    return {'lr': count_lr, 'followers': lambda: twitter_helpers.get_follower_count(client_bearer,username)}
+
+def count_interactions(counts, snapshot_store = None):
+    """
+    Returns the interaction count from the results of the interaction_calls reads, appending them to the snapshot
+    store when one is given.
+    """
+    lr_count = counts['lr']
+    follow_count = int(counts['followers'])
+    if snapshot_store is not None:
+        snapshot_store.record_account(follow_count, lr_count['likes'], lr_count['retweets'])
+    lr_count = lr_count['likes'] + lr_count['retweets']
+    return lr_count + follow_count
+
+def get_interaction_count(client_bearer, username, metrics_table = None, snapshot_store = None):
+    """
+    Returns the total number of likes, retweets and followers of the account, which is the quantity the agent
+    tries to maximise.
+
+    Args:
+        client_bearer: A tweepy Client object with a bearer token.
+        username (str): The Twitter username of the agent.
+        metrics_table (pymongo.collection.Collection, optional): The MongoDB collection that stores per-tweet
+            engagement metrics. If None, the whole timeline is rescanned with twitter_helpers.get_total_lr.
+        snapshot_store (snapshot_helpers.SnapshotStore, optional): Store the account totals, and with a
+            metrics_table the per-tweet counts, are appended to as snapshots for delayed reward attribution.
+
+    Returns:
+        int: The interaction count of the account.
+    """
+    #the timeline and the follower count are independent reads, fetched at the same time
+    return count_interactions(fanout_helpers.gather(interaction_calls(client_bearer, username, metrics_table, snapshot_store)), snapshot_store)
+
+def prepare_tweet(openai_key, model_engine, prompt, tweet_buffer = None, duplicate_index = None, max_attempts = 3):
+    """
+    Returns the text of the next tweet to post: popped from the buffer when there is one, generated otherwise, and
+    replaced while it nearly repeats a posted tweet.
+
+    Returns:
+        str: The tweet, or None if every one of the max_attempts tweets was a near-duplicate.
+    """
+    for attempt in range(max_attempts):
+        tweet = None
+        if tweet_buffer is not None:
+            tweet = tweet_buffer.pop(model_engine, prompt)
+        if tweet is None:
+            tweet = openai_helpers.generate_tweet(openai_key,model_engine, prompt)
+        if duplicate_index is None or not duplicate_index.is_duplicate(tweet):
+            return tweet
+        metrics_helpers.increment('duplicate_tweets_total')
+        print('discarded a near-duplicate tweet')
+    return None
+
+def select_target(action, client_bearer, openai_key, candidate_pool = None, tweet_buffer = None, follow_index = None, duplicate_index = None, max_tweet_attempts = 3):
+    """
+    Makes the reads an action needs before it can be performed: the text to post for a tweet, the tweet to act on
+    for a like, retweet or follow.
+
+    Returns:
+        The tweet text or the selected tweepy Tweet, None if nothing usable was found.
+    """
+    if action == 'tweet':
+        return prepare_tweet(openai_key, MODEL_ENGINE, PROMPT, tweet_buffer, duplicate_index, max_tweet_attempts)
+    return twitter_helpers.select_tweet(client_bearer, QUERY, action, candidate_pool, follow_index)
 
-def execute_action(qtable,action_table, alpha, gamma, epsilon, client, client_bearer, openai_key, username):
+def perform_action(action, target, client, client_bearer, candidate_pool = None, follow_index = None, duplicate_index = None):
+    """
+    Performs an action on Twitter with the target chosen by select_target.
+
+    Returns:
+        dict: The extra fields to log with the action, or None if the action was skipped and must not be logged.
+    """
+    if action == 'tweet':
+        if target is None:
+            print('every generated tweet was a near-duplicate, skipping the tweet')
+            return None
+        sent_tweet = twitter_helpers.send_tweet(client, target)
+        if duplicate_index is not None:
+            duplicate_index.add(target)
+        #the tweet id lets the engagement of this tweet be credited to this action later
+        return {'tweet_id': int(sent_tweet.data['id'])}
+    elif action == 'like':
+        like = twitter_helpers.like_motavational_tweet(client, client_bearer, QUERY, candidate_pool, target)
+    elif action == 'retweet':
+        retweet = twitter_helpers.retweet_motavational_tweet(client, client_bearer, QUERY, candidate_pool, target)
+    else:
+        follow = twitter_helpers.follow_account(client, client_bearer, QUERY, candidate_pool, follow_index, target)
+    return {}
+
+def execute_action(qtable,action_table, alpha, gamma, epsilon, client, client_bearer, openai_key, username, metrics_table = None, candidate_pool = None, rate_limiter = None, tweet_buffer = None, follow_index = None, snapshot_store = None, duplicate_index = None, max_tweet_attempts = 3, policy = None):
     """
     Chooses an action based on the Q-values in the Q-table and performs the action on Twitter. Updates the action
-    table with the details of the action performed.
+    table with the details of the action performed. The choice only needs the in-memory Q-table, so the reads the
+    action depends on (the interaction count, and the tweet to post or the tweet to act on) are made at the same
+    time once the action is known.
 
     Parameters:
     -----------
-    qtable: pymongo.collection.Collection
-        MongoDB collection containing Q-values for all state-action pairs.
+    qtable: qtable_helpers.QTable or pymongo.collection.Collection
+        In-memory Q-table, or the MongoDB collection containing Q-values for all state-action pairs.
     action_table: pymongo.collection.Collection
         MongoDB collection containing details of all actions performed by the agent.
     alpha: float
@@ -35,6 +141,29 @@ def execute_action(qtable,action_table, alpha, gamma, epsilon, client, client_be
         OpenAI API key used to access GPT-3 for tweet generation.
     username: str
         Twitter username of the agent.
+    metrics_table: pymongo.collection.Collection, optional
+        MongoDB collection holding per-tweet engagement metrics. When given, the interaction count is computed
+        incrementally instead of rescanning the whole timeline.
+    candidate_pool: candidate_helpers.CandidatePool, optional
+        Pool of searched tweets shared by the like, retweet and follow actions. When given, those actions are
+        served from the pool instead of running a new search each time.
+    rate_limiter: rate_limit_helpers.RateLimiter, optional
+        Limiter the clients are wrapped with. When given, actions whose endpoints have no quota left are not chosen.
+    tweet_buffer: tweet_buffer_helpers.TweetBuffer, optional
+        Buffer of pre-generated tweets. When given, a tweet action pops a ready tweet instead of waiting for OpenAI.
+    follow_index: follow_graph_helpers.FollowIndex, optional
+        Index of the accounts already followed or attempted. When given, the follow action skips them without
+        calling the API.
+    snapshot_store: snapshot_helpers.SnapshotStore, optional
+        Store the engagement counts read for this action are appended to.
+    duplicate_index: dedup_helpers.DuplicateIndex, optional
+        Index of the posted tweets. When given, a generated tweet that nearly repeats one of them is discarded and
+        replaced, and the posted tweet is added to the index.
+    max_tweet_attempts: int
+        The number of tweets tried before a tweet action is given up because every one was a duplicate.
+    policy: policy_helpers.EpsilonGreedy, UCB1 or ThompsonSampling, optional
+        Exploration policy that chooses the action from the Q-table and its reward statistics. When None, the
+        action is chosen epsilon-greedy with the given epsilon.
 
     Returns:
     --------
@@ -42,43 +171,87 @@ def execute_action(qtable,action_table, alpha, gamma, epsilon, client, client_be
     """
     state = time_helpers.get_state()
     print(state)
-    qtable_doc = qtable.find_one({'time_bucket': state})
+    qtable, _ = qtable_helpers.as_qtable(qtable)
     possible_actions = ['tweet', 'like', 'retweet', 'follow']
-    query = 'motivation -is:retweet lang:en'
-    lr_count = twitter_helpers.get_total_lr(client_bearer, username)
-    lr_count = lr_count['likes'] + lr_count['retweets']
-    follow_count = int(twitter_helpers.get_follower_count(client_bearer,username))
-    interaction_count = lr_count + follow_count
-    if np.random.random() < epsilon:
+    if rate_limiter is not None:
+        possible_actions = rate_limiter.allowed_actions(possible_actions)
+        if not possible_actions:
+            print('every action is rate limited, skipping this cycle')
+            return
+    if policy is not None:
+        action = policy.select(qtable, state, possible_actions)
+    elif np.random.random() < epsilon:
         # Choose a random action
         action = random.choice(possible_actions)
     else:
-        max_value = max(qtable_doc['actions'].values())
-        tied_actions = [key for key, value in qtable_doc['actions'].items() if value == max_value]
-        action = random.choice(tied_actions)
+        action = qtable.best_action(state, possible_actions)
 
-    if action == 'tweet':
-        model_engine = "text-davinci-003"
-        prompt = "Write a motivational tweet"
-        tweet = openai_helpers.generate_tweet(openai_key,model_engine, prompt)
-        sent_tweet = twitter_helpers.send_tweet(client, tweet)
-        action_table.insert_one({'datetime':datetime.datetime.now(pytz.timezone('America/New_York')),'state':state, 'action': action, 'interactions': interaction_count})
-    elif action == 'like':
-        like = twitter_helpers.like_motavational_tweet(client, client_bearer, query)
-        action_table.insert_one({'datetime':datetime.datetime.now(pytz.timezone('America/New_York')),'state':state, 'action': action, 'interactions': interaction_count})
-    elif action == 'retweet':
-        retweet = twitter_helpers.retweet_motavational_tweet(client, client_bearer, query)
-        action_table.insert_one({'datetime':datetime.datetime.now(pytz.timezone('America/New_York')),'state':state, 'action': action, 'interactions': interaction_count})
-    else:
-        follow = twitter_helpers.follow_account(client, client_bearer, query)
-        action_table.insert_one({'datetime':datetime.datetime.now(pytz.timezone('America/New_York')), 'state':state, 'action': action, 'interactions': interaction_count})
+    #the target is selected while the interaction count is read
+    read = fanout_helpers.gather(dict(interaction_calls(client_bearer, username, metrics_table, snapshot_store),
+        target = lambda: select_target(action, client_bearer, openai_key, candidate_pool, tweet_buffer, follow_index, duplicate_index, max_tweet_attempts)))
+    interaction_count = count_interactions(read, snapshot_store)
+
+    fields = perform_action(action, read['target'], client, client_bearer, candidate_pool, follow_index, duplicate_index)
+    if fields is not None:
+        action_log_helpers.record_action(action_table, state, action, interaction_count, **fields)
     return
 
-def get_results(qtable,action_table, alpha, gamma, epsilon, client, client_bearer, openai_key, username):
+def execute_actions(qtable,action_table, alpha, gamma, epsilon, client, client_bearer, openai_key, username, k, budget = None, metrics_table = None, candidate_pool = None, rate_limiter = None, tweet_buffer = None, follow_index = None, snapshot_store = None, duplicate_index = None, max_tweet_attempts = 3, policy = None):
+    """
+    Plans and performs a batch of up to k actions in one cycle. The actions are chosen one after the other, by the
+    policy or epsilon-greedy, within a per-endpoint budget of API calls, the engagement is measured once for the whole batch, and the
+    batch is written to the action log with a single insert. get_results splits the next reward between the
+    actions of the batch.
+
+    Parameters:
+    -----------
+    k: int
+        The largest number of actions performed in the cycle.
+    budget: dict, optional
+        API calls the cycle may make per endpoint, planner_helpers.DEFAULT_BUDGET by default. It is also capped by
+        the quota the rate limiter has left.
+
+    The other parameters are those of execute_action.
+
+    Returns:
+    --------
+    list: The actions performed.
+    """
+    state = time_helpers.get_state()
+    print(state)
+    qtable, _ = qtable_helpers.as_qtable(qtable)
+    budget = planner_helpers.cycle_budget(budget, rate_limiter)
+    actions = planner_helpers.plan(qtable, state, k, epsilon, budget, candidate_pool = candidate_pool, query = QUERY, policy = policy)
+    if not actions:
+        print('the API budget of this cycle is spent, skipping this cycle')
+        return []
+
+    #the targets are selected on one thread, so the candidate pool never hands the same tweet out twice
+    read = fanout_helpers.gather(dict(interaction_calls(client_bearer, username, metrics_table, snapshot_store),
+        targets = lambda: [select_target(action, client_bearer, openai_key, candidate_pool, tweet_buffer, follow_index, duplicate_index, max_tweet_attempts) for action in actions]),
+        timeouts = {'targets': fanout_helpers.DEFAULT_TIMEOUT * len(actions)})
+    interaction_count = count_interactions(read, snapshot_store)
+
+    performed = []
+    fields = []
+    #the actions already performed are logged even if a later one raises, so the next reward is not lost
+    try:
+        for action, target in zip(actions, read['targets']):
+            action_fields = perform_action(action, target, client, client_bearer, candidate_pool, follow_index, duplicate_index)
+            if action_fields is not None:
+                performed.append(action)
+                fields.append(action_fields)
+    finally:
+        if performed:
+            action_log_helpers.record_actions(action_table, state, performed, interaction_count, fields)
+    return performed
+
+def get_results(qtable,action_table, alpha, gamma, epsilon, client, client_bearer, openai_key, username, metrics_table = None, snapshot_store = None):
     """Calculates and updates Q-values based on the most recent action taken.
 
     Args:
-        qtable (pymongo.collection.Collection): The MongoDB collection that stores Q-values.
+        qtable (qtable_helpers.QTable or pymongo.collection.Collection): The in-memory Q-table, or the MongoDB
+            collection that stores Q-values. A collection is wrapped and flushed before returning.
         action_table (pymongo.collection.Collection): The MongoDB collection that stores previous actions.
         alpha (float): The learning rate, which determines how much the new Q-value is influenced by the reward.
         gamma (float): The discount factor, which determines the weight of future rewards.
@@ -87,23 +260,39 @@ def get_results(qtable,action_table, alpha, gamma, epsilon, client, client_beare
         client_bearer (tweepy.bearer.Bearer): The Tweepy Bearer object.
         openai_key (str): The OpenAI API key.
         username (str): The Twitter username of the account being used.
+        metrics_table (pymongo.collection.Collection, optional): The MongoDB collection that stores per-tweet
+            engagement metrics, used to count interactions incrementally.
+        snapshot_store (snapshot_helpers.SnapshotStore, optional): Store the engagement counts read for the reward
+            are appended to.
 
     Returns:
         None
     """
-    if(list(action_table.find())):
-        prev_action = action_table.find().sort('datetime', -1).limit(1)[0]
-        lr_count = twitter_helpers.get_total_lr(client_bearer,username)
-        lr_count = lr_count['likes'] + lr_count['retweets']
-        follow_count = int(twitter_helpers.get_follower_count(client_bearer,username))
-        interaction_count = lr_count + follow_count
+    #the previous action, the interaction count reads and the Q-table are independent, made at the same time. The
+    #count is only wasted on the very first run, when there is no previous action yet
+    read = fanout_helpers.gather(dict(interaction_calls(client_bearer, username, metrics_table, snapshot_store),
+        prev_action = lambda: action_log_helpers.latest_action(action_table),
+        qtable = lambda: qtable_helpers.as_qtable(qtable)))
+    interaction_count = count_interactions(read, snapshot_store)
+    prev_action = read['prev_action']
+    if prev_action is not None:
         reward = interaction_count - prev_action['interactions']
-        qval_prev = qtable.find_one({'time_bucket': prev_action['state']})
-        print(qval_prev)
-        qval_prev = qval_prev['actions'][prev_action['action']]
-        q_value = (1 - alpha) * qval_prev + alpha * (reward + gamma *50)
-        update_spot = 'actions.' + prev_action['action']
-        qtable.update_one({'time_bucket':prev_action['state']}, {'$set':{update_spot:q_value}})
+        qtable, owned = read['qtable']
+        print(qtable.as_dict(prev_action['state']))
+        #a batch shares the reward of the cycle equally between its actions
+        batch = action_log_helpers.latest_batch(action_table, prev_action)
+        reward = reward / len(batch)
+        #the state the next action is taken in is the next state of the previous batch
+        next_value = qtable.max_value(time_helpers.get_state())
+        for prev_action in batch:
+            qval_prev = qtable.get(prev_action['state'], prev_action['action'])
+            q_value = (1 - alpha) * qval_prev + alpha * (reward + gamma * next_value)
+            qtable.update(prev_action['state'], prev_action['action'], q_value)
+            qtable.record(prev_action['state'], prev_action['action'], reward)
+            metrics_helpers.observe('reward', reward, metrics_helpers.VALUE_BUCKETS, state = prev_action['state'], action = prev_action['action'])
+            metrics_helpers.observe('q_value_delta', q_value - qval_prev, metrics_helpers.VALUE_BUCKETS, state = prev_action['state'], action = prev_action['action'])
+        if owned:
+            qtable.flush()
     else:
         return
 
@@ -0,0 +1,265 @@
+import time
+import random
+import numpy as np
+import storage_helpers
+
+DEFAULT_ACTIONS = ['tweet', 'like', 'retweet', 'follow']
+
+class StaleQTableError(Exception):
+    """
+    Raised when a flush finds that another process changed Q-table rows since they were loaded.
+    """
+    def __init__(self, states):
+        super().__init__('Q-table rows changed by another writer: ' + ', '.join(str(state) for state in states))
+        self.states = states
+
+class QTable:
+    """
+    In-memory copy of the MongoDB qtable collection. All rows are loaded once into a dense states x actions NumPy
+    array, lookups and updates happen in memory, and changed rows are written back with a single bulk_write when
+    flush is called. Every row carries a version number that is checked and incremented on write, so a flush
+    never silently overwrites rows that another process changed in the meantime. Next to the Q-values, each row
+    keeps the number of rewards observed per action and their sum and sum of squares, which the exploration
+    policies of policy_helpers read; they are stored in the 'stats' field of the row document.
+
+    Attributes:
+        collection (pymongo.collection.Collection): The MongoDB collection backing the table.
+        states (list): The time buckets, in row order.
+        actions (list): The action names, in column order.
+        values (numpy.ndarray): The Q-values, indexed by state row and action column.
+        counts (numpy.ndarray): The number of rewards observed, indexed like values.
+        reward_sums (numpy.ndarray): The sum of the observed rewards, indexed like values.
+        reward_squares (numpy.ndarray): The sum of the squared observed rewards, indexed like values.
+    """
+    def __init__(self, collection, actions = None, flush_interval = 300):
+        """
+        Args:
+            collection (pymongo.collection.Collection): The MongoDB collection that stores Q-values.
+            actions (list, optional): The action names. Defaults to the actions found in the collection, or
+                DEFAULT_ACTIONS when it is empty.
+            flush_interval (float): The number of seconds flush_if_due waits between two flushes.
+        """
+        self.collection = collection
+        self.flush_interval = flush_interval
+        self.actions = list(actions) if actions is not None else None
+        self.ensure_index()
+        self.load()
+
+    def ensure_index(self):
+        """
+        Creates the unique index on time_bucket, so two writers adding the same new state cannot both insert a row.
+        """
+        try:
+            self.collection.create_index([('time_bucket', storage_helpers.ASCENDING)], unique = True)
+        except storage_helpers.pymongo_errors().OperationFailure as error:
+            print('qtable: time_bucket is not unique, concurrent inserts of new states are not detected: ' + str(error))
+
+    def load(self):
+        """
+        Reads every row of the collection and rebuilds the array and index maps, dropping unflushed changes.
+        """
+        docs = sorted(self.collection.find({}), key = lambda doc: str(doc['time_bucket']))
+        if self.actions is None:
+            self.actions = []
+            for doc in docs:
+                for action in doc['actions']:
+                    if action not in self.actions:
+                        self.actions.append(action)
+            if not self.actions:
+                self.actions = list(DEFAULT_ACTIONS)
+        self.states = [doc['time_bucket'] for doc in docs]
+        self.state_index = {state: row for row, state in enumerate(self.states)}
+        self.action_index = {action: column for column, action in enumerate(self.actions)}
+        self.values = np.zeros((len(self.states), len(self.actions)))
+        self.counts = np.zeros_like(self.values)
+        self.reward_sums = np.zeros_like(self.values)
+        self.reward_squares = np.zeros_like(self.values)
+        self.versions = {}
+        for row, doc in enumerate(docs):
+            self.load_row(row, doc)
+            self.versions[doc['time_bucket']] = doc.get('version', 0)
+        self.dirty = set()
+        self.new_states = set()
+        self.last_flush = time.monotonic()
+
+    def load_row(self, row, doc):
+        """
+        Copies the Q-values and reward statistics of a row document into the arrays.
+        """
+        for action, value in doc['actions'].items():
+            self.values[row, self.action_index[action]] = value
+        stats = doc.get('stats') or {}
+        for name, array in (('count', self.counts), ('reward_sum', self.reward_sums), ('reward_square', self.reward_squares)):
+            for action, value in stats.get(name, {}).items():
+                array[row, self.action_index[action]] = value
+
+    def add_state(self, state):
+        """
+        Adds a zero-valued row for a state that is not in the collection yet and returns its row index.
+        """
+        self.state_index[state] = len(self.states)
+        self.states.append(state)
+        self.values = np.vstack([self.values, np.zeros((1, len(self.actions)))])
+        self.counts = np.vstack([self.counts, np.zeros((1, len(self.actions)))])
+        self.reward_sums = np.vstack([self.reward_sums, np.zeros((1, len(self.actions)))])
+        self.reward_squares = np.vstack([self.reward_squares, np.zeros((1, len(self.actions)))])
+        self.versions[state] = 0
+        self.new_states.add(state)
+        return self.state_index[state]
+
+    def row(self, state):
+        """
+        Returns the row index of a state, adding the state if it is unknown.
+        """
+        if state not in self.state_index:
+            return self.add_state(state)
+        return self.state_index[state]
+
+    def get(self, state, action):
+        """
+        Returns the Q-value of a state-action pair.
+        """
+        row = self.row(state)
+        return float(self.values[row, self.action_index[action]])
+
+    def as_dict(self, state):
+        """
+        Returns the Q-values of a state as an action -> value dictionary, like the 'actions' field of a row document.
+        """
+        index = self.row(state)
+        row = self.values[index]
+        return {action: float(row[column]) for column, action in enumerate(self.actions)}
+
+    def stats_dict(self, state):
+        """
+        Returns the reward statistics of a state as stored in the 'stats' field of a row document.
+        """
+        index = self.row(state)
+        return {
+            name: {action: float(array[index, column]) for column, action in enumerate(self.actions)}
+            for name, array in (('count', self.counts), ('reward_sum', self.reward_sums), ('reward_square', self.reward_squares))
+        }
+
+    def max_value(self, state):
+        """
+        Returns the largest Q-value of a state.
+        """
+        index = self.row(state)
+        return float(self.values[index].max())
+
+    def best_action(self, state, allowed_actions = None):
+        """
+        Returns the action with the highest Q-value for a state, breaking ties at random.
+
+        Args:
+            state: The time bucket.
+            allowed_actions (list, optional): Restrict the choice to these actions.
+
+        Returns:
+            str: The chosen action.
+        """
+        index = self.row(state)
+        row = self.values[index]
+        if allowed_actions is not None:
+            columns = np.array([self.action_index[action] for action in allowed_actions])
+            row_values = row[columns]
+            tied = columns[np.flatnonzero(row_values == row_values.max())]
+        else:
+            tied = np.flatnonzero(row == row.max())
+        return self.actions[random.choice(list(tied))]
+
+    def update(self, state, action, value):
+        """
+        Sets the Q-value of a state-action pair in memory and marks the row for the next flush.
+        """
+        row = self.row(state)
+        self.values[row, self.action_index[action]] = value
+        self.dirty.add(state)
+
+    def record(self, state, action, reward):
+        """
+        Adds an observed reward to the statistics of a state-action pair and marks the row for the next flush.
+        """
+        row = self.row(state)
+        column = self.action_index[action]
+        self.counts[row, column] += 1
+        self.reward_sums[row, column] += reward
+        self.reward_squares[row, column] += reward * reward
+        self.dirty.add(state)
+
+    def flush(self):
+        """
+        Writes all changed rows back to MongoDB in one bulk_write. A row is only written if its version still
+        matches the version that was loaded, and a new state is inserted, so the unique time_bucket index rejects
+        it if another writer inserted it first; rows changed by another writer are reloaded from MongoDB, dropping
+        the local change, and reported with StaleQTableError.
+
+        Returns:
+            int: The number of rows written.
+        """
+        self.last_flush = time.monotonic()
+        if not self.dirty:
+            return 0
+        import pymongo
+        states = sorted(self.dirty, key = str)
+        operations = []
+        for state in states:
+            if state in self.new_states:
+                operations.append(pymongo.InsertOne({'time_bucket': state, 'actions': self.as_dict(state), 'stats': self.stats_dict(state), 'version': 1}))
+                continue
+            version = self.versions[state]
+            version_filter = version if version else {'$in': [0, None]}
+            operations.append(pymongo.UpdateOne(
+                {'time_bucket': state, 'version': version_filter},
+                {'$set': {'actions': self.as_dict(state), 'stats': self.stats_dict(state)}, '$inc': {'version': 1}}))
+        try:
+            result = self.collection.bulk_write(operations, ordered = False)
+            written = result.matched_count + result.inserted_count
+        except pymongo.errors.BulkWriteError as error:
+            # A duplicate time_bucket means another writer inserted the state first, it is reloaded below
+            if any(write_error['code'] != 11000 for write_error in error.details['writeErrors']):
+                raise
+            written = error.details['nMatched'] + error.details['nInserted']
+        self.dirty = set()
+        if written == len(operations):
+            for state in states:
+                self.versions[state] += 1
+            self.new_states -= set(states)
+            return written
+        stale = []
+        for state in states:
+            doc = self.collection.find_one({'time_bucket': state})
+            if doc is not None and doc.get('version', 0) == self.versions[state] + 1 and doc['actions'] == self.as_dict(state):
+                self.versions[state] += 1
+                continue
+            stale.append(state)
+            if doc is not None:
+                self.load_row(self.row(state), doc)
+                self.versions[state] = doc.get('version', 0)
+        self.new_states -= set(states)
+        raise StaleQTableError(stale)
+
+    def flush_if_due(self):
+        """
+        Flushes if at least flush_interval seconds passed since the last flush.
+
+        Returns:
+            int: The number of rows written.
+        """
+        if time.monotonic() - self.last_flush >= self.flush_interval:
+            return self.flush()
+        return 0
+
+def as_qtable(qtable):
+    """
+    Wraps a qtable collection in a QTable, or returns an existing QTable as it is.
+
+    Args:
+        qtable (QTable or pymongo.collection.Collection): The Q-table or the collection storing it.
+
+    Returns:
+        tuple: The QTable and a flag telling whether it was created here, in which case the caller has to flush it.
+    """
+    if isinstance(qtable, QTable):
+        return qtable, False
+    return QTable(qtable), True
@@ -0,0 +1,202 @@
+import random
+import threading
+import time
+import metrics_helpers
+
+# Requests allowed per 15 minute window for the endpoints the bot uses, used until the API reports the real limits
+DEFAULT_LIMITS = {
+    'create_tweet': 200,
+    'like': 50,
+    'retweet': 50,
+    'follow_user': 50,
+    'search_recent_tweets': 450,
+    'get_user': 300,
+    'get_users_tweets': 1500,
+    'get_tweets': 300,
+    'get_users_following': 15,
+}
+WINDOW = 900
+
+# Write endpoints each action needs, used to steer the agent away from actions whose quota is used up
+ACTION_ENDPOINTS = {
+    'tweet': ['create_tweet'],
+    'like': ['like'],
+    'retweet': ['retweet'],
+    'follow': ['follow_user'],
+}
+
+class QuotaExhausted(Exception):
+    """
+    Raised when an endpoint has no requests left and its window resets later than the limiter is willing to wait.
+    """
+    def __init__(self, endpoint, reset_in):
+        super().__init__(endpoint + ' is rate limited for another ' + format(reset_in, '.0f') + 's')
+        self.endpoint = endpoint
+        self.reset_in = reset_in
+
+class RateLimiter:
+    """
+    Tracks a token bucket per API endpoint and schedules calls against it. Buckets start from DEFAULT_LIMITS and
+    are corrected from the x-rate-limit-* headers of every response. A call to an exhausted endpoint waits for the
+    window to reset when that is at most max_wait seconds away and raises QuotaExhausted otherwise. A 429 or
+    5xx response is retried with exponential backoff and jitter, or until the reported reset time.
+
+    Attributes:
+        buckets (dict): Per endpoint, a dictionary with the keys 'limit', 'remaining' and 'reset' (epoch seconds).
+    """
+    def __init__(self, max_wait = 60, max_retries = 3, backoff_base = 1.0, backoff_cap = 60, limits = None):
+        """
+        Args:
+            max_wait (float): The longest number of seconds a call is deferred for an exhausted endpoint.
+            max_retries (int): The number of retries after a 429 or 5xx response.
+            backoff_base (float): The first backoff delay in seconds, doubled on every retry.
+            backoff_cap (float): The longest backoff delay in seconds.
+            limits (dict, optional): Requests per window per endpoint, overriding DEFAULT_LIMITS.
+        """
+        self.max_wait = max_wait
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.limits = dict(DEFAULT_LIMITS)
+        if limits:
+            self.limits.update(limits)
+        self.buckets = {}
+        self.lock = threading.Lock()
+        self.last_headers = threading.local()
+
+    def bucket(self, endpoint):
+        """
+        Returns the bucket of an endpoint, refilled if its window has reset.
+        """
+        now = time.time()
+        bucket = self.buckets.get(endpoint)
+        if bucket is None or now >= bucket['reset']:
+            limit = bucket['limit'] if bucket is not None else self.limits.get(endpoint, 300)
+            bucket = {'limit': limit, 'remaining': limit, 'reset': now + WINDOW}
+            self.buckets[endpoint] = bucket
+        return bucket
+
+    def remaining(self, endpoint):
+        """
+        Returns the number of requests left for an endpoint in the current window.
+        """
+        with self.lock:
+            return self.bucket(endpoint)['remaining']
+
+    def has_quota(self, endpoints):
+        """
+        Tells whether every endpoint in the list has at least one request left.
+        """
+        return all(self.remaining(endpoint) > 0 for endpoint in endpoints)
+
+    def allowed_actions(self, actions):
+        """
+        Returns the actions whose endpoints all have quota left.
+        """
+        return [action for action in actions if self.has_quota(ACTION_ENDPOINTS.get(action, []))]
+
+    def update_from_headers(self, endpoint, headers):
+        """
+        Corrects the bucket of an endpoint from x-rate-limit-limit, x-rate-limit-remaining and x-rate-limit-reset.
+        """
+        if not headers or 'x-rate-limit-remaining' not in headers:
+            return
+        with self.lock:
+            bucket = self.bucket(endpoint)
+            bucket['remaining'] = int(headers['x-rate-limit-remaining'])
+            if 'x-rate-limit-limit' in headers:
+                bucket['limit'] = int(headers['x-rate-limit-limit'])
+            if 'x-rate-limit-reset' in headers:
+                bucket['reset'] = float(headers['x-rate-limit-reset'])
+
+    def acquire(self, endpoint):
+        """
+        Takes one token from an endpoint's bucket, waiting for the window to reset if needed.
+        """
+        while True:
+            with self.lock:
+                bucket = self.bucket(endpoint)
+                if bucket['remaining'] > 0:
+                    bucket['remaining'] -= 1
+                    return
+                reset_in = bucket['reset'] - time.time()
+            if reset_in > self.max_wait:
+                metrics_helpers.increment('rate_limit_exhausted_total', endpoint = endpoint)
+                raise QuotaExhausted(endpoint, reset_in)
+            metrics_helpers.increment('rate_limit_deferrals_total', endpoint = endpoint)
+            time.sleep(max(0.0, reset_in))
+
+    def backoff(self, attempt):
+        """
+        Returns the delay before retry number attempt: exponential, capped, with full jitter.
+        """
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * 2 ** attempt))
+
+    def call(self, endpoint, function, *args, **kwargs):
+        """
+        Calls function(*args, **kwargs) as a request to endpoint, respecting its quota and retrying on 429 and 5xx.
+
+        Returns:
+            The return value of function.
+        """
+        # Imported on first call, so importing this module does not load tweepy
+        import tweepy
+        attempt = 0
+        while True:
+            self.acquire(endpoint)
+            self.last_headers.value = None
+            try:
+                result = function(*args, **kwargs)
+                self.update_from_headers(endpoint, self.last_headers.value)
+                return result
+            except tweepy.TooManyRequests as error:
+                headers = error.response.headers if error.response is not None else None
+                self.update_from_headers(endpoint, headers)
+                if attempt >= self.max_retries:
+                    raise
+                with self.lock:
+                    self.bucket(endpoint)['remaining'] = 0
+                    reset_in = self.buckets[endpoint]['reset'] - time.time()
+                if reset_in > self.max_wait:
+                    raise QuotaExhausted(endpoint, reset_in) from error
+                delay = max(reset_in, 0.0) + self.backoff(attempt)
+            except tweepy.TwitterServerError:
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff(attempt)
+            attempt += 1
+            metrics_helpers.increment('rate_limit_retries_total', endpoint = endpoint)
+            time.sleep(delay)
+
+    def record_response(self, response, *args, **kwargs):
+        """
+        requests response hook that remembers the headers of the last response on the calling thread.
+        """
+        self.last_headers.value = response.headers
+        return response
+
+    def wrap(self, client):
+        """
+        Returns a proxy of a tweepy Client whose methods go through this limiter.
+        """
+        return ScheduledClient(client, self)
+
+class ScheduledClient:
+    """
+    Proxy of a tweepy Client that sends every method call through a RateLimiter, using the method name as the
+    endpoint name. Attributes that are not methods are passed through unchanged.
+    """
+    def __init__(self, client, limiter):
+        self.client = client
+        self.limiter = limiter
+        session = getattr(client, 'session', None)
+        if session is not None:
+            session.hooks.setdefault('response', []).append(limiter.record_response)
+
+    def __getattr__(self, name):
+        attribute = getattr(self.client, name)
+        if not callable(attribute):
+            return attribute
+        def scheduled(*args, **kwargs):
+            return self.limiter.call(name, attribute, *args, **kwargs)
+        return scheduled
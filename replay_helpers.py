@@ -0,0 +1,197 @@
+import datetime
+import numpy as np
+import action_log_helpers
+import qtable_helpers
+import snapshot_helpers
+
+def load_history(action_table, batch_size = 10000, encoder = None):
+    """
+    Streams the action log in chronological order and converts it into integer-coded NumPy arrays. Only the
+    datetime, state, action, interactions, tweet_id and batch fields are read, and documents are pulled from MongoDB in batches so memory
+    use stays proportional to the arrays, not to the documents.
+
+    Args:
+        action_table (pymongo.collection.Collection): The MongoDB collection that stores previous actions.
+        batch_size (int): The number of documents fetched per round trip.
+        encoder (state_helpers.StateEncoder, optional): Re-encodes every row from its datetime with this encoder
+            instead of using the logged state, so the history can be replayed under a different state space.
+
+    Returns:
+        dict: 'states' and 'actions' hold the names behind the integer codes, and 'state_ids', 'action_ids',
+        'interactions', 'times' (epoch seconds), 'tweet_ids' (-1 for actions that posted no tweet) and 'group_ids'
+        (the cycle of the action: rows logged together by record_actions share one) hold one entry per logged
+        action.
+    """
+    state_index = {}
+    action_index = {action: column for column, action in enumerate(qtable_helpers.DEFAULT_ACTIONS)}
+    state_ids = []
+    action_ids = []
+    interactions = []
+    datetimes = []
+    tweet_ids = []
+    group_ids = []
+    previous_batch = None
+    cursor = action_table.find({}, {'_id': 0, 'datetime': 1, 'state': 1, 'action': 1, 'interactions': 1, 'tweet_id': 1, 'batch': 1}).sort(action_log_helpers.LOG_ORDER).batch_size(batch_size)
+    for doc in cursor:
+        state = doc['state']
+        if state not in state_index:
+            state_index[state] = len(state_index)
+        if doc['action'] not in action_index:
+            action_index[doc['action']] = len(action_index)
+        state_ids.append(state_index[state])
+        action_ids.append(action_index[doc['action']])
+        interactions.append(doc['interactions'])
+        datetimes.append(doc['datetime'])
+        tweet_ids.append(doc.get('tweet_id', -1))
+        # rows of a batch share a datetime and are ordered by position, so they are contiguous in the sorted log
+        batch = doc.get('batch')
+        if batch is None or batch != previous_batch:
+            group_ids.append(group_ids[-1] + 1 if group_ids else 0)
+        else:
+            group_ids.append(group_ids[-1])
+        previous_batch = batch
+    if encoder is not None:
+        state_index = {str(state): state for state in range(encoder.n_states)}
+        state_ids = encoder.encode_many(np.array(datetimes, dtype = object)) if datetimes else []
+    history = {
+        'states': list(state_index),
+        'actions': list(action_index),
+        'state_ids': np.array(state_ids, dtype = np.int64),
+        'action_ids': np.array(action_ids, dtype = np.int64),
+        'interactions': np.array(interactions, dtype = np.float64),
+        # MongoDB returns naive datetimes in UTC
+        'times': np.array([(moment if moment.tzinfo is not None else moment.replace(tzinfo = datetime.timezone.utc)).timestamp() for moment in datetimes], dtype = np.float64),
+        'tweet_ids': np.array(tweet_ids, dtype = np.int64),
+        'group_ids': np.array(group_ids, dtype = np.int64),
+    }
+    return history
+
+def build_transitions(state_ids, action_ids, interactions, rewards = None, group_ids = None):
+    """
+    Turns a chronological action log into (state, action, reward, next state) transitions. The actions of a cycle
+    form a group: by default each of them is rewarded with the change in interaction count between its cycle and
+    the next one, divided by the number of actions of the cycle, and its next state is the state of the next
+    cycle, which are the rewards get_results computes online.
+
+    Args:
+        state_ids (numpy.ndarray): The state code of every logged action.
+        action_ids (numpy.ndarray): The action code of every logged action.
+        interactions (numpy.ndarray): The interaction count recorded with every logged action.
+        rewards (numpy.ndarray, optional): A reward per logged action, such as the attributed rewards of
+            snapshot_helpers.attribute_rewards, used instead of the interaction deltas.
+        group_ids (numpy.ndarray, optional): The cycle of every logged action, as returned by load_history. Every
+            action is its own cycle when None.
+
+    Returns:
+        tuple: The arrays (states, actions, rewards, next_states), without the actions of the last cycle.
+    """
+    count = len(state_ids)
+    if group_ids is None:
+        group_ids = np.arange(count)
+    starts = np.flatnonzero(np.r_[True, np.diff(group_ids) != 0])
+    sizes = np.diff(np.r_[starts, count])
+    row_groups = np.repeat(np.arange(len(starts)), sizes)
+    kept = row_groups < len(starts) - 1
+    if rewards is None:
+        rewards = (np.diff(np.asarray(interactions, dtype = np.float64)[starts]) / sizes[:-1])[row_groups[kept]]
+    else:
+        rewards = np.asarray(rewards, dtype = np.float64)[kept]
+    next_states = state_ids[starts][1:][row_groups[kept]]
+    return state_ids[kept], action_ids[kept], rewards, next_states
+
+def train(states, actions, rewards, next_states, n_states, n_actions, alpha = 0.1, gamma = 0.9, epochs = 50, q_values = None):
+    """
+    Runs vectorized Q-learning sweeps over a set of transitions. Each epoch computes the target
+    reward + gamma * max Q(s') for every transition at once, averages the targets per state-action pair, and moves
+    each visited pair towards its average target. A pair visited n times in the log gets the step
+    1 - (1 - alpha) ** n, which is what n sequential updates with the same target would give.
+
+    Args:
+        states, actions, rewards, next_states (numpy.ndarray): The transitions returned by build_transitions.
+        n_states (int): The number of states.
+        n_actions (int): The number of actions.
+        alpha (float): The learning rate.
+        gamma (float): The discount factor.
+        epochs (int): The number of sweeps over the whole history.
+        q_values (numpy.ndarray, optional): The starting Q-values. Starts from zeros when None.
+
+    Returns:
+        numpy.ndarray: The learned n_states x n_actions Q-values.
+    """
+    if q_values is None:
+        q_values = np.zeros((n_states, n_actions))
+    else:
+        q_values = np.array(q_values, dtype = np.float64)
+    pairs = states * n_actions + actions
+    counts = np.bincount(pairs, minlength = n_states * n_actions)
+    visited = counts > 0
+    step = 1 - (1 - alpha) ** counts[visited]
+    flat = q_values.reshape(-1)
+    for epoch in range(epochs):
+        targets = rewards + gamma * q_values.max(axis = 1)[next_states]
+        mean_targets = np.bincount(pairs, weights = targets, minlength = n_states * n_actions)[visited] / counts[visited]
+        flat[visited] += step * (mean_targets - flat[visited])
+    return q_values
+
+def train_from_log(action_table, alpha = 0.1, gamma = 0.9, epochs = 50, qtable = None, encoder = None, snapshot_store = None, reward_window = None):
+    """
+    Recomputes the Q-table from the full action log.
+
+    Args:
+        action_table (pymongo.collection.Collection): The MongoDB collection that stores previous actions.
+        alpha (float): The learning rate.
+        gamma (float): The discount factor.
+        epochs (int): The number of sweeps over the whole history.
+        qtable (qtable_helpers.QTable, optional): A Q-table whose values are used as the starting point.
+        encoder (state_helpers.StateEncoder, optional): Re-encodes the logged actions into this encoder's state space.
+        snapshot_store (snapshot_helpers.SnapshotStore, optional): Engagement snapshots used, together with
+            reward_window, to credit each action with its own delayed engagement instead of the interaction delta.
+        reward_window (float, optional): The attribution window in seconds.
+
+    Returns:
+        tuple: The learned Q-values, the state names of its rows and the action names of its columns.
+    """
+    history = load_history(action_table, encoder = encoder)
+    states = history['states']
+    actions = history['actions']
+    q_values = None
+    if qtable is not None:
+        for state in qtable.states:
+            if state not in states:
+                states.append(state)
+        for action in qtable.actions:
+            if action not in actions:
+                actions.append(action)
+        q_values = np.zeros((len(states), len(actions)))
+        for row, state in enumerate(states):
+            for column, action in enumerate(actions):
+                if state in qtable.state_index and action in qtable.action_index:
+                    q_values[row, column] = qtable.get(state, action)
+    if len(history['state_ids']) < 2:
+        if q_values is None:
+            q_values = np.zeros((len(states), len(actions)))
+        return q_values, states, actions
+    rewards = None
+    if snapshot_store is not None and reward_window is not None:
+        action_names = np.array(actions)[history['action_ids']]
+        rewards = snapshot_helpers.attribute_rewards(snapshot_store, history['times'], action_names, history['tweet_ids'], [reward_window])[:, 0]
+    transitions = build_transitions(history['state_ids'], history['action_ids'], history['interactions'], rewards, history['group_ids'])
+    q_values = train(*transitions, len(states), len(actions), alpha, gamma, epochs, q_values)
+    return q_values, states, actions
+
+def write_qtable(collection, q_values, states, actions):
+    """
+    Replaces the contents of a collection with a Q-table in the same document format as the qtable collection.
+
+    Args:
+        collection (pymongo.collection.Collection): The collection to write to.
+        q_values (numpy.ndarray): The Q-values, indexed by state row and action column.
+        states (list): The state names of the rows.
+        actions (list): The action names of the columns.
+    """
+    docs = []
+    for row, state in enumerate(states):
+        docs.append({'time_bucket': state, 'actions': {action: float(q_values[row, column]) for column, action in enumerate(actions)}, 'version': 0})
+    collection.delete_many({})
+    if docs:
+        collection.insert_many(docs)
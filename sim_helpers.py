@@ -0,0 +1,289 @@
+import bisect
+import contextlib
+import datetime
+import itertools
+import os
+import time
+from types import SimpleNamespace
+import numpy as np
+import pytz
+import action_log_helpers
+import fanout_helpers
+import openai_helpers
+import time_helpers
+from storage_helpers import MemoryDatabase
+
+ACTIONS = ['tweet', 'like', 'retweet', 'follow']
+
+# Mean engagement (likes + retweets + new followers) gained by each action in each 3-hour time bucket
+DEFAULT_RATES = np.array([
+    [0.4, 0.1, 0.1, 0.3],
+    [0.2, 0.05, 0.05, 0.2],
+    [0.8, 0.2, 0.2, 0.4],
+    [1.5, 0.3, 0.4, 0.6],
+    [1.2, 0.3, 0.3, 0.6],
+    [1.0, 0.3, 0.3, 0.5],
+    [2.0, 0.4, 0.5, 0.7],
+    [1.4, 0.3, 0.3, 0.5],
+])
+
+class SimTweet:
+    """
+    Tweet object with the attributes the bot reads from tweepy Tweets: id, author_id and the raw data dictionary.
+    """
+    def __init__(self, tweet_id, author_id, created_at, likes = 0, retweets = 0, text = ''):
+        self.id = tweet_id
+        self.author_id = author_id
+        self.text = text
+        self.data = {'id': str(tweet_id), 'author_id': str(author_id), 'created_at': created_at, 'text': text, 'public_metrics': {'like_count': likes, 'retweet_count': retweets, 'reply_count': 0, 'quote_count': 0}}
+
+    def __getitem__(self, key):
+        return self.data[key]
+
+class SimWorld:
+    """
+    Simulated Twitter account and audience. Each action earns a Poisson-distributed amount of engagement whose mean
+    depends on the time bucket and the action (`rates`), credited when the clock next advances, so the reward
+    shows up in the following cycle as it does on the live account. Tweet actions earn likes and retweets on the new
+    tweet, the other actions mostly earn followers.
+
+    Attributes:
+        now (datetime.datetime): The simulated America/New_York time.
+        calls (dict): The number of calls per simulated endpoint.
+    """
+    def __init__(self, rates = None, seed = 0, cycle_minutes = 60, start = None, user_id = 1, username = 'motivater247'):
+        self.rates = np.array(DEFAULT_RATES if rates is None else rates, dtype = np.float64)
+        self.rng = np.random.default_rng(seed)
+        self.cycle = datetime.timedelta(minutes = cycle_minutes)
+        self.timezone = pytz.timezone('America/New_York')
+        self.now = start if start is not None else self.timezone.localize(datetime.datetime(2023, 1, 1))
+        self.user_id = user_id
+        self.username = username
+        self.followers = 0
+        self.following = set()
+        self.tweets = {}
+        self.tweet_ids = []
+        self.next_id = itertools.count(10 ** 6)
+        self.pending = []
+        self.calls = {}
+
+    def count(self, endpoint):
+        self.calls[endpoint] = self.calls.get(endpoint, 0) + 1
+
+    def state(self):
+        """
+        Returns the simulated time bucket as time_helpers.get_state would.
+        """
+        return str(self.now.hour // 3)
+
+    def earn(self, action, tweet = None):
+        """
+        Draws the engagement an action earns and schedules it for the next clock advance.
+        """
+        bucket = self.now.hour // 3
+        gain = int(self.rng.poisson(self.rates[bucket, ACTIONS.index(action)]))
+        if gain:
+            self.pending.append((action, tweet, gain))
+
+    def advance(self):
+        """
+        Moves the clock forward by one cycle and credits the pending engagement.
+        """
+        self.now = self.now + self.cycle
+        for action, tweet, gain in self.pending:
+            if tweet is not None:
+                retweets = int(self.rng.binomial(gain, 0.25))
+                tweet.data['public_metrics']['like_count'] += gain - retweets
+                tweet.data['public_metrics']['retweet_count'] += retweets
+            else:
+                self.followers += gain
+        self.pending = []
+
+    def interactions(self):
+        """
+        Returns the true interaction count of the account, the quantity the agent maximises.
+        """
+        total = self.followers
+        for tweet in self.tweets.values():
+            total += tweet.data['public_metrics']['like_count'] + tweet.data['public_metrics']['retweet_count']
+        return total
+
+    def search_result(self, count):
+        """
+        Returns freshly created tweets by random other authors, as a search would.
+        """
+        return [SimTweet(next(self.next_id), int(self.rng.integers(2, 10 ** 6)), self.now, text = 'motivation') for index in range(count)]
+
+class SimClient:
+    """
+    Simulated tweepy Client exposing the endpoints the bot uses, backed by a SimWorld.
+    """
+    def __init__(self, world):
+        self.world = world
+
+    def get_user(self, username = None, id = None, user_fields = None, **kwargs):
+        self.world.count('get_user')
+        data = {'id': str(self.world.user_id), 'username': self.world.username, 'public_metrics': {'followers_count': self.world.followers, 'following_count': len(self.world.following), 'tweet_count': len(self.world.tweets)}}
+        return SimpleNamespace(data = SimpleNamespace(data = data, id = self.world.user_id), includes = {}, errors = [], meta = {})
+
+    def get_me(self, **kwargs):
+        return self.get_user()
+
+    def get_users_tweets(self, id, max_results = 10, since_id = None, pagination_token = None, **kwargs):
+        self.world.count('get_users_tweets')
+        ids = self.world.tweet_ids
+        end = int(pagination_token) if pagination_token else len(ids)
+        start = end - max(5, min(int(max_results or 10), 100))
+        if since_id is not None:
+            start = max(start, bisect.bisect_right(ids, int(since_id)))
+        start = max(start, 0)
+        page = [self.world.tweets[tweet_id] for tweet_id in reversed(ids[start:end])]
+        floor = bisect.bisect_right(ids, int(since_id)) if since_id is not None else 0
+        meta = {'result_count': len(page)}
+        if start > floor:
+            meta['next_token'] = str(start)
+        return SimpleNamespace(data = page or None, includes = {}, errors = [], meta = meta)
+
+    def get_tweets(self, ids, **kwargs):
+        self.world.count('get_tweets')
+        found = [self.world.tweets[int(tweet_id)] for tweet_id in ids if int(tweet_id) in self.world.tweets]
+        return SimpleNamespace(data = found or None, includes = {}, errors = [], meta = {})
+
+    def search_recent_tweets(self, query, max_results = 10, **kwargs):
+        self.world.count('search_recent_tweets')
+        tweets = self.world.search_result(max(10, min(int(max_results or 10), 100)))
+        return SimpleNamespace(data = tweets, includes = {}, errors = [], meta = {'result_count': len(tweets)})
+
+    def get_users_following(self, id, **kwargs):
+        self.world.count('get_users_following')
+        users = [SimpleNamespace(id = user_id) for user_id in sorted(self.world.following)]
+        return SimpleNamespace(data = users or None, includes = {}, errors = [], meta = {'result_count': len(users)})
+
+    def create_tweet(self, text = None, **kwargs):
+        self.world.count('create_tweet')
+        tweet = SimTweet(next(self.world.next_id), self.world.user_id, self.world.now, text = text)
+        self.world.tweets[tweet.id] = tweet
+        self.world.tweet_ids.append(tweet.id)
+        self.world.earn('tweet', tweet)
+        return SimpleNamespace(data = {'id': str(tweet.id), 'text': text}, includes = {}, errors = [], meta = {})
+
+    def like(self, tweet_id, **kwargs):
+        self.world.count('like')
+        self.world.earn('like')
+        return SimpleNamespace(data = {'liked': True}, includes = {}, errors = [], meta = {})
+
+    def retweet(self, tweet_id, **kwargs):
+        self.world.count('retweet')
+        self.world.earn('retweet')
+        return SimpleNamespace(data = {'retweeted': True}, includes = {}, errors = [], meta = {})
+
+    def follow_user(self, target_user_id, **kwargs):
+        self.world.count('follow_user')
+        self.world.following.add(int(target_user_id))
+        self.world.earn('follow')
+        return SimpleNamespace(data = {'following': True, 'pending_follow': False}, includes = {}, errors = [], meta = {})
+
+@contextlib.contextmanager
+def simulated(world):
+    """
+    Points time_helpers.get_state and the action log timestamps at the simulated clock, replaces the OpenAI calls
+    with canned tweets and runs fanned-out calls inline, since simulated calls are cheaper than a thread hand-off,
+    restoring everything on exit.
+
+    Args:
+        world (SimWorld): The simulated world.
+    """
+    originals = (time_helpers.get_state, action_log_helpers.now, openai_helpers.generate_tweet, openai_helpers.generate_tweets)
+    concurrent_calls = fanout_helpers.concurrent_calls
+    def generate_tweets(api_key, model_engine, prompt, n):
+        world.count('completion')
+        return ['Keep going ' + str(next(world.next_id)) for index in range(n)]
+    time_helpers.get_state = world.state
+    action_log_helpers.now = lambda: world.now
+    openai_helpers.generate_tweets = generate_tweets
+    openai_helpers.generate_tweet = lambda api_key, model_engine, prompt: generate_tweets(api_key, model_engine, prompt, 1)[0]
+    fanout_helpers.disable()
+    try:
+        yield world
+    finally:
+        time_helpers.get_state, action_log_helpers.now, openai_helpers.generate_tweet, openai_helpers.generate_tweets = originals
+        if concurrent_calls:
+            fanout_helpers.enable()
+
+def new_qtable(collection, states = 8, actions = ACTIONS):
+    """
+    Fills a qtable collection with zero-valued rows for the time buckets '0' to str(states - 1).
+    """
+    collection.insert_many([{'time_bucket': str(state), 'actions': {action: 0.0 for action in actions}} for state in range(states)])
+
+def run_simulation(cycles, alpha = 0.1, gamma = 0.9, epsilon = 0.8, rates = None, seed = 0, incremental = True, actions_per_cycle = 1, policy = None):
+    """
+    Drives q_helpers.get_results and q_helpers.execute_action, or execute_actions, against the simulated world for
+    a number of cycles, in the order Q_bot.learn_and_act calls them, with a per-cycle response cache, the
+    incremental metrics table and a follow index. The other parts of a live cycle are left out: the rate limiter,
+    the tweet buffer, the candidate pool, the snapshot store, the duplicate index, the index syncs and the action
+    log archive. Actions are logged with the simulated time, one hour apart by default.
+
+    Args:
+        cycles (int): The number of bot cycles to run.
+        alpha (float): The learning rate.
+        gamma (float): The discount factor.
+        epsilon (float): The exploration rate.
+        rates (numpy.ndarray, optional): The mean engagement per time bucket and action. Defaults to DEFAULT_RATES.
+        seed (int): The seed of the engagement model and the agent's random choices.
+        incremental (bool): Count interactions with the incremental metrics table, as the live bot does. A rescan
+            reads the whole simulated timeline every cycle, so with False the run time grows quadratically with
+            cycles.
+        actions_per_cycle (int): Plan and perform batches of up to this many actions per cycle with
+            q_helpers.execute_actions instead of a single execute_action.
+        policy (str, optional): The name of the policy_helpers exploration policy. Epsilon-greedy with epsilon when
+            None.
+
+    Returns:
+        dict: The learned Q-table, the final interaction count, the number of times each action was taken, the
+        per-endpoint call counts and the wall time.
+    """
+    import random
+    import q_helpers
+    import qtable_helpers
+    import action_log_helpers
+    import follow_graph_helpers
+    import cache_helpers
+    import policy_helpers
+    random.seed(seed)
+    np.random.seed(seed)
+    world = SimWorld(rates = rates, seed = seed)
+    response_cache = cache_helpers.ResponseCache()
+    client = response_cache.wrap(SimClient(world))
+    db = MemoryDatabase()
+    new_qtable(db.qtable)
+    action_log_helpers.ensure_indexes(db.action_table)
+    qtable = qtable_helpers.QTable(db.qtable)
+    metrics_table = db.tweet_metrics if incremental else None
+    follow_index = follow_graph_helpers.FollowIndex()
+    if policy is not None:
+        policy = policy_helpers.make_policy(policy, epsilon)
+    start = time.perf_counter()
+    # q_helpers prints the state and Q-values every cycle, which would dominate the run time
+    with simulated(world), open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        for cycle in range(cycles):
+            response_cache.clear()
+            q_helpers.get_results(qtable, db.action_table, alpha, gamma, epsilon, client, client, None, world.username, metrics_table)
+            if actions_per_cycle > 1:
+                q_helpers.execute_actions(qtable, db.action_table, alpha, gamma, epsilon, client, client, None, world.username, actions_per_cycle, metrics_table = metrics_table, follow_index = follow_index, policy = policy)
+            else:
+                q_helpers.execute_action(qtable, db.action_table, alpha, gamma, epsilon, client, client, None, world.username, metrics_table, follow_index = follow_index, policy = policy)
+            world.advance()
+    elapsed = time.perf_counter() - start
+    qtable.flush()
+    action_counts = dict(zip(ACTIONS, [0] * len(ACTIONS)))
+    for seq, doc in db.action_table.docs.items():
+        action_counts[doc['action']] += 1
+    results = {
+        'qtable': {state: qtable.as_dict(state) for state in qtable.states},
+        'interactions': world.interactions(),
+        'actions': action_counts,
+        'calls': dict(world.calls),
+        'seconds': elapsed,
+    }
+    return results
@@ -0,0 +1,200 @@
+import os
+import time
+import numpy as np
+
+# Columns of each snapshot series, stored as one append-only binary file per column
+SERIES = {
+    'tweets': [('time', np.float64), ('tweet_id', np.int64), ('likes', np.int64), ('retweets', np.int64)],
+    'account': [('time', np.float64), ('followers', np.int64), ('likes', np.int64), ('retweets', np.int64)],
+}
+
+class SnapshotStore:
+    """
+    Columnar time series of engagement snapshots. The 'tweets' series holds the like and retweet counts of
+    individual tweets each time they are observed, the 'account' series the follower count and the like and
+    retweet totals of the account. Every column is a flat binary file of fixed-width values that rows are appended
+    to, and reads memory-map the files, so millions of snapshots are scanned as NumPy arrays without being loaded
+    into Python objects. Rows are always appended in time order.
+
+    Attributes:
+        directory (str): The directory holding the column files.
+    """
+    def __init__(self, directory):
+        """
+        Args:
+            directory (str): The directory the column files are kept in, created if missing.
+        """
+        self.directory = directory
+        os.makedirs(directory, exist_ok = True)
+        self.lengths = {}
+        for series, columns in SERIES.items():
+            # A crash in the middle of an append leaves some columns longer than others, cut them back
+            length = min(self.file_rows(series, name, dtype) for name, dtype in columns)
+            for name, dtype in columns:
+                if os.path.getsize(self.path(series, name)) != length * np.dtype(dtype).itemsize:
+                    with open(self.path(series, name), 'r+b') as column:
+                        column.truncate(length * np.dtype(dtype).itemsize)
+            self.lengths[series] = length
+
+    def path(self, series, name):
+        return os.path.join(self.directory, series + '.' + name + '.bin')
+
+    def file_rows(self, series, name, dtype):
+        path = self.path(series, name)
+        if not os.path.exists(path):
+            open(path, 'wb').close()
+            return 0
+        return os.path.getsize(path) // np.dtype(dtype).itemsize
+
+    def rows(self, series):
+        """
+        Returns the number of rows in a series.
+        """
+        return self.lengths[series]
+
+    def append(self, series, **values):
+        """
+        Appends rows to a series.
+
+        Args:
+            series (str): 'tweets' or 'account'.
+            **values: One array-like per column of the series, all of the same length, or scalars for a single row.
+        """
+        columns = SERIES[series]
+        arrays = [np.atleast_1d(np.asarray(values[name], dtype = dtype)) for name, dtype in columns]
+        count = len(arrays[0])
+        if any(len(array) != count for array in arrays):
+            raise ValueError('every column of a snapshot must have the same length')
+        if count == 0:
+            return
+        for (name, dtype), array in zip(columns, arrays):
+            with open(self.path(series, name), 'ab') as column:
+                column.write(array.tobytes())
+        self.lengths[series] += count
+
+    def record_account(self, followers, likes, retweets, now = None):
+        """
+        Appends one account snapshot, timestamped now (epoch seconds) or at the current time.
+        """
+        self.append('account', time = time.time() if now is None else now, followers = followers, likes = likes, retweets = retweets)
+
+    def record_tweets(self, tweet_ids, likes, retweets, now = None):
+        """
+        Appends a snapshot of several tweets taken at the same time.
+        """
+        tweet_ids = np.atleast_1d(np.asarray(tweet_ids, dtype = np.int64))
+        times = np.full(len(tweet_ids), time.time() if now is None else now)
+        self.append('tweets', time = times, tweet_id = tweet_ids, likes = likes, retweets = retweets)
+
+    def read(self, series):
+        """
+        Returns the columns of a series as read-only memory-mapped arrays.
+
+        Returns:
+            dict: One NumPy array per column name.
+        """
+        length = self.lengths[series]
+        columns = {}
+        for name, dtype in SERIES[series]:
+            if length == 0:
+                columns[name] = np.empty(0, dtype = dtype)
+            else:
+                columns[name] = np.memmap(self.path(series, name), dtype = dtype, mode = 'r', shape = (length,))
+        return columns
+
+def value_at(times, values, query_times):
+    """
+    Returns, for every query time, the last value recorded at or before it. Queries before the first record get
+    the first value, so a difference of two lookups there is zero.
+
+    Args:
+        times (numpy.ndarray): The nondecreasing record times.
+        values (numpy.ndarray): The value recorded at each time.
+        query_times (numpy.ndarray): The times to look up.
+
+    Returns:
+        numpy.ndarray: One value per query time, zeros when there are no records.
+    """
+    query_times = np.asarray(query_times, dtype = np.float64)
+    if len(times) == 0:
+        return np.zeros(len(query_times))
+    positions = np.maximum(np.searchsorted(times, query_times, side = 'right') - 1, 0)
+    return np.asarray(values)[positions]
+
+def tweet_engagement_at(tweets, tweet_ids, query_times):
+    """
+    Returns the likes plus retweets of each given tweet as last observed at or before the matching query time,
+    0 when the tweet had not been observed by then. The snapshots are ordered by tweet and time once, and every
+    query is a binary search on a combined (tweet, time) key.
+
+    Args:
+        tweets (dict): The columns of the 'tweets' series, as returned by SnapshotStore.read.
+        tweet_ids (numpy.ndarray): The tweet of each query.
+        query_times (numpy.ndarray): The time of each query, in epoch seconds.
+
+    Returns:
+        numpy.ndarray: One engagement count per query.
+    """
+    tweet_ids = np.asarray(tweet_ids, dtype = np.int64)
+    query_times = np.asarray(query_times, dtype = np.float64)
+    engagement = np.zeros(len(tweet_ids))
+    if len(tweets['time']) == 0 or len(tweet_ids) == 0:
+        return engagement
+    snapshot_ids = np.asarray(tweets['tweet_id'])
+    snapshot_seconds = np.floor(np.asarray(tweets['time'])).astype(np.int64)
+    origin = min(snapshot_seconds.min(), int(np.floor(query_times.min())))
+    known_ids, dense = np.unique(snapshot_ids, return_inverse = True)
+    # Seconds since origin fit in 32 bits for over a century, so (tweet, time) packs into one int64 key
+    keys = (dense.astype(np.int64) << 32) + (snapshot_seconds - origin)
+    order = np.argsort(keys, kind = 'stable')
+    keys = keys[order]
+    totals = (np.asarray(tweets['likes']) + np.asarray(tweets['retweets']))[order]
+    query_dense = np.searchsorted(known_ids, tweet_ids)
+    found = (query_dense < len(known_ids)) & (known_ids[np.minimum(query_dense, len(known_ids) - 1)] == tweet_ids)
+    query_keys = (query_dense.astype(np.int64) << 32) + (np.floor(query_times).astype(np.int64) - origin)
+    positions = np.searchsorted(keys, query_keys, side = 'right') - 1
+    valid = found & (positions >= 0)
+    valid[valid] &= (keys[positions[valid]] >> 32) == query_dense[valid]
+    engagement[valid] = totals[positions[valid]]
+    return engagement
+
+def attribute_rewards(store, action_times, actions, tweet_ids, windows, exclusive = True):
+    """
+    Computes a reward per logged action and per attribution window, instead of the single global change in
+    interactions between two cycles. A tweet action is credited with the likes and retweets its own tweet gathered
+    within the window, however late they arrive. Every other action is credited with the followers gained within
+    the window. With exclusive windows a non-tweet action's window also ends at the next action, so two actions
+    never share a follower.
+
+    Args:
+        store (SnapshotStore): The snapshot store.
+        action_times (numpy.ndarray): The epoch time of every action, in chronological order.
+        actions (numpy.ndarray): The action name of every action.
+        tweet_ids (numpy.ndarray): The id of the tweet posted by every tweet action, anything for other actions.
+        windows (list): The attribution windows in seconds.
+        exclusive (bool): End the window of non-tweet actions at the next action.
+
+    Returns:
+        numpy.ndarray: A len(action_times) x len(windows) array of rewards.
+    """
+    action_times = np.asarray(action_times, dtype = np.float64)
+    actions = np.asarray(actions)
+    windows = np.asarray(windows, dtype = np.float64)
+    ends = action_times[:, None] + windows[None, :]
+    rewards = np.zeros(ends.shape)
+    is_tweet = actions == 'tweet'
+    if is_tweet.any():
+        tweets = store.read('tweets')
+        ids = np.repeat(np.asarray(tweet_ids)[is_tweet].astype(np.int64), len(windows))
+        rewards[is_tweet] = tweet_engagement_at(tweets, ids, ends[is_tweet].reshape(-1)).reshape(-1, len(windows))
+    others = ~is_tweet
+    if others.any():
+        account = store.read('account')
+        other_ends = ends[others]
+        if exclusive:
+            next_times = np.append(action_times[1:], np.inf)[others]
+            other_ends = np.minimum(other_ends, next_times[:, None])
+        start_followers = value_at(account['time'], account['followers'], action_times[others])
+        end_followers = value_at(account['time'], account['followers'], other_ends.reshape(-1)).reshape(other_ends.shape)
+        rewards[others] = end_followers - start_followers[:, None]
+    return rewards
@@ -0,0 +1,80 @@
+import builtins
+import contextlib
+import sys
+import threading
+import time
+
+enabled = False
+started = time.perf_counter()
+original_import = builtins.__import__
+local = threading.local()
+# Seconds spent importing each module the first time, as (own, including the modules it imported)
+imports = {}
+# Seconds spent in each named initialization phase, in the order they ran
+phases = []
+
+def timed_import(name, globals = None, locals = None, fromlist = (), level = 0):
+    if level or name in sys.modules:
+        return original_import(name, globals, locals, fromlist, level)
+    stack = getattr(local, 'stack', None)
+    if stack is None:
+        stack = local.stack = []
+    stack.append(0.0)
+    start = time.perf_counter()
+    try:
+        return original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - start
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        imports.setdefault(name, (elapsed - nested, elapsed))
+
+def enable():
+    """
+    Starts timing every module imported for the first time from now on. Call it before the imports to profile.
+    """
+    global enabled
+    if not enabled:
+        builtins.__import__ = timed_import
+        enabled = True
+
+def disable():
+    """
+    Stops timing imports, keeping what was recorded so far.
+    """
+    global enabled
+    builtins.__import__ = original_import
+    enabled = False
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    Times the enclosed block as an initialization phase when profiling is enabled.
+    """
+    if not enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        phases.append((name, time.perf_counter() - start))
+
+def report(limit = 15, file = None):
+    """
+    Prints the slowest module imports, with their own time and the time including the modules they imported, the
+    initialization phases and the time since this module was imported.
+
+    Args:
+        limit (int): The number of imports listed.
+        file (optional): The stream written to, stdout when None.
+    """
+    file = file or sys.stdout
+    print('startup profile (ms):', file = file)
+    print('  import' + ' ' * 26 + 'self   cumulative', file = file)
+    for name, (own, total) in sorted(imports.items(), key = lambda item: -item[1][1])[:limit]:
+        print('  ' + name.ljust(30) + format(own * 1000, '7.1f') + format(total * 1000, '10.1f'), file = file)
+    for name, seconds in phases:
+        print('  phase ' + name.ljust(24) + format(seconds * 1000, '17.1f'), file = file)
+    print('  total' + ' ' * 25 + format((time.perf_counter() - started) * 1000, '17.1f'), file = file)
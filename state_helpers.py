@@ -0,0 +1,129 @@
+import datetime
+import functools
+import numpy as np
+
+# Number of time states and the lookup table from (weekday, hour) to time state, for each state space
+SPACES = {
+    '3hour': (8, np.tile(np.arange(24) // 3, (7, 1))),
+    'hourly': (24, np.tile(np.arange(24), (7, 1))),
+    'weekday_hour': (168, np.arange(168).reshape(7, 24)),
+}
+
+@functools.lru_cache(maxsize = None)
+def get_timezone(name):
+    """
+    Returns the pytz timezone with the given name, looked up only once per name. pytz is imported on the first
+    call, so importing this module does not load it.
+    """
+    import pytz
+    return pytz.timezone(name)
+
+class StateEncoder:
+    """
+    Maps a time, and optionally a follower count, to a compact integer state id that can index a Q-table array
+    directly. The mapping is a precomputed (weekday, hour) lookup table for the chosen state space; follower counts
+    are discretized into bands with the given thresholds, and the state id is time_state * number_of_bands + band.
+    With the default '3hour' space and no bands, the ids 0 to 7 are the time buckets get_state has always used.
+
+    Attributes:
+        space (str): The state space: '3hour', 'hourly' or 'weekday_hour'.
+        n_states (int): The number of state ids.
+    """
+    def __init__(self, space = '3hour', follower_bands = None, timezone = 'America/New_York'):
+        """
+        Args:
+            space (str): The state space: '3hour' (8 states), 'hourly' (24) or 'weekday_hour' (168).
+            follower_bands (list, optional): Increasing follower-count thresholds. A count below the first
+                threshold is band 0, a count at or above the last one is band len(follower_bands).
+            timezone (str): The timezone the hours are measured in.
+        """
+        if space not in SPACES:
+            raise ValueError('unknown state space ' + repr(space) + ', expected one of ' + ', '.join(sorted(SPACES)))
+        self.space = space
+        self.n_time_states, self.table = SPACES[space]
+        self.follower_bands = np.array(follower_bands if follower_bands is not None else [], dtype = np.int64)
+        self.n_bands = len(self.follower_bands) + 1
+        self.n_states = self.n_time_states * self.n_bands
+        self.timezone_name = timezone
+        self.transitions = None
+
+    @property
+    def timezone(self):
+        """
+        The pytz timezone the hours are measured in, looked up on first use.
+        """
+        return get_timezone(self.timezone_name)
+
+    def band(self, followers):
+        """
+        Returns the follower band of a count, or of every count in an array.
+        """
+        return np.searchsorted(self.follower_bands, followers, side = 'right')
+
+    def encode(self, now = None, followers = None):
+        """
+        Returns the state id of a single time.
+
+        Args:
+            now (datetime.datetime, optional): The time to encode, the current time when None.
+            followers (int, optional): The follower count. Band 0 is used when None.
+
+        Returns:
+            int: The state id.
+        """
+        if now is None:
+            now = datetime.datetime.now(self.timezone)
+        elif now.tzinfo is None:
+            now = now.replace(tzinfo = datetime.timezone.utc).astimezone(self.timezone)
+        else:
+            now = now.astimezone(self.timezone)
+        state = int(self.table[now.weekday(), now.hour])
+        band = int(self.band(followers)) if followers is not None else 0
+        return state * self.n_bands + band
+
+    def utc_offsets(self, timestamps):
+        """
+        Returns the UTC offset in seconds of the timezone at every epoch timestamp, looked up in the timezone's
+        transition table so that daylight saving time is handled without converting each time separately.
+        """
+        if not hasattr(self.timezone, '_utc_transition_times'):
+            offset = self.timezone.utcoffset(datetime.datetime(2000, 1, 1))
+            return np.full(len(timestamps), offset.total_seconds() if offset is not None else 0.0)
+        if self.transitions is None:
+            epoch = datetime.datetime(1970, 1, 1)
+            times = [(moment - epoch).total_seconds() if moment > datetime.datetime(1900, 1, 1) else -np.inf for moment in self.timezone._utc_transition_times]
+            offsets = [info[0].total_seconds() for info in self.timezone._transition_info]
+            self.transitions = (np.array(times), np.array(offsets))
+        times, offsets = self.transitions
+        return offsets[np.maximum(np.searchsorted(times, timestamps, side = 'right') - 1, 0)]
+
+    def encode_many(self, timestamps, followers = None):
+        """
+        Returns the state ids of many times at once.
+
+        Args:
+            timestamps (array-like): Epoch seconds, numpy datetime64 values, or datetime objects (naive ones are
+                taken as UTC, the way MongoDB returns them).
+            followers (array-like, optional): The follower count at every time. Band 0 is used when None.
+
+        Returns:
+            numpy.ndarray: The state ids.
+        """
+        timestamps = np.asarray(timestamps)
+        if timestamps.dtype == object:
+            timestamps = np.array([(moment if moment.tzinfo is not None else moment.replace(tzinfo = datetime.timezone.utc)).timestamp() for moment in timestamps], dtype = np.float64)
+        elif np.issubdtype(timestamps.dtype, np.datetime64):
+            timestamps = timestamps.astype('datetime64[s]').astype(np.float64)
+        else:
+            timestamps = timestamps.astype(np.float64)
+        local = timestamps + self.utc_offsets(timestamps)
+        days = np.floor_divide(local, 86400).astype(np.int64)
+        hours = (np.floor_divide(local, 3600).astype(np.int64)) % 24
+        # 1970-01-01 was a Thursday, weekday 3
+        weekdays = (days + 3) % 7
+        states = self.table[weekdays, hours].astype(np.int64) * self.n_bands
+        if followers is not None:
+            states = states + self.band(np.asarray(followers))
+        return states
+
+default_encoder = StateEncoder()
@@ -0,0 +1,876 @@
+import bisect
+import functools
+import datetime
+import itertools
+import os
+import threading
+import time
+from types import SimpleNamespace
+import numpy as np
+
+# pymongo sort directions. pymongo and bson are only imported by the code that needs them, so the embedded
+# backend does not load the MongoDB driver
+ASCENDING = 1
+DESCENDING = -1
+
+def pymongo_errors():
+    """
+    Returns the pymongo.errors module, imported on first use.
+    """
+    import pymongo.errors
+    return pymongo.errors
+
+def sort_key(value):
+    """
+    Returns a key that orders values of mixed types the way MongoDB orders BSON types.
+    """
+    if value is None:
+        return (0, 0)
+    if isinstance(value, bool):
+        return (6, value)
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo = datetime.timezone.utc)
+        return (7, value.timestamp())
+    # Compared by name, an ObjectId can only exist once bson is imported
+    if type(value).__name__ == 'ObjectId':
+        return (5, str(value))
+    return (3, str(value))
+
+def clone(value):
+    """
+    Copies nested dictionaries and lists, leaving other values shared. Much faster than copy.deepcopy for documents.
+    """
+    if type(value) is dict:
+        return {key: clone(item) if type(item) in (dict, list) else item for key, item in value.items()}
+    if type(value) is list:
+        return [clone(item) if type(item) in (dict, list) else item for item in value]
+    return value
+
+def get_path(doc, path):
+    """
+    Returns the value at a dotted path of a document, or None if it is missing.
+    """
+    value = doc
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return None
+        value = value[part]
+    return value
+
+def has_path(doc, path):
+    """
+    Tells whether a dotted path exists in a document.
+    """
+    value = doc
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return False
+        value = value[part]
+    return True
+
+def set_path(doc, path, value):
+    """
+    Sets the value at a dotted path of a document, creating intermediate dictionaries.
+    """
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.setdefault(part, {})
+    doc[parts[-1]] = value
+
+def unset_path(doc, path):
+    """
+    Removes the value at a dotted path of a document if it exists.
+    """
+    parts = path.split('.')
+    for part in parts[:-1]:
+        doc = doc.get(part)
+        if not isinstance(doc, dict):
+            return
+    doc.pop(parts[-1], None)
+
+def matches_condition(value, present, condition):
+    """
+    Tells whether a field value satisfies a filter condition, which is either a value or a dictionary of operators.
+    """
+    if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+        for operator, operand in condition.items():
+            if operator == '$ne':
+                if value == operand:
+                    return False
+            elif operator == '$in':
+                if not any(value == item or (item is None and not present) for item in operand):
+                    return False
+            elif operator == '$nin':
+                if any(value == item for item in operand):
+                    return False
+            elif operator == '$exists':
+                if present != bool(operand):
+                    return False
+            elif operator in ('$gt', '$gte', '$lt', '$lte'):
+                if not present or value is None:
+                    return False
+                left = sort_key(value)
+                right = sort_key(operand)
+                if left[0] != right[0]:
+                    return False
+                if operator == '$gt' and not left > right:
+                    return False
+                if operator == '$gte' and not left >= right:
+                    return False
+                if operator == '$lt' and not left < right:
+                    return False
+                if operator == '$lte' and not left <= right:
+                    return False
+            else:
+                raise NotImplementedError('filter operator ' + operator + ' is not supported')
+        return True
+    if condition is None:
+        return value is None
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value == condition
+
+def matches(doc, query):
+    """
+    Tells whether a document matches a MongoDB-style filter.
+    """
+    for key, condition in query.items():
+        if type(condition) is not dict and '.' not in key and key[0] != '$':
+            # Plain equality on a top-level field, the most common case
+            value = doc.get(key)
+            if value != condition and not (type(value) is list and condition in value):
+                return False
+            continue
+        if key == '$or':
+            if not any(matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif key == '$and':
+            if not all(matches(doc, sub_query) for sub_query in condition):
+                return False
+        elif not matches_condition(get_path(doc, key), has_path(doc, key), condition):
+            return False
+    return True
+
+def project(doc, projection):
+    """
+    Returns a copy of a document restricted by a MongoDB-style projection.
+    """
+    if not projection:
+        return clone(doc)
+    included = [key for key, flag in projection.items() if flag and key != '_id']
+    if included:
+        result = {}
+        for key in included:
+            if has_path(doc, key):
+                set_path(result, key, clone(get_path(doc, key)))
+        if projection.get('_id', 1) and '_id' in doc:
+            result['_id'] = doc['_id']
+        return result
+    result = clone(doc)
+    for key, flag in projection.items():
+        if not flag:
+            unset_path(result, key)
+    return result
+
+def normalize_sort(key_or_list, direction = None):
+    """
+    Turns the arguments of Cursor.sort or the sort option of find_one into a list of (key, direction) pairs.
+    """
+    if key_or_list is None:
+        return []
+    if isinstance(key_or_list, str):
+        return [(key_or_list, direction if direction is not None else ASCENDING)]
+    return list(key_or_list)
+
+def evaluate(doc, expression):
+    """
+    Evaluates an aggregation expression on a document: a '$field' path, a dictionary of expressions, a
+    $dateToString expression or a constant.
+    """
+    if isinstance(expression, str) and expression.startswith('$'):
+        return get_path(doc, expression[1:])
+    if isinstance(expression, dict):
+        if '$dateToString' in expression:
+            options = expression['$dateToString']
+            date = evaluate(doc, options['date'])
+            if date is None:
+                return None
+            import pytz
+            if date.tzinfo is None:
+                date = date.replace(tzinfo = pytz.utc)
+            return date.astimezone(pytz.timezone(options.get('timezone', 'UTC'))).strftime(options['format'])
+        if any(key.startswith('$') for key in expression):
+            raise NotImplementedError('aggregation expression ' + ', '.join(expression) + ' is not supported')
+        return {key: evaluate(doc, value) for key, value in expression.items()}
+    return expression
+
+def group_documents(docs, group):
+    """
+    Applies a $group stage to a list of documents.
+    """
+    groups = {}
+    for doc in docs:
+        key = evaluate(doc, group['_id'])
+        frozen = repr(key)
+        if frozen not in groups:
+            groups[frozen] = {'_id': key}
+        result = groups[frozen]
+        for field, accumulator in group.items():
+            if field == '_id':
+                continue
+            (operator, expression), = accumulator.items()
+            value = evaluate(doc, expression)
+            if operator == '$sum':
+                result[field] = result.get(field, 0) + (value if isinstance(value, (int, float)) else 0)
+            elif operator in ('$min', '$max'):
+                if value is None:
+                    result.setdefault(field, None)
+                elif result.get(field) is None or (sort_key(value) < sort_key(result[field])) == (operator == '$min'):
+                    result[field] = value
+            else:
+                raise NotImplementedError('group accumulator ' + operator + ' is not supported')
+    return list(groups.values())
+
+def writes(method):
+    """
+    Decorator for the MemoryCollection methods that change documents: holds the collection lock for the whole
+    operation, deletes the documents past their TTL index expiry first, then commits the journaled changes once the operation is over, including the changes made
+    before an operation failed part way.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            try:
+                self.expire()
+                return method(self, *args, **kwargs)
+            finally:
+                self.commit()
+    return wrapper
+
+def reads(method):
+    """
+    Decorator for the MemoryCollection methods that only read: holds the collection lock, so a concurrent write
+    cannot change the documents or indexes being iterated.
+    """
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+class MemoryCursor:
+    """
+    Lazily evaluated result of MemoryCollection.find, supporting sort, skip, limit, batch_size and indexing.
+    """
+    def __init__(self, collection, query, projection):
+        self.collection = collection
+        self.query = query
+        self.projection = projection
+        self.sort_keys = []
+        self.skip_count = 0
+        self.limit_count = 0
+
+    def sort(self, key_or_list, direction = None):
+        self.sort_keys = normalize_sort(key_or_list, direction)
+        return self
+
+    def skip(self, count):
+        self.skip_count = count
+        return self
+
+    def limit(self, count):
+        self.limit_count = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def results(self):
+        return self.collection.query(self.query, self.projection, self.sort_keys, self.skip_count, self.limit_count)
+
+    def __iter__(self):
+        return iter(self.results())
+
+    def __getitem__(self, index):
+        return self.results()[index]
+
+class MemoryCollection:
+    """
+    In-memory stand-in for a pymongo Collection implementing the subset of its API used by the bot: find, find_one,
+    find_one_and_delete, insert_one, insert_many, update_one, update_many, delete_one, delete_many, bulk_write,
+    count_documents, aggregate, create_index and drop_index. Single-field indexes are kept as sorted lists, so a
+    query sorted on an indexed field first, with a limit, such as the latest row of the action log, does not scan
+    the collection. Unique
+    single-field indexes reject duplicates with DuplicateKeyError, and documents past the expiry of a TTL index are
+    deleted at the start of the next write.
+
+    Attributes:
+        name (str): The collection name.
+        round_trips (int): The number of operations performed, each of which would be a round trip to MongoDB.
+    """
+    def __init__(self, name = 'collection', lock = None):
+        self.name = name
+        # Background refills and fanned-out reads use the collection from several threads
+        self.lock = lock if lock is not None else threading.RLock()
+        self.docs = {}
+        self.ids = {}
+        self.indexes = {'_id': []}
+        # Fields of the unique single-field indexes, besides _id
+        self.unique = set()
+        # expireAfterSeconds of the TTL indexes, by field
+        self.ttl = {}
+        self.sequence = itertools.count()
+        self.round_trips = 0
+        self.journal = None
+
+    def index_add(self, seq, doc):
+        for field, entries in self.indexes.items():
+            bisect.insort(entries, (sort_key(get_path(doc, field)), seq))
+
+    def index_remove(self, seq, doc):
+        for field, entries in self.indexes.items():
+            entry = (sort_key(get_path(doc, field)), seq)
+            position = bisect.bisect_left(entries, entry)
+            if position < len(entries) and entries[position] == entry:
+                del entries[position]
+
+    def store(self, doc):
+        if '_id' not in doc:
+            import bson
+            doc['_id'] = bson.ObjectId()
+        if doc['_id'] in self.ids:
+            raise pymongo_errors().DuplicateKeyError('duplicate _id ' + str(doc['_id']))
+        self.check_unique(doc)
+        seq = next(self.sequence)
+        self.docs[seq] = doc
+        self.ids[doc['_id']] = seq
+        self.index_add(seq, doc)
+        if self.journal is not None:
+            self.journal.append(('put', doc))
+        return doc['_id']
+
+    def check_unique(self, doc, seq = None):
+        """
+        Raises DuplicateKeyError if another document than seq has the same value in a unique indexed field.
+        """
+        for field in self.unique:
+            entries = self.indexes[field]
+            key = sort_key(get_path(doc, field))
+            position = bisect.bisect_left(entries, (key, -1))
+            while position < len(entries) and entries[position][0] == key:
+                if entries[position][1] != seq:
+                    raise pymongo_errors().DuplicateKeyError('duplicate ' + field + ' ' + repr(get_path(doc, field)), 11000)
+                position += 1
+
+    def expire(self):
+        """
+        Deletes the documents whose TTL indexed date is older than the index's expireAfterSeconds. Dates sort after
+        every other type in the index, so the expired documents are a contiguous run found by bisection.
+        """
+        for field, seconds in self.ttl.items():
+            entries = self.indexes[field]
+            cutoff = time.time() - seconds
+            start = bisect.bisect_left(entries, ((7, float('-inf')), -1))
+            end = bisect.bisect_left(entries, ((7, cutoff), -1))
+            for key, seq in entries[start:end]:
+                self.remove(seq)
+
+    def remove(self, seq):
+        doc = self.docs.pop(seq)
+        del self.ids[doc['_id']]
+        self.index_remove(seq, doc)
+        if self.journal is not None:
+            self.journal.append(('del', doc['_id']))
+
+    def commit(self):
+        """
+        Called once at the end of every write operation. Memory-only collections have nothing to persist.
+        """
+
+    def candidates(self, query, sort_keys):
+        """
+        Yields (seq, doc) pairs that may match the query, in sort order when an index covers the sort.
+        """
+        if '_id' in query and not isinstance(query['_id'], dict):
+            seq = self.ids.get(query['_id'])
+            if seq is not None:
+                yield seq, self.docs[seq]
+            return
+        if sort_keys and sort_keys[0][0] in self.indexes:
+            entries = self.indexes[sort_keys[0][0]]
+            if sort_keys[0][1] == DESCENDING:
+                entries = reversed(entries)
+            if len(sort_keys) == 1:
+                for key, seq in entries:
+                    yield seq, self.docs[seq]
+                return
+            # only the runs of equal values in the indexed field are sorted on the other keys
+            for key, run in itertools.groupby(entries, key = lambda entry: entry[0]):
+                pairs = [(seq, self.docs[seq]) for key, seq in run]
+                for field, direction in reversed(sort_keys[1:]):
+                    pairs.sort(key = lambda pair: sort_key(get_path(pair[1], field)), reverse = direction == DESCENDING)
+                yield from pairs
+            return
+        for seq, doc in self.docs.items():
+            yield seq, doc
+
+    def matching(self, query, sort_keys = (), limit = 0):
+        """
+        Returns the (seq, doc) pairs matching a query, sorted, with at most limit entries when limit is positive.
+        """
+        query = query or {}
+        sort_keys = list(sort_keys)
+        indexed = ('_id' in query and not isinstance(query['_id'], dict)) or (bool(sort_keys) and sort_keys[0][0] in self.indexes)
+        found = []
+        for seq, doc in self.candidates(query, sort_keys):
+            if matches(doc, query):
+                found.append((seq, doc))
+                if indexed and limit and len(found) >= limit:
+                    break
+        if not indexed:
+            for key, direction in reversed(sort_keys):
+                found.sort(key = lambda pair: sort_key(get_path(pair[1], key)), reverse = direction == DESCENDING)
+        return found
+
+    @reads
+    def query(self, query, projection = None, sort_keys = (), skip = 0, limit = 0):
+        self.round_trips += 1
+        found = self.matching(query, sort_keys, skip + limit if limit else 0)[skip:]
+        if limit:
+            found = found[:limit]
+        return [project(doc, projection) for seq, doc in found]
+
+    def find(self, filter = None, projection = None, sort = None):
+        cursor = MemoryCursor(self, filter or {}, projection)
+        if sort is not None:
+            cursor.sort(sort)
+        return cursor
+
+    @reads
+    def find_one(self, filter = None, projection = None, sort = None):
+        found = self.query(filter or {}, projection, normalize_sort(sort), 0, 1)
+        return found[0] if found else None
+
+    @writes
+    def find_one_and_delete(self, filter, projection = None, sort = None):
+        self.round_trips += 1
+        found = self.matching(filter, normalize_sort(sort), 1)
+        if not found:
+            return None
+        seq, doc = found[0]
+        self.remove(seq)
+        return project(doc, projection)
+
+    @reads
+    def count_documents(self, filter):
+        self.round_trips += 1
+        return len(self.matching(filter))
+
+    @writes
+    def insert_one(self, document):
+        self.round_trips += 1
+        doc = clone(document)
+        inserted_id = self.store(doc)
+        document['_id'] = inserted_id
+        return SimpleNamespace(inserted_id = inserted_id, acknowledged = True)
+
+    @writes
+    def insert_many(self, documents, ordered = True):
+        self.round_trips += 1
+        inserted_ids = []
+        for document in documents:
+            doc = clone(document)
+            inserted_ids.append(self.store(doc))
+            document['_id'] = doc['_id']
+        return SimpleNamespace(inserted_ids = inserted_ids, acknowledged = True)
+
+    def apply_update(self, doc, update, inserting):
+        for operator, fields in update.items():
+            for path, value in fields.items():
+                if operator == '$set':
+                    set_path(doc, path, clone(value))
+                elif operator == '$setOnInsert':
+                    if inserting:
+                        set_path(doc, path, clone(value))
+                elif operator == '$inc':
+                    set_path(doc, path, (get_path(doc, path) or 0) + value)
+                elif operator == '$min':
+                    if not has_path(doc, path) or sort_key(value) < sort_key(get_path(doc, path)):
+                        set_path(doc, path, value)
+                elif operator == '$max':
+                    if not has_path(doc, path) or sort_key(value) > sort_key(get_path(doc, path)):
+                        set_path(doc, path, value)
+                elif operator == '$unset':
+                    unset_path(doc, path)
+                else:
+                    raise NotImplementedError('update operator ' + operator + ' is not supported')
+
+    def update(self, filter, update, upsert, many):
+        found = self.matching(filter, limit = 0 if many else 1)
+        if not many:
+            found = found[:1]
+        for seq, doc in found:
+            self.index_remove(seq, doc)
+            if self.unique:
+                previous = clone(doc)
+                self.apply_update(doc, update, False)
+                try:
+                    self.check_unique(doc, seq)
+                except pymongo_errors().DuplicateKeyError:
+                    doc.clear()
+                    doc.update(previous)
+                    self.index_add(seq, doc)
+                    raise
+            else:
+                self.apply_update(doc, update, False)
+            self.index_add(seq, doc)
+            if self.journal is not None:
+                self.journal.append(('put', doc))
+        upserted_id = None
+        if not found and upsert:
+            doc = {}
+            for key, condition in filter.items():
+                if not key.startswith('$') and not (isinstance(condition, dict) and any(operator.startswith('$') for operator in condition)):
+                    set_path(doc, key, clone(condition))
+            self.apply_update(doc, update, True)
+            upserted_id = self.store(doc)
+        return SimpleNamespace(matched_count = len(found), modified_count = len(found), upserted_id = upserted_id, acknowledged = True)
+
+    @writes
+    def update_one(self, filter, update, upsert = False):
+        self.round_trips += 1
+        return self.update(filter, update, upsert, False)
+
+    @writes
+    def update_many(self, filter, update, upsert = False):
+        self.round_trips += 1
+        return self.update(filter, update, upsert, True)
+
+    def delete(self, filter, many):
+        found = self.matching(filter, limit = 0 if many else 1)
+        if not many:
+            found = found[:1]
+        for seq, doc in found:
+            self.remove(seq)
+        return SimpleNamespace(deleted_count = len(found), acknowledged = True)
+
+    @writes
+    def delete_one(self, filter):
+        self.round_trips += 1
+        return self.delete(filter, False)
+
+    @writes
+    def delete_many(self, filter):
+        self.round_trips += 1
+        return self.delete(filter, True)
+
+    @writes
+    def bulk_write(self, requests, ordered = True):
+        """
+        Applies pymongo InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany and ReplaceOne operations. A
+        duplicate key stops an ordered bulk and is skipped by an unordered one, and either way BulkWriteError is
+        raised at the end with the counts of what was applied, as MongoDB does.
+        """
+        self.round_trips += 1
+        result = {'inserted_count': 0, 'matched_count': 0, 'modified_count': 0, 'deleted_count': 0, 'upserted_count': 0}
+        errors = []
+        for index, request in enumerate(requests):
+            try:
+                self.apply_request(request, result)
+            except pymongo_errors().DuplicateKeyError as error:
+                errors.append({'index': index, 'code': 11000, 'errmsg': str(error), 'op': request._doc})
+                if ordered:
+                    break
+        if errors:
+            raise pymongo_errors().BulkWriteError({
+                'writeErrors': errors,
+                'writeConcernErrors': [],
+                'nInserted': result['inserted_count'],
+                'nUpserted': result['upserted_count'],
+                'nMatched': result['matched_count'],
+                'nModified': result['modified_count'],
+                'nRemoved': result['deleted_count'],
+                'upserted': [],
+            })
+        return SimpleNamespace(acknowledged = True, **result)
+
+    def apply_request(self, request, result):
+        """
+        Applies one bulk_write operation, adding its counts to result.
+        """
+        import pymongo
+        if isinstance(request, pymongo.InsertOne):
+            self.store(clone(request._doc))
+            result['inserted_count'] += 1
+        elif isinstance(request, (pymongo.UpdateOne, pymongo.UpdateMany)):
+            outcome = self.update(request._filter, request._doc, request._upsert, isinstance(request, pymongo.UpdateMany))
+            result['matched_count'] += outcome.matched_count
+            result['modified_count'] += outcome.modified_count
+            result['upserted_count'] += outcome.upserted_id is not None
+        elif isinstance(request, pymongo.ReplaceOne):
+            found = self.matching(request._filter, limit = 1)[:1]
+            for seq, doc in found:
+                replacement = clone(request._doc)
+                replacement['_id'] = doc['_id']
+                # checked before the original is removed, so a duplicate leaves it in place as MongoDB does
+                self.check_unique(replacement, seq)
+                self.remove(seq)
+                self.store(replacement)
+            if not found and request._upsert:
+                self.store(clone(request._doc))
+                result['upserted_count'] += 1
+            result['matched_count'] += len(found)
+            result['modified_count'] += len(found)
+        elif isinstance(request, (pymongo.DeleteOne, pymongo.DeleteMany)):
+            result['deleted_count'] += self.delete(request._filter, isinstance(request, pymongo.DeleteMany)).deleted_count
+        else:
+            raise NotImplementedError('bulk operation ' + type(request).__name__ + ' is not supported')
+
+    @reads
+    def create_index(self, keys, **kwargs):
+        self.round_trips += 1
+        keys = normalize_sort(keys)
+        field = keys[0][0]
+        if len(keys) == 1 and field not in self.indexes:
+            self.indexes[field] = sorted((sort_key(get_path(doc, field)), seq) for seq, doc in self.docs.items())
+        if len(keys) == 1 and kwargs.get('unique') and field not in self.unique:
+            entries = self.indexes[field]
+            for position in range(1, len(entries)):
+                if entries[position][0] == entries[position - 1][0]:
+                    raise pymongo_errors().DuplicateKeyError('cannot build unique index, duplicate ' + field + ' ' + repr(get_path(self.docs[entries[position][1]], field)), 11000)
+            self.unique.add(field)
+        if len(keys) == 1 and kwargs.get('expireAfterSeconds') is not None:
+            self.ttl[field] = kwargs['expireAfterSeconds']
+        return kwargs.get('name', '_'.join(key + '_' + str(direction) for key, direction in keys))
+
+    @reads
+    def drop_index(self, name):
+        self.round_trips += 1
+
+    @reads
+    def aggregate(self, pipeline):
+        """
+        Runs an aggregation pipeline made of $match and $group stages. $group keys may be field paths ('$field'),
+        dictionaries of them, or $dateToString expressions, and the accumulators $sum, $min and $max are supported.
+        """
+        self.round_trips += 1
+        docs = [doc for seq, doc in self.matching({})]
+        for stage in pipeline:
+            (operator, argument), = stage.items()
+            if operator == '$match':
+                docs = [doc for doc in docs if matches(doc, argument)]
+            elif operator == '$group':
+                docs = group_documents(docs, argument)
+            else:
+                raise NotImplementedError('aggregation stage ' + operator + ' is not supported')
+        return iter(docs)
+
+class MemoryDatabase:
+    """
+    In-memory stand-in for a pymongo Database: collections are created on first access, by attribute or by key.
+    """
+    def __init__(self):
+        self.collections = {}
+        self.lock = threading.Lock()
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = MemoryCollection(name)
+            return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self[name]
+
+
+@functools.lru_cache(maxsize = None)
+def json_options():
+    """
+    Returns the bson JSON options of the database file. Relaxed extended JSON keeps ints, floats and strings
+    readable while preserving datetimes and ObjectIds.
+    """
+    from bson import json_util
+    return json_util.RELAXED_JSON_OPTIONS.with_options(tz_aware = True, tzinfo = datetime.timezone.utc)
+
+class FileCollection(MemoryCollection):
+    """
+    MemoryCollection whose changes are persisted by a FileDatabase. Reads are served from memory; every write
+    operation appends the documents it changed to the database file as one line when it completes.
+    """
+    def __init__(self, name, database):
+        # The database lock covers every collection, so a commit never writes another thread's half-done operation
+        super().__init__(name, database.lock)
+        self.database = database
+        self.journal = []
+
+    def commit(self):
+        if self.journal:
+            changes = self.journal
+            self.journal = []
+            self.database.append(self.name, changes)
+
+class FileDatabase:
+    """
+    Embedded alternative to a MongoDB database, for running the bot on a single host without a cluster. All
+    collections live in memory as FileCollections and are persisted to one append-only file: every write
+    operation appends one line holding the new state of the documents it changed (or their deletion), and the
+    line is flushed, and fsynced unless disabled, before the operation returns. On open, the file is replayed;
+    a torn last line left by a crash is discarded, so an operation is either fully persisted or not at all. When
+    the file holds compact_ratio times more lines than live documents it is compacted by writing the live
+    documents to a temporary file and atomically renaming it over the original.
+
+    Attributes:
+        path (str): The database file.
+        collections (dict): The collections by name.
+    """
+    def __init__(self, path, fsync = True, compact_ratio = 4, min_compact_records = 1000):
+        """
+        Args:
+            path (str): The database file, created if missing.
+            fsync (bool): Force every write to disk. Without it a write survives a crash of the process but not of
+                the host.
+            compact_ratio (float): Compact when the file has this many times more lines than live documents.
+            min_compact_records (int): Never compact files with fewer lines than this.
+        """
+        self.path = path
+        self.fsync = fsync
+        self.compact_ratio = compact_ratio
+        self.min_compact_records = min_compact_records
+        self.collections = {}
+        self.records = 0
+        # Shared by every collection: operations, journal commits and appends are serialized
+        self.lock = threading.RLock()
+        self.load()
+        self.file = open(path, 'a', encoding = 'utf-8')
+
+    def __getitem__(self, name):
+        with self.lock:
+            if name not in self.collections:
+                self.collections[name] = FileCollection(name, self)
+            return self.collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return self[name]
+
+    def load(self):
+        """
+        Replays the database file into memory, truncating a torn last line.
+        """
+        if not os.path.exists(self.path):
+            return
+        from bson import json_util
+        good_size = 0
+        with open(self.path, 'rb') as source:
+            for line in source:
+                if not line.endswith(b'\n'):
+                    break
+                try:
+                    entry = json_util.loads(line.decode('utf-8'), json_options = json_options())
+                except ValueError:
+                    break
+                self.apply(entry)
+                self.records += 1
+                good_size += len(line)
+        if good_size < os.path.getsize(self.path):
+            with open(self.path, 'r+b') as source:
+                source.truncate(good_size)
+
+    def apply(self, entry):
+        """
+        Applies one line of the database file to the in-memory collections.
+        """
+        collection = self[entry['c']]
+        journal = collection.journal
+        collection.journal = None
+        for change in entry['ops']:
+            if 'put' in change:
+                doc = change['put']
+                seq = collection.ids.get(doc['_id'])
+                if seq is not None:
+                    collection.remove(seq)
+                collection.store(doc)
+            else:
+                seq = collection.ids.get(change['del'])
+                if seq is not None:
+                    collection.remove(seq)
+        collection.journal = journal
+
+    def write_line(self, output, name, ops):
+        from bson import json_util
+        output.write(json_util.dumps({'c': name, 'ops': ops}, json_options = json_options()) + '\n')
+
+    def append(self, name, changes):
+        """
+        Persists the changes of one write operation as a single line.
+        """
+        ops = [{'put': value} if kind == 'put' else {'del': value} for kind, value in changes]
+        with self.lock:
+            self.write_line(self.file, name, ops)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            self.records += 1
+            live = sum(len(collection.docs) for collection in self.collections.values())
+            if self.records >= self.min_compact_records and self.records > self.compact_ratio * max(live, 1):
+                self.compact()
+
+    def compact(self, batch = 1000):
+        """
+        Rewrites the database file with only the live documents, atomically replacing the old file.
+        """
+        with self.lock:
+            temporary = self.path + '.tmp'
+            records = 0
+            with open(temporary, 'w', encoding = 'utf-8') as output:
+                for name, collection in self.collections.items():
+                    docs = list(collection.docs.values())
+                    for start in range(0, len(docs), batch):
+                        self.write_line(output, name, [{'put': doc} for doc in docs[start:start + batch]])
+                        records += 1
+                output.flush()
+                os.fsync(output.fileno())
+            self.file.close()
+            os.replace(temporary, self.path)
+            directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+            self.file = open(self.path, 'a', encoding = 'utf-8')
+            self.records = records
+
+    def close(self):
+        self.file.close()
+
+def open_database(backend = 'mongo', path = 'qbase.jsonl', mongo_uri = None, database_name = 'Qbase', **options):
+    """
+    Opens the database holding the bot's collections. Both backends expose the same pymongo-style collection API
+    that q_helpers and the other helpers use, so the rest of the bot does not depend on which one is chosen.
+
+    Args:
+        backend (str): 'mongo' for the remote MongoDB cluster, 'file' for the embedded FileDatabase.
+        path (str): The database file of the 'file' backend.
+        mongo_uri (str): The connection string of the 'mongo' backend.
+        database_name (str): The MongoDB database name.
+        **options: Extra keyword arguments for pymongo.MongoClient or FileDatabase.
+
+    Returns:
+        tuple: The database and the object to close at shutdown (the MongoClient or the FileDatabase).
+    """
+    if backend == 'mongo':
+        import pymongo
+        mongo_client = pymongo.MongoClient(mongo_uri, **options)
+        return mongo_client[database_name], mongo_client
+    if backend == 'file':
+        database = FileDatabase(path, **options)
+        return database, database
+    raise ValueError('unknown storage backend ' + repr(backend) + ", expected 'mongo' or 'file'")
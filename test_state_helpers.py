@@ -0,0 +1,48 @@
+import datetime
+import numpy as np
+import pytest
+import state_helpers
+
+BANDS = [100, 1000]
+# One follower count inside every band of BANDS, and the band it falls in
+FOLLOWERS = [(0, 0), (99, 0), (100, 1), (999, 1), (1000, 2), (50000, 2)]
+
+def week_of_hours(start):
+    """
+    Returns every hour of the week starting at start, as UTC datetimes.
+    """
+    return [start + datetime.timedelta(hours = hour) for hour in range(7 * 24)]
+
+# A plain week and the week daylight saving time starts in New York
+WEEKS = [datetime.datetime(2023, 1, 2, 5, tzinfo = datetime.timezone.utc), datetime.datetime(2023, 3, 9, 5, tzinfo = datetime.timezone.utc)]
+
+def time_bucket(moment):
+    """
+    The state get_state used before the encoder: the 3-hour bucket of the hour in New York, as a string.
+    """
+    return str(moment.astimezone(state_helpers.get_timezone('America/New_York')).hour // 3)
+
+@pytest.mark.parametrize('start', WEEKS)
+def test_default_encoder_matches_time_buckets(start):
+    for moment in week_of_hours(start):
+        assert str(state_helpers.default_encoder.encode(moment)) == time_bucket(moment)
+
+@pytest.mark.parametrize('start', WEEKS)
+def test_bands_extend_time_buckets(start):
+    encoder = state_helpers.StateEncoder(follower_bands = BANDS)
+    assert encoder.n_states == 8 * 3
+    for moment in week_of_hours(start):
+        bucket = int(time_bucket(moment))
+        assert encoder.encode(moment) == bucket * 3
+        for followers, band in FOLLOWERS:
+            assert encoder.encode(moment, followers = followers) == bucket * 3 + band
+
+@pytest.mark.parametrize('start', WEEKS)
+def test_encode_many_matches_encode(start):
+    encoder = state_helpers.StateEncoder(follower_bands = BANDS)
+    moments = week_of_hours(start)
+    timestamps = np.array([moment.timestamp() for moment in moments])
+    assert list(encoder.encode_many(timestamps)) == [encoder.encode(moment) for moment in moments]
+    for followers, band in FOLLOWERS:
+        counts = np.full(len(moments), followers)
+        assert list(encoder.encode_many(timestamps, counts)) == [encoder.encode(moment, followers = followers) for moment in moments]
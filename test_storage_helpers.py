@@ -0,0 +1,113 @@
+import datetime
+import os
+import pymongo
+import pymongo.errors
+import pytest
+import storage_helpers
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / 'qbase.jsonl')
+
+def open_file(path):
+    return storage_helpers.FileDatabase(path, fsync = False)
+
+def test_replay_discards_torn_last_line(path):
+    db = open_file(path)
+    db.table.insert_one({'_id': 1, 'value': 'a'})
+    db.table.update_one({'_id': 1}, {'$set': {'value': 'b'}})
+    db.table.insert_one({'_id': 2, 'value': 'c'})
+    db.close()
+    good_size = os.path.getsize(path)
+    # a crash in the middle of an append leaves a line without its newline
+    with open(path, 'a', encoding = 'utf-8') as output:
+        output.write('{"c": "table", "ops": [{"put": {"_id": 3, "val')
+    db = open_file(path)
+    assert os.path.getsize(path) == good_size
+    assert sorted((doc['_id'], doc['value']) for doc in db.table.find({})) == [(1, 'b'), (2, 'c')]
+    db.table.insert_one({'_id': 3, 'value': 'd'})
+    db.close()
+    db = open_file(path)
+    assert db.table.count_documents({}) == 3
+    db.close()
+
+def test_replay_after_compaction(path):
+    db = storage_helpers.FileDatabase(path, fsync = False, compact_ratio = 2, min_compact_records = 10)
+    for value in range(30):
+        db.table.update_one({'_id': 'counter'}, {'$set': {'value': value}}, upsert = True)
+    db.close()
+    with open(path) as source:
+        assert len(source.readlines()) < 30
+    db = open_file(path)
+    assert db.table.find_one({'_id': 'counter'})['value'] == 29
+    db.close()
+
+def test_duplicate_id_is_rejected():
+    table = storage_helpers.MemoryCollection()
+    table.insert_one({'_id': 1})
+    with pytest.raises(pymongo.errors.DuplicateKeyError):
+        table.insert_one({'_id': 1})
+    assert table.count_documents({}) == 1
+
+def test_unique_index_rejects_insert_and_update():
+    table = storage_helpers.MemoryCollection()
+    table.create_index([('key', pymongo.ASCENDING)], unique = True)
+    table.insert_one({'_id': 1, 'key': 'a', 'value': 1})
+    table.insert_one({'_id': 2, 'key': 'b', 'value': 2})
+    with pytest.raises(pymongo.errors.DuplicateKeyError):
+        table.insert_one({'_id': 3, 'key': 'a'})
+    with pytest.raises(pymongo.errors.DuplicateKeyError):
+        table.update_one({'_id': 2}, {'$set': {'key': 'a', 'value': 3}})
+    # the failed update is rolled back, index included
+    assert table.find_one({'_id': 2}) == {'_id': 2, 'key': 'b', 'value': 2}
+    assert table.find_one({'key': 'b'}, sort = [('key', pymongo.ASCENDING)])['_id'] == 2
+
+def test_unique_index_build_fails_on_duplicates():
+    table = storage_helpers.MemoryCollection()
+    table.insert_many([{'key': 'a'}, {'key': 'a'}])
+    with pytest.raises(pymongo.errors.DuplicateKeyError):
+        table.create_index([('key', pymongo.ASCENDING)], unique = True)
+    table.insert_one({'key': 'a'})
+    assert table.count_documents({'key': 'a'}) == 3
+
+@pytest.mark.parametrize('ordered', [True, False])
+def test_bulk_write_reports_duplicates(ordered):
+    table = storage_helpers.MemoryCollection()
+    table.create_index([('key', pymongo.ASCENDING)], unique = True)
+    table.insert_one({'_id': 1, 'key': 'a'})
+    requests = [pymongo.InsertOne({'_id': 2, 'key': 'a'}), pymongo.InsertOne({'_id': 3, 'key': 'c'}), pymongo.UpdateOne({'_id': 1}, {'$set': {'value': 1}})]
+    with pytest.raises(pymongo.errors.BulkWriteError) as raised:
+        table.bulk_write(requests, ordered = ordered)
+    details = raised.value.details
+    assert [(error['index'], error['code']) for error in details['writeErrors']] == [(0, 11000)]
+    # an ordered bulk stops at the error, an unordered one applies the other operations
+    assert details['nInserted'] == (0 if ordered else 1)
+    assert details['nMatched'] == (0 if ordered else 1)
+    assert table.count_documents({}) == (1 if ordered else 2)
+
+def test_replace_keeps_original_on_duplicate():
+    table = storage_helpers.MemoryCollection()
+    table.create_index([('key', pymongo.ASCENDING)], unique = True)
+    table.insert_many([{'_id': 1, 'key': 'a'}, {'_id': 2, 'key': 'b'}])
+    with pytest.raises(pymongo.errors.BulkWriteError):
+        table.bulk_write([pymongo.ReplaceOne({'_id': 2}, {'key': 'a'})])
+    assert table.find_one({'_id': 2}) == {'_id': 2, 'key': 'b'}
+    table.bulk_write([pymongo.ReplaceOne({'_id': 2}, {'key': 'c'})])
+    assert table.find_one({'_id': 2}) == {'_id': 2, 'key': 'c'}
+
+def test_ttl_index_expires_on_next_write(path):
+    db = open_file(path)
+    db.buffer.create_index([('expires_at', pymongo.ASCENDING)], expireAfterSeconds = 0)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    db.buffer.insert_many([
+        {'_id': 'old', 'expires_at': now - datetime.timedelta(seconds = 1)},
+        {'_id': 'new', 'expires_at': now + datetime.timedelta(hours = 1)},
+        {'_id': 'undated'},
+    ])
+    db.buffer.insert_one({'_id': 'trigger'})
+    assert sorted(doc['_id'] for doc in db.buffer.find({})) == ['new', 'trigger', 'undated']
+    db.close()
+    # the expiry was persisted like any other delete
+    db = open_file(path)
+    assert db.buffer.find_one({'_id': 'old'}) is None
+    db.close()
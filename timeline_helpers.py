@@ -0,0 +1,91 @@
+import datetime
+import numpy as np
+
+PAGE_SIZE = 100
+TIMELINE_FIELDS = ['created_at', 'public_metrics']
+
+# The only fields kept from each tweet of the timeline
+RECORD_DTYPE = np.dtype([('id', np.int64), ('created_at', 'datetime64[s]'), ('likes', np.int64), ('retweets', np.int64)])
+
+def to_datetime64(value):
+    """
+    Converts a created_at value, an ISO 8601 string as returned by the API or a datetime, to a UTC datetime64.
+    """
+    if value is None:
+        return np.datetime64('NaT')
+    if isinstance(value, datetime.datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(datetime.timezone.utc).replace(tzinfo = None)
+        return np.datetime64(value, 's')
+    return np.datetime64(str(value).rstrip('Z')[:19], 's')
+
+def to_records(tweets):
+    """
+    Packs tweepy Tweets into a structured array of RECORD_DTYPE.
+    """
+    records = np.empty(len(tweets), dtype = RECORD_DTYPE)
+    for row, tweet in enumerate(tweets):
+        metrics = tweet.data['public_metrics']
+        records[row] = (int(tweet.id), to_datetime64(tweet.data.get('created_at')), int(metrics['like_count']), int(metrics['retweet_count']))
+    return records
+
+def iter_timeline(client_bearer, user_id, page_size = PAGE_SIZE, pagination_token = None, since_id = None, exclude = None, max_pages = None, raw = False, tweet_fields = TIMELINE_FIELDS):
+    """
+    Walks a user's timeline, newest first, one page at a time. Each page is reduced to a small structured array of
+    ids, creation times, like counts and retweet counts before the next one is requested, so memory use does not
+    grow with the length of the timeline.
+
+    Args:
+        client_bearer: A tweepy Client object with a bearer token.
+        user_id: The id of the user whose timeline is read.
+        page_size (int): The number of tweets per request, between 5 and 100.
+        pagination_token (str, optional): The token of the page to start from, to resume an earlier walk.
+        since_id (int, optional): Only read tweets newer than this id.
+        exclude (list, optional): Tweet types left out by the API, such as ['retweets'].
+        max_pages (int, optional): Stop after this many pages.
+        raw (bool): Yield the tweepy Tweets of each page instead of records, for callers that need fields the
+            records leave out, such as the text.
+        tweet_fields (list): The tweet fields requested with each page.
+
+    Yields:
+        tuple: (records, next_token) per page, where records is an array of RECORD_DTYPE, or the list of Tweets when
+        raw is True, and next_token the pagination token to resume from after this page, None on the last page.
+    """
+    page_size = max(5, min(int(page_size), 100))
+    pages = 0
+    while True:
+        tweets = client_bearer.get_users_tweets(id = user_id, max_results = page_size, pagination_token = pagination_token, since_id = since_id, exclude = exclude, tweet_fields = tweet_fields)
+        pages += 1
+        pagination_token = tweets.meta.get('next_token') if tweets.meta else None
+        yield (tweets.data or []) if raw else to_records(tweets.data or []), pagination_token
+        if not pagination_token or (max_pages is not None and pages >= max_pages):
+            return
+
+def scan_timeline(client_bearer, user_id, pagination_token = None, totals = None, max_pages = None):
+    """
+    Sums the likes and retweets of a user's timeline in a single pass. A scan stopped by max_pages can be resumed
+    later by passing back the returned totals, next_token included.
+
+    Args:
+        client_bearer: A tweepy Client object with a bearer token.
+        user_id: The id of the user whose timeline is read.
+        pagination_token (str, optional): The page to resume from.
+        totals (dict, optional): The totals of the pages read before pagination_token.
+        max_pages (int, optional): Stop after this many pages.
+
+    Returns:
+        dict: 'likes', 'retweets' and 'tweets' (the number of tweets read), and 'next_token', the token to resume
+        from, or None when the whole timeline was read.
+    """
+    if totals is None:
+        totals = {'likes': 0, 'retweets': 0, 'tweets': 0}
+    else:
+        pagination_token = pagination_token or totals.get('next_token')
+        totals = {'likes': totals['likes'], 'retweets': totals['retweets'], 'tweets': totals['tweets']}
+    next_token = None
+    for records, next_token in iter_timeline(client_bearer, user_id, pagination_token = pagination_token, max_pages = max_pages):
+        totals['likes'] += int(records['likes'].sum())
+        totals['retweets'] += int(records['retweets'].sum())
+        totals['tweets'] += len(records)
+    totals['next_token'] = next_token
+    return totals
@@ -0,0 +1,112 @@
+import datetime
+import threading
+import openai_helpers
+
+class TweetBuffer:
+    """
+    Persistent buffer of generated tweets waiting to be posted, stored in a MongoDB collection and partitioned by
+    model and prompt. Tweets are generated in batches with one completion request each, so a tweet action only pops
+    a ready tweet. When a partition drops below low_water tweets it is refilled on a background thread. Tweets
+    expire after ttl_hours through a TTL index. With a duplicate index, generated tweets that repeat a posted or
+    buffered tweet are dropped before they enter the buffer.
+
+    Attributes:
+        collection (pymongo.collection.Collection): The MongoDB collection holding the buffered tweets.
+        generated_count (int): The number of completion requests made so far.
+    """
+    def __init__(self, collection, api_key, low_water = 5, batch_size = 10, ttl_hours = 48, duplicate_index = None):
+        """
+        Args:
+            collection (pymongo.collection.Collection): The MongoDB collection holding the buffered tweets.
+            api_key (str): The OpenAI API key.
+            low_water (int): Refill a partition when it holds fewer tweets than this.
+            batch_size (int): The number of tweets generated per completion request.
+            ttl_hours (float): The number of hours a buffered tweet stays usable.
+            duplicate_index (dedup_helpers.DuplicateIndex, optional): Index of the posted tweets, used to keep
+                near-duplicates out of the buffer.
+        """
+        self.collection = collection
+        self.api_key = api_key
+        self.low_water = low_water
+        self.batch_size = batch_size
+        self.ttl_hours = ttl_hours
+        self.duplicate_index = duplicate_index
+        self.generated_count = 0
+        self.refills = {}
+        self.lock = threading.Lock()
+        collection.create_index([('expires_at', 1)], expireAfterSeconds = 0)
+        collection.create_index([('model', 1), ('prompt', 1), ('created_at', 1)])
+
+    def partition(self, model_engine, prompt):
+        """
+        Returns the filter selecting the unexpired tweets of a partition.
+        """
+        now = datetime.datetime.now(datetime.timezone.utc)
+        return {'model': model_engine, 'prompt': prompt, 'expires_at': {'$gt': now}}
+
+    def count(self, model_engine, prompt):
+        """
+        Returns the number of usable tweets buffered for a model and prompt.
+        """
+        return self.collection.count_documents(self.partition(model_engine, prompt))
+
+    def refill(self, model_engine, prompt):
+        """
+        Generates one batch of tweets for a model and prompt and adds it to the buffer, leaving out near-duplicates
+        of posted tweets, of buffered ones and of each other when a duplicate index was given.
+
+        Returns:
+            int: The number of tweets added.
+        """
+        tweets = openai_helpers.generate_tweets(self.api_key, model_engine, prompt, self.batch_size)
+        self.generated_count += 1
+        if self.duplicate_index is not None:
+            buffered = [doc['text'] for doc in self.collection.find(self.partition(model_engine, prompt), {'_id': 0, 'text': 1})]
+            tweets = self.duplicate_index.unique([tweet for tweet in tweets if tweet], buffered)
+        now = datetime.datetime.now(datetime.timezone.utc)
+        expires_at = now + datetime.timedelta(hours = self.ttl_hours)
+        docs = [{'model': model_engine, 'prompt': prompt, 'text': tweet, 'created_at': now, 'expires_at': expires_at} for tweet in tweets if tweet]
+        if docs:
+            self.collection.insert_many(docs)
+        return len(docs)
+
+    def refill_async(self, model_engine, prompt):
+        """
+        Starts a background refill of a partition unless one is already running.
+        """
+        key = (model_engine, prompt)
+        with self.lock:
+            running = self.refills.get(key)
+            if running is not None and running.is_alive():
+                return
+            thread = threading.Thread(target = self.refill, args = key, daemon = True)
+            self.refills[key] = thread
+            thread.start()
+
+    def pop(self, model_engine, prompt):
+        """
+        Removes and returns the oldest usable tweet of a partition. If the partition is empty a batch is generated
+        on the spot; if it is running low a background refill is started.
+
+        Returns:
+            str: The tweet text, or None if every generated tweet was a duplicate.
+        """
+        doc = self.collection.find_one_and_delete(self.partition(model_engine, prompt), sort = [('created_at', 1)])
+        if doc is None:
+            self.wait()
+            self.refill(model_engine, prompt)
+            doc = self.collection.find_one_and_delete(self.partition(model_engine, prompt), sort = [('created_at', 1)])
+            if doc is None:
+                return None
+        if self.count(model_engine, prompt) < self.low_water:
+            self.refill_async(model_engine, prompt)
+        return doc['text']
+
+    def wait(self):
+        """
+        Waits for running background refills to finish.
+        """
+        with self.lock:
+            threads = list(self.refills.values())
+        for thread in threads:
+            thread.join()
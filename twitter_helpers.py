@@ -1,11 +1,5 @@
-import tweepy
-
-import os
-import dotenv
-from dotenv import load_dotenv
 import random
-
-load_dotenv()
+import timeline_helpers
 
 
 def generate_client(consumer_key = None, consumer_secret = None, access_token = None, access_token_secret = None, bt_present = False, bearer_token = None):
@@ -30,6 +24,7 @@ def generate_client(consumer_key = None, consumer_secret = None, access_token =
         - If bt_present is False, then the consumer_key, consumer_secret, access_token, and access_token_secret
         parameters are required, and the bearer_token parameter will be ignored.
     """
+    import tweepy
     if(bt_present):
         client = tweepy.Client(bearer_token = bearer_token)
     else:
@@ -38,7 +33,7 @@ def generate_client(consumer_key = None, consumer_secret = None, access_token =
     return client
 
 
-def send_tweet(client: tweepy.Client, tweet:str):
+def send_tweet(client: 'tweepy.Client', tweet:str):
     """
     Sends a tweet using the specified Twitter API client.
 
@@ -66,7 +61,37 @@ def get_tweets(client_bearer, query):
     tweets = client_bearer.search_recent_tweets(query = query, tweet_fields = ['context_annotations','author_id', 'public_metrics'])
     return tweets
 
-def like_motavational_tweet(client, client_bearer,query):
+def select_tweet(client_bearer, query, kind, candidate_pool = None, follow_index = None):
+    """
+    Picks a random tweet matching the query for the given action.
+
+    Parameters:
+        client_bearer (tweepy.Client): A bearer token-authenticated Tweepy client.
+        query (str): The search query for which to retrieve recent tweets.
+        kind (str): The action the tweet is selected for: 'like', 'retweet' or 'follow'.
+        candidate_pool (candidate_helpers.CandidatePool, optional): A pool of already searched tweets. When given,
+            the tweet is served from the pool, which skips tweets and authors that were already acted on, instead
+            of running a new search.
+        follow_index (follow_graph_helpers.FollowIndex, optional): Accounts already followed or attempted. For a
+            follow, tweets by these authors are skipped.
+
+    Returns:
+        tweepy.Tweet: The selected tweet, or None if no usable tweet was found.
+    """
+    if candidate_pool is not None:
+        return candidate_pool.take(query, kind, follow_index)
+    tweets = get_tweets(client_bearer,query)
+    candidates = tweets.data or []
+    if kind == 'follow' and follow_index is not None:
+        candidates = follow_index.filter_authors(candidates)
+    if not candidates:
+        return None
+    num_tweets = len(candidates)
+    selected_index = random.randrange(0,num_tweets)
+    selected_tweet = candidates[selected_index]
+    return selected_tweet
+
+def like_motavational_tweet(client, client_bearer,query, candidate_pool = None, selected_tweet = None):
     """
     Likes a motivational tweet from a given query using the Twitter API.
 
@@ -74,9 +99,11 @@ def like_motavational_tweet(client, client_bearer,query):
     - client: A Twitter API client object for making API requests.
     - client_bearer: A bearer token for the Twitter API authentication.
     - query: A string representing the query to search for tweets.
+    - candidate_pool: An optional candidate_helpers.CandidatePool that serves the tweet instead of a new search.
+    - selected_tweet: An optional tweet already chosen with select_tweet, liked without another selection.
 
     Returns:
-    - A like object representing the successful like action.
+    - A like object representing the successful like action, or None if no tweet was found.
 
     This function first uses the `get_tweets()` function to retrieve a list of tweets from the given query.
     It then selects a random tweet from the list and likes it using the `client.like()` method. The function 
@@ -84,14 +111,14 @@ def like_motavational_tweet(client, client_bearer,query):
 
     Note: The `get_tweets()` function should be defined separately to retrieve tweets based on a given query.
     """
-    tweets = get_tweets(client_bearer,query)
-    num_tweets = len(tweets.data)
-    selected_index = random.randrange(0,num_tweets)
-    selected_tweet = tweets.data[selected_index]
+    if selected_tweet is None:
+        selected_tweet = select_tweet(client_bearer, query, 'like', candidate_pool)
+    if selected_tweet is None:
+        return None
     like = client.like(tweet_id = selected_tweet.id)
     return like
 
-def retweet_motavational_tweet(client, client_bearer,query):
+def retweet_motavational_tweet(client, client_bearer,query, candidate_pool = None, selected_tweet = None):
     """
     Retrieves a random tweet containing a given query from the Twitter API using the specified client bearer token, and then retweets it using the specified client. Returns the retweet object if successful, or raises a Tweepy error if unsuccessful.
 
@@ -99,22 +126,24 @@ def retweet_motavational_tweet(client, client_bearer,query):
         client: A Tweepy client object that the retweet will be made on.
         client_bearer: A string representing the Twitter API bearer token to use for authentication.
         query: A string representing the query to search for in the tweets.
+        candidate_pool: An optional candidate_helpers.CandidatePool that serves the tweet instead of a new search.
+        selected_tweet: An optional tweet already chosen with select_tweet, retweeted without another selection.
 
     Returns:
-        A Tweepy retweet object if the retweet was successful, otherwise a Tweepy error is raised.
+        A Tweepy retweet object if the retweet was successful, None if no tweet was found, otherwise a Tweepy error is raised.
 
     Raises:
         Tweepy error: If the retweet was unsuccessful for any reason.
     """
 
-    tweets = get_tweets(client_bearer,query)
-    num_tweets = len(tweets.data)
-    selected_index = random.randrange(0,num_tweets)
-    selected_tweet = tweets.data[selected_index]
+    if selected_tweet is None:
+        selected_tweet = select_tweet(client_bearer, query, 'retweet', candidate_pool)
+    if selected_tweet is None:
+        return None
     retweet = client.retweet(tweet_id = selected_tweet.id)
     return retweet
 
-def follow_account(client, client_bearer,query):
+def follow_account(client, client_bearer,query, candidate_pool = None, follow_index = None, selected_tweet = None):
     """
     Follows a random user who has tweeted using the given query term.
 
@@ -122,17 +151,25 @@ def follow_account(client, client_bearer,query):
         client: A tweepy Client object representing the authenticated Twitter API client.
         client_bearer: A string representing the bearer token used to authenticate the Twitter API client.
         query: A string representing the search term to be used to find relevant tweets.
+        candidate_pool: An optional candidate_helpers.CandidatePool that serves the tweet instead of a new search.
+        follow_index: An optional follow_graph_helpers.FollowIndex of accounts already followed or attempted. Their
+            tweets are skipped, and the followed author is added to it.
+        selected_tweet: An optional tweet already chosen with select_tweet, whose author is followed without
+            another selection.
 
     Returns:
-        A tweepy Follow object representing the newly created follow relationship.
+        A tweepy Follow object representing the newly created follow relationship, or None if no tweet by an
+        account not followed yet was found.
     """
 
-    tweets = get_tweets(client_bearer,query)
-    num_tweets = len(tweets.data)
-    selected_index = random.randrange(0,num_tweets)
-    selected_tweet = tweets.data[selected_index]
+    if selected_tweet is None:
+        selected_tweet = select_tweet(client_bearer, query, 'follow', candidate_pool, follow_index)
+    if selected_tweet is None:
+        return None
     tweet_author = selected_tweet.author_id
     follow = client.follow_user(target_user_id = tweet_author)
+    if follow_index is not None:
+        follow_index.add(tweet_author)
     return follow
 
 def get_user(client_bearer, username):
@@ -175,19 +212,7 @@ def get_total_likes(client_bearer, username):
     Returns:
     - Total number of likes received by the user's tweets (integer)
     """
-    like_count = 0
-    user = get_user(client_bearer, username)
-    user_id = user.data.data['id']
-    tweet_count = user.data.data['public_metrics']['tweet_count']
-    if tweet_count < 5:
-        tweets = client_bearer.get_users_tweets(id = user_id, max_results = 5, tweet_fields = ['context_annotations','author_id', 'public_metrics'], exclude = ['retweets'])
-        for tweet in tweets.data:
-            like_count += int(tweet.data['public_metrics']['like_count'])
-    else:
-        tweets = client_bearer.get_users_tweets(id = user_id, max_results = tweet_count, tweet_fields = ['context_annotations','author_id', 'public_metrics'])
-        for tweet in tweets.data:
-            like_count += int(tweet.data['public_metrics']['like_count'])
-    return like_count
+    return get_total_lr(client_bearer, username)['likes']
 
 def get_total_retweets(client_bearer, username):
     """
@@ -207,24 +232,16 @@ def get_total_retweets(client_bearer, username):
     retweet_count : int
         The total number of retweets for all tweets posted by the user.
     """
-    retweet_count = 0
-    user = get_user(client_bearer, username)
-    user_id = user.data.data['id']
-    tweet_count = user.data.data['public_metrics']['tweet_count']
-    if tweet_count < 5:
-        tweets = client_bearer.get_users_tweets(id = user_id, max_results = 5, tweet_fields = ['context_annotations','author_id', 'public_metrics'], exclude = ['retweets'])
-        for tweet in tweets.data:
-            retweet_count += int(tweet.data['public_metrics']['retweet_count'])
-    else:
-        tweets = client_bearer.get_users_tweets(id = user_id, max_results = tweet_count, tweet_fields = ['context_annotations','author_id', 'public_metrics'])
-        for tweet in tweets.data:
-            retweet_count += int(tweet.data['public_metrics']['retweet_count'])
-    return retweet_count
+    return get_total_lr(client_bearer, username)['retweets']
 
 def get_total_lr(client_bearer, username):
     """
     Retrieve the total number of likes and retweets of a given user's tweets.
 
+    The timeline is read page by page with timeline_helpers.scan_timeline, which follows the pagination tokens
+    and keeps only the counts of each page, so the like and retweet totals come from a single pass whatever the
+    size of the account. The API serves at most the 3200 most recent tweets of a timeline.
+
     Args:
     - client_bearer: An instance of the tweepy.ClientBearer class authorized with a bearer token.
     - username: A string representing the username of the target user.
@@ -232,28 +249,8 @@ def get_total_lr(client_bearer, username):
     Returns:
     A dictionary with two keys: 'likes' and 'retweets', each holding the respective count of the target user's likes and retweets.
     """
-    like_count = 0
-    retweet_count = 0
     user = get_user(client_bearer, username)
     user_id = user.data.data['id']
-    tweet_count = user.data.data['public_metrics']['tweet_count']
-    if tweet_count < 5:
-        tweets = client_bearer.get_users_tweets(id = user_id, max_results = 5, tweet_fields = ['context_annotations','author_id', 'public_metrics'], exclude = ['retweets'])
-        if(tweets.data):
-            for tweet in tweets.data:
-                like_count += int(tweet.data['public_metrics']['like_count'])
-                retweet_count += int(tweet.data['public_metrics']['retweet_count'])
-        else:
-            like_count += 0 
-            retweet_count += 0
-    else:
-        tweets = client_bearer.get_users_tweets(id = user_id, max_results = tweet_count, tweet_fields = ['context_annotations','author_id', 'public_metrics'])
-        if(tweets.data):
-            for tweet in tweets.data:
-                like_count += int(tweet.data['public_metrics']['like_count'])
-                retweet_count += int(tweet.data['public_metrics']['retweet_count'])
-        else:
-            like_count += 0 
-            retweet_count += 0
-    total_counts = {'likes': like_count, 'retweets': retweet_count}
-    return total_counts 
\ No newline at end of file
+    totals = timeline_helpers.scan_timeline(client_bearer, user_id)
+    total_counts = {'likes': totals['likes'], 'retweets': totals['retweets']}
+    return total_counts